@@ -0,0 +1,117 @@
+# /////////////////
+# Lambdaコールドスタートのベンチマーク
+# /////////////////
+# 1. python -X importtime で app_lambda のimport時間と重いモジュールを計測する
+# 2. 新しいプロセスでハンドラー初期化(シークレット取得 + YouTubeサービス生成)の
+#    コールド/ウォーム時間を FAST_START の有無で比較する
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_cold_start.py --secret-latency 0.15
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+MODULE = "src.lambda_func.app_lambda"
+
+
+def parse_importtime(stderr, top=10):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    total = next((c for name, _, c in rows if name == MODULE), None)
+    heaviest = sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+    return total, [{"module": n, "self_ms": round(s / 1000, 1)} for n, s, _ in heaviest]
+
+
+def measure_importtime(fast_start):
+    env = {**os.environ, "FAST_START": "true" if fast_start else "false"}
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall = time.perf_counter() - started
+    total_us, heaviest = parse_importtime(result.stderr)
+
+    return {
+        "benchmark": "cold_start_import",
+        "fast_start": fast_start,
+        "import_ms": round(total_us / 1000, 1) if total_us else None,
+        "process_wall_ms": round(wall * 1000, 1),
+        "heaviest_self": heaviest,
+    }
+
+
+# 子プロセス側: ハンドラー初期化と同じ順序でシークレット取得→サービス生成を行う
+def run_handler_init(secret_latency):
+    started = time.perf_counter()
+    from src.lambda_func import app_lambda
+
+    imported = time.perf_counter()
+
+    # Secrets Managerへの往復の代わりにI/O待ちを模擬する
+    time.sleep(secret_latency)
+    app_lambda.get_youtube_service("BENCHMARK_API_KEY")
+    cold_init = time.perf_counter()
+
+    app_lambda.get_youtube_service("BENCHMARK_API_KEY")
+    warm_init = time.perf_counter()
+
+    print(
+        json.dumps(
+            {
+                "import_ms": round((imported - started) * 1000, 1),
+                "cold_init_ms": round((cold_init - imported) * 1000, 1),
+                "warm_init_ms": round((warm_init - cold_init) * 1000, 3),
+                "cold_total_ms": round((cold_init - started) * 1000, 1),
+            }
+        )
+    )
+
+
+def measure_handler_init(fast_start, secret_latency):
+    env = {**os.environ, "FAST_START": "true" if fast_start else "false"}
+    result = subprocess.run(
+        [sys.executable, __file__, "--child", "--secret-latency", str(secret_latency)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return {
+        "benchmark": "cold_start_handler_init",
+        "fast_start": fast_start,
+        "secret_latency_ms": secret_latency * 1000,
+        **timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--secret-latency", type=float, default=0.15)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        run_handler_init(args.secret_latency)
+        return
+
+    for fast_start in (False, True):
+        print(json.dumps(measure_importtime(fast_start), ensure_ascii=False))
+        for _ in range(args.repeat):
+            print(json.dumps(measure_handler_init(fast_start, args.secret_latency)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# /////////////////
+# 小ファイル統合(glue_compaction)のベンチマーク
+# /////////////////
+# 1チャンネル分のワークフロー(週1回の実行を想定)ごとの processed_video を模した小さなParquetを
+# moto(インプロセスのS3)上に作成し、統合前後で
+#   - 一覧取得: 対象ファイルの一覧に必要なLIST回数・時間
+#   - スキャン: 全ファイルを開いて全行を読む時間(GET回数)
+# を比較する。S3の実際のレイテンシは含まないため、時間よりもリクエスト数の差に注目する。
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_compaction.py --workflows 52 --files-per-workflow 8
+import argparse
+import io
+import time
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from moto import mock_aws
+
+from src.glue.glue_compaction import (
+    compact_table,
+    list_objects,
+    list_prefixes,
+    manifest_files,
+    read_parquet,
+)
+
+BUCKET = "bench-data-lake"
+CHANNEL_PREFIX = "channel=UCbench/"
+
+
+def synthetic_part(rows, offset):
+    return pa.table(
+        {
+            "video_id": [f"v{offset + i:08d}" for i in range(rows)],
+            "title": [f"title {offset + i}" for i in range(rows)],
+            "view_count": list(range(rows)),
+            "like_count": list(range(rows)),
+        }
+    )
+
+
+def populate(s3, workflows, files_per_workflow, rows_per_file):
+    for workflow in range(workflows):
+        prefix = f"{CHANNEL_PREFIX}workflow=wf{workflow:04d}/processed_data/processed_video/"
+        for index in range(files_per_workflow):
+            buffer = io.BytesIO()
+            pq.write_table(synthetic_part(rows_per_file, index * rows_per_file), buffer)
+            s3.put_object(Bucket=BUCKET, Key=f"{prefix}part-{index:05d}.parquet", Body=buffer.getvalue())
+        s3.put_object(Bucket=BUCKET, Key=f"{prefix}_SUCCESS", Body=b"")
+
+
+def list_before(s3):
+    keys = []
+    for workflow_prefix in list_prefixes(s3, BUCKET, f"{CHANNEL_PREFIX}workflow="):
+        keys.extend(
+            obj["Key"]
+            for obj in list_objects(s3, BUCKET, f"{workflow_prefix}processed_data/processed_video/")
+            if obj["Key"].endswith(".parquet")
+        )
+    return keys
+
+
+def list_after(s3):
+    return manifest_files(s3, BUCKET, CHANNEL_PREFIX, "video")
+
+
+def measure(s3, list_keys):
+    requests = []
+
+    def count(**kwargs):
+        requests.append(kwargs["event_name"])
+
+    s3.meta.events.register("before-call.s3", count)
+
+    started = time.perf_counter()
+    keys = list_keys(s3)
+    list_seconds = time.perf_counter() - started
+    list_requests = len(requests)
+
+    started = time.perf_counter()
+    rows = sum(read_parquet(s3, BUCKET, key).num_rows for key in keys)
+    scan_seconds = time.perf_counter() - started
+    scan_requests = len(requests) - list_requests
+
+    s3.meta.events.unregister("before-call.s3", count)
+    return len(keys), rows, list_requests, list_seconds, scan_requests, scan_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workflows", type=int, default=52)
+    parser.add_argument("--files-per-workflow", type=int, default=8)
+    parser.add_argument("--rows-per-file", type=int, default=300)
+    args = parser.parse_args()
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="ap-northeast-1")
+        s3.create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"}
+        )
+        populate(s3, args.workflows, args.files_per_workflow, args.rows_per_file)
+
+        print(f"{'state':>8} {'files':>6} {'rows':>9} {'list_req':>9} {'list(s)':>8} {'scan_req':>9} {'scan(s)':>8}")
+        for state, list_keys in (("before", list_before), ("after", list_after)):
+            if state == "after":
+                started = time.perf_counter()
+                compact_table(
+                    s3, BUCKET, CHANNEL_PREFIX, "video",
+                    now=datetime.now(timezone.utc) + timedelta(days=1),
+                )
+                print(f"compaction: {time.perf_counter() - started:.2f}s")
+            files, rows, list_requests, list_seconds, scan_requests, scan_seconds = measure(s3, list_keys)
+            print(
+                f"{state:>8} {files:>6} {rows:>9} {list_requests:>9} {list_seconds:>8.3f} {scan_requests:>9} {scan_seconds:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# /////////////////
+# DQルール評価(glue_dq)のベンチマーク
+# /////////////////
+# videoのルールセットについて、ルールごとに集計を実行する方式(ルール数だけ入力を走査する)と、
+# すべてのルールを1回の集計で評価する glue_dq.evaluate_rules の時間を比較する。
+# (Glue Data QualityはGlueの実行環境にのみ存在するため、ここでは比較対象に含めない)
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_glue_dq.py --rows 1000000
+# (Java 17が必要。JAVA_HOMEを設定して実行する)
+import argparse
+import os
+import tempfile
+import time
+
+from pyspark.sql import SparkSession
+
+from benchmarks.bench_glue_transforms import synthetic_videos
+from src.glue.glue_dq import RULESETS, evaluate_rules
+from src.glue.glue_transforms import read_raw, transform_video, video_schema
+
+
+def evaluate_per_rule(df, rules):
+    # ルールごとに1回ずつ集計する(従来の評価方式に相当)
+    return [evaluate_rules(df, [rule])[0] for rule in rules]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--master", default="local[4]")
+    args = parser.parse_args()
+
+    spark = (
+        SparkSession.builder.master(args.master)
+        .appName("bench_glue_dq")
+        .config("spark.ui.enabled", "false")
+        .config("spark.ui.showConsoleProgress", "false")
+        .config("spark.sql.shuffle.partitions", str(args.partitions))
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+
+    rules = RULESETS["video"]
+    with tempfile.TemporaryDirectory() as work_dir:
+        raw_path = os.path.join(work_dir, "raw_video")
+        synthetic_videos(spark, args.rows, args.partitions).write.json(raw_path)
+        df = transform_video(read_raw(spark, video_schema, raw_path))
+
+        print(f"{'rows':>10} {'method':>10} {'best(s)':>8}")
+        for method, evaluate in (("per_rule", evaluate_per_rule), ("single", evaluate_rules)):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                evaluate(df, rules)
+                timings.append(time.perf_counter() - started)
+            print(f"{args.rows:>10} {method:>10} {min(timings):>8.2f}")
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# /////////////////
+# 加工済みデータの永続化方式ごとのベンチマーク
+# /////////////////
+# Glueジョブと同様に、加工済みのvideoデータに対して複数の出力(DQ相当の集計、
+# S3出力・BigQuery出力相当の書き込み)を実行し、永続化方式ごとの合計時間を比較する。
+# 生データはローカルのNDJSONから読み込む(永続化しない場合は出力のたびに読み込みからやり直す)。
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_glue_materialize.py --rows 1000000
+# (Java 17が必要。JAVA_HOMEを設定して実行する)
+import argparse
+import os
+import tempfile
+import time
+
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+from benchmarks.bench_glue_transforms import synthetic_videos
+from src.glue.glue_transforms import materialize, read_raw, release, transform_video, video_schema
+
+MODES = ["none", "persist", "local_checkpoint", "checkpoint"]
+
+
+def run_sinks(df):
+    # DQ相当(完全性・一意性の集計と、失敗ルールの取得)
+    df.agg(
+        F.count("video_id"), F.countDistinct("video_id"), F.count("total_seconds")
+    ).collect()
+    df.filter(F.col("total_seconds").isNull()).limit(10).collect()
+    # S3出力・BigQuery出力相当
+    df.write.format("noop").mode("overwrite").save()
+    df.write.format("noop").mode("overwrite").save()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--master", default="local[4]")
+    args = parser.parse_args()
+
+    spark = (
+        SparkSession.builder.master(args.master)
+        .appName("bench_glue_materialize")
+        .config("spark.ui.enabled", "false")
+        .config("spark.ui.showConsoleProgress", "false")
+        .config("spark.sql.shuffle.partitions", str(args.partitions))
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        raw_path = os.path.join(work_dir, "raw_video")
+        synthetic_videos(spark, args.rows, args.partitions).write.json(raw_path)
+
+        print(f"{'rows':>10} {'mode':>17} {'materialize(s)':>15} {'sinks(s)':>9} {'total(s)':>9}")
+        for mode in MODES:
+            df = transform_video(read_raw(spark, video_schema, raw_path))
+
+            started = time.perf_counter()
+            df = materialize(df, mode=mode, checkpoint_dir=os.path.join(work_dir, "checkpoints"))
+            materialize_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            run_sinks(df)
+            sink_seconds = time.perf_counter() - started
+            release(df)
+
+            print(
+                f"{args.rows:>10} {mode:>17} {materialize_seconds:>15.2f} {sink_seconds:>9.2f} {materialize_seconds + sink_seconds:>9.2f}"
+            )
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
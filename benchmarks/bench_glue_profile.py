@@ -0,0 +1,82 @@
+# /////////////////
+# 実行プロファイル(glue_profile)のベンチマーク
+# /////////////////
+# 小・中・大規模の合成チャンネル(video)について、Sparkの既定設定と
+# 入力データ量から選択した実行プロファイルで、読み込み→加工→Parquet出力の時間と
+# 出力ファイル数を比較する。
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_glue_profile.py --sizes 300 100000 1000000
+# (Java 17が必要。JAVA_HOMEを設定して実行する)
+import argparse
+import os
+import tempfile
+import time
+
+from pyspark.sql import SparkSession
+
+from benchmarks.bench_glue_transforms import synthetic_videos
+from src.glue.glue_profile import apply_profile, choose_profile, coalesce_for_output, input_size_bytes
+from src.glue.glue_transforms import read_raw, transform_video, video_schema
+
+# Sparkの既定値(プロファイル適用前の状態に戻すために使用する)
+SPARK_DEFAULTS = {
+    "spark.sql.shuffle.partitions": "200",
+    "spark.sql.adaptive.enabled": "true",
+    "spark.sql.adaptive.coalescePartitions.enabled": "true",
+    "spark.sql.adaptive.advisoryPartitionSizeInBytes": str(64 * 1024 * 1024),
+    "spark.sql.autoBroadcastJoinThreshold": str(10 * 1024 * 1024),
+}
+
+
+def run_pipeline(spark, raw_path, output_path, profile):
+    df = transform_video(read_raw(spark, video_schema, raw_path))
+    coalesce_for_output(df, profile, "video").write.mode("overwrite").parquet(output_path)
+    return len([name for name in os.listdir(output_path) if name.endswith(".parquet")])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[300, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--master", default="local[4]")
+    args = parser.parse_args()
+
+    spark = (
+        SparkSession.builder.master(args.master)
+        .appName("bench_glue_profile")
+        .config("spark.ui.enabled", "false")
+        .config("spark.ui.showConsoleProgress", "false")
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+
+    print(f"{'videos':>9} {'setting':>16} {'best(s)':>8} {'files':>6}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            raw_path = os.path.join(work_dir, f"raw_{size}")
+            synthetic_videos(spark, size, 4).write.json(raw_path)
+
+            profile = choose_profile(
+                {"video": input_size_bytes(raw_path)}, {"video": raw_path}
+            )
+            for setting, selected in (("spark_default", None), (f"profile:{profile['name']}", profile)):
+                for key, value in SPARK_DEFAULTS.items():
+                    spark.conf.set(key, value)
+                if selected is not None:
+                    apply_profile(spark, selected)
+
+                output_path = os.path.join(work_dir, f"out_{size}")
+                run_pipeline(spark, raw_path, output_path, selected)  # ウォームアップ
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    file_count = run_pipeline(spark, raw_path, output_path, selected)
+                    timings.append(time.perf_counter() - started)
+
+                print(f"{size:>9} {setting:>16} {min(timings):>8.2f} {file_count:>6}")
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# /////////////////
+# Glue加工処理(glue_transforms)のベンチマーク
+# /////////////////
+# 合成データ(Spark上で生成)に対して各加工処理を単独で実行し、処理時間を計測する。
+# 結果は noop シンクへ書き出して、読み込み・出力のコストを除いた変換のみを計測する。
+# durationの変換は、従来の regexp_extract 3回の実装(legacy)と比較する。
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_glue_transforms.py --rows 10000 1000000 10000000
+# (Java 17が必要。JAVA_HOMEを設定して実行する)
+import argparse
+import time
+
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.types import LongType
+
+from src.glue.glue_transforms import (
+    add_total_seconds,
+    cast_timestamps,
+    dedup_latest,
+    drop_nulls,
+    transform_video,
+)
+
+
+# 従来の実装(時・分・秒をそれぞれ正規表現で抽出し、日・週は無視する)
+def legacy_add_total_seconds(df):
+    def extract(unit):
+        return F.coalesce(
+            F.regexp_extract(F.col("duration"), rf"(\d+){unit}", 1).cast(LongType()), F.lit(0)
+        )
+
+    return df.withColumn(
+        "total_seconds", extract("H") * 3600 + extract("M") * 60 + extract("S")
+    )
+
+
+# video_schema と同じ列を持つ合成データ(約10%が重複、約1%が欠損)
+def synthetic_videos(spark, rows, partitions):
+    return (
+        spark.range(rows, numPartitions=partitions)
+        .select(
+            F.when(F.col("id") % 100 == 0, F.lit(None))
+            .otherwise(F.concat(F.lit("vid"), (F.col("id") % (rows * 9 // 10 + 1)).cast("string")))
+            .alias("video_id"),
+            F.concat(F.lit("テスト動画 #"), F.col("id").cast("string")).alias("title"),
+            F.date_format(
+                F.timestamp_seconds(F.lit(1_600_000_000) + F.col("id") * 37 % 100_000_000),
+                "yyyy-MM-dd'T'HH:mm:ss'Z'",
+            ).alias("published_at"),
+            (F.col("id") * 7919 % 10_000_000).alias("view_count"),
+            (F.col("id") % 5000).alias("like_count"),
+            (F.col("id") % 300).alias("comment_count"),
+            F.when(F.col("id") % 50 == 0, F.concat(F.lit("P1DT"), (F.col("id") % 24).cast("string"), F.lit("H")))
+            .otherwise(
+                F.concat(
+                    F.lit("PT"),
+                    (F.col("id") % 3).cast("string"),
+                    F.lit("H"),
+                    (F.col("id") % 60).cast("string"),
+                    F.lit("M"),
+                    (F.col("id") % 59).cast("string"),
+                    F.lit("S"),
+                )
+            )
+            .alias("duration"),
+            F.lit("music,official,live").alias("tags"),
+        )
+    )
+
+
+TRANSFORMS = [
+    ("cast_timestamps", lambda df: cast_timestamps(df)),
+    ("duration_legacy", legacy_add_total_seconds),
+    ("duration", add_total_seconds),
+    ("drop_nulls", lambda df: drop_nulls(df, ["video_id", "published_at"])),
+    ("dedup_latest", lambda df: dedup_latest(df, "video_id")),
+    ("transform_video", transform_video),
+]
+
+
+def run(df):
+    df.write.format("noop").mode("overwrite").save()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--master", default="local[4]")
+    args = parser.parse_args()
+
+    spark = (
+        SparkSession.builder.master(args.master)
+        .appName("bench_glue_transforms")
+        .config("spark.ui.enabled", "false")
+        .config("spark.ui.showConsoleProgress", "false")
+        .config("spark.sql.shuffle.partitions", str(args.partitions))
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+
+    print(f"{'rows':>10} {'transform':>16} {'best(s)':>8} {'rows/s':>12}")
+    for rows in args.rows:
+        # 合成データはキャッシュし、生成コストを計測から除く
+        source = synthetic_videos(spark, rows, args.partitions).cache()
+        source.count()
+
+        baseline = None
+        for name, transform in [("scan", lambda df: df)] + TRANSFORMS:
+            run(transform(source))  # ウォームアップ
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                run(transform(source))
+                timings.append(time.perf_counter() - started)
+
+            best = min(timings)
+            if name == "scan":
+                baseline = best
+            print(f"{rows:>10} {name:>16} {best:>8.3f} {rows / max(best, 1e-9):>12,.0f}")
+
+        print(f"{rows:>10} {'(scan baseline)':>16} {baseline:>8.3f}")
+        source.unpersist()
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# /////////////////
+# 生データ形式(NDJSON / gzip NDJSON / Parquet)の比較ベンチマーク
+# /////////////////
+# Lambda側の書き込み時間・ファイルサイズと、Glueジョブと同じスキーマ指定での
+# Spark(ローカル)の読み込み+集計時間を比較する。
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_raw_format_read.py --videos 100000 500000
+# (Java 17が必要。JAVA_HOMEを設定して実行する)
+import argparse
+import os
+import tempfile
+import time
+
+from src.lambda_func.s3_writer import open_raw_writer, raw_object_key
+
+FORMATS = [("json", None), ("json", "gzip"), ("parquet", None)]
+
+
+# 受け取ったデータをローカルファイルへ書き出すS3クライアント
+class LocalFileS3:
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._files = {}
+
+    def _path(self, key):
+        path = os.path.join(self.base_dir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def put_object(self, Body, Key, **kwargs):
+        with open(self._path(Key), "wb") as f:
+            f.write(Body)
+
+    def create_multipart_upload(self, Key, **kwargs):
+        self._files[Key] = open(self._path(Key), "wb")
+        return {"UploadId": Key}
+
+    def upload_part(self, Body, Key, PartNumber, **kwargs):
+        self._files[Key].write(Body)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Key, **kwargs):
+        self._files.pop(Key).close()
+
+    def abort_multipart_upload(self, Key, **kwargs):
+        self._files.pop(Key).close()
+
+
+def make_videos(count):
+    for i in range(count):
+        yield {
+            "video_id": f"vid{i:08d}",
+            "title": f"テスト動画 #{i} 公式ミュージックビデオ",
+            "published_at": f"2024-{i % 12 + 1:02d}-01T00:00:00Z",
+            "view_count": i * 37 % 1_000_000,
+            "like_count": i % 5000,
+            "comment_count": i % 300,
+            "duration": f"PT{i % 10}M{i % 60}S",
+            "tags": "music,official,live",
+        }
+
+
+def video_schema():
+    from pyspark.sql.types import LongType, StringType, StructField, StructType
+
+    return StructType(
+        [
+            StructField("video_id", StringType(), False),
+            StructField("title", StringType(), False),
+            StructField("published_at", StringType(), False),
+            StructField("view_count", LongType(), False),
+            StructField("like_count", LongType(), False),
+            StructField("comment_count", LongType(), False),
+            StructField("duration", StringType(), False),
+            StructField("tags", StringType(), False),
+        ]
+    )
+
+
+def read_and_aggregate(spark, raw_format, path):
+    from pyspark.sql import functions as F
+
+    reader = spark.read.schema(video_schema())
+    df = reader.parquet(path) if raw_format == "parquet" else reader.json(path)
+    return df.groupBy(F.substring("published_at", 1, 7)).agg(F.sum("view_count")).collect()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from pyspark.sql import SparkSession
+
+    spark = (
+        SparkSession.builder.master("local[2]")
+        .appName("bench_raw_format_read")
+        .config("spark.ui.enabled", "false")
+        .config("spark.ui.showConsoleProgress", "false")
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+
+    print(f"{'videos':>8} {'format':>10} {'size(MiB)':>10} {'write(s)':>9} {'read(s)':>8}")
+    for count in args.videos:
+        with tempfile.TemporaryDirectory() as base_dir:
+            s3 = LocalFileS3(base_dir)
+            for raw_format, compression in FORMATS:
+                key = raw_object_key("raw", "video", raw_format, compression)
+                started = time.perf_counter()
+                with open_raw_writer(s3, "bench", key, "video", raw_format, compression=compression) as writer:
+                    writer.write_all(make_videos(count))
+                write_seconds = time.perf_counter() - started
+
+                path = os.path.join(base_dir, key)
+                # 1回目はJVMのウォームアップとして計測から除く
+                read_and_aggregate(spark, raw_format, path)
+                read_seconds = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    read_and_aggregate(spark, raw_format, path)
+                    read_seconds.append(time.perf_counter() - started)
+
+                label = raw_format + ("+gzip" if compression else "")
+                size_mib = os.path.getsize(path) / 1024 / 1024
+                print(
+                    f"{count:>8} {label:>10} {size_mib:>10.1f} {write_seconds:>9.2f} {min(read_seconds):>8.2f}"
+                )
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
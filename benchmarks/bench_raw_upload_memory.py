@@ -0,0 +1,111 @@
+# /////////////////
+# 生データ書き込みのメモリベンチマーク
+# /////////////////
+# 従来の DataFrame + StringIO + put_object と、NDJSONストリーミング書き込みの
+# ピークメモリ(tracemalloc)と実行時間を比較する。
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_raw_upload_memory.py --videos 10000 100000
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from io import StringIO
+
+import pandas as pd
+
+from src.lambda_func.s3_writer import open_ndjson_writer
+
+
+# 受け取ったデータを破棄し、送信バイト数だけを数えるS3クライアント
+class NullS3:
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def put_object(self, Body, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        self.bytes_sent += len(Body)
+
+    def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "bench"}
+
+    def upload_part(self, Body, PartNumber, **kwargs):
+        self.bytes_sent += len(Body)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, **kwargs):
+        pass
+
+    def abort_multipart_upload(self, **kwargs):
+        pass
+
+
+def iter_synthetic_videos(count):
+    for i in range(count):
+        yield {
+            "video_id": f"vid{i:08d}",
+            "title": f"ベンチマーク用の動画タイトル {i}",
+            "published_at": "2024-01-01T00:00:00Z",
+            "view_count": i * 7,
+            "like_count": i,
+            "comment_count": i % 100,
+            "duration": "PT4M13S",
+            "tags": "music,live,official",
+        }
+
+
+def legacy_upload(s3, records):
+    output = StringIO()
+    df = pd.DataFrame(list(records))
+    df.to_json(output, orient="records", lines=True, force_ascii=False)
+    s3.put_object(Bucket="bench", Key="data_video.json", Body=output.getvalue())
+
+
+def streaming_upload(s3, records, compression=None):
+    with open_ndjson_writer(
+        s3, "bench", "data_video.json", compression=compression
+    ) as writer:
+        writer.write_all(records)
+
+
+def measure(name, func, count):
+    s3 = NullS3()
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(s3, iter_synthetic_videos(count))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "benchmark": "raw_upload_memory",
+        "path": name,
+        "records": count,
+        "peak_mib": round(peak / 1024 / 1024, 2),
+        "elapsed_seconds": round(elapsed, 3),
+        "bytes_sent": s3.bytes_sent,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    paths = {
+        "dataframe_stringio": legacy_upload,
+        "ndjson_stream": streaming_upload,
+        "ndjson_stream_gzip": lambda s3, records: streaming_upload(
+            s3, records, compression="gzip"
+        ),
+    }
+
+    for count in args.videos:
+        for name, func in paths.items():
+            print(json.dumps(measure(name, func, count)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# /////////////////
+# スクレイパー(app_lambda)のベンチマーク
+# /////////////////
+# YouTube APIの代替(youtube_standin)で動画数・コメント数を指定した合成チャンネルを作り、
+#   - get_video: チャンネルの全動画の取得(プレイリストのページング + videos().list)
+#   - get_comments_for_video: 動画ごとのコメント取得(--comment-videos 件を逐次実行。全ページを取得する)
+#   - lambda_handler: ハンドラー全体(S3への書き込みは送信バイト数だけを数えて破棄する)
+# の処理時間・ピークRSS・API呼び出し回数・S3へ書き込んだバイト数を計測する。
+# ピークRSSを計測ごとに独立させるため、各計測は新しいプロセスで実行する。
+#
+# API応答の遅延(--latency, --jitter)とエラー(--error-rate, --error-endpoints)を注入できる。
+# --batch-size でバッチリクエスト(BatchExecutor)の有無・サイズを切り替え、HTTPの往復回数(round_trips)も記録する。
+# 結果は1計測1行のJSONで出力し、--output を指定した場合は実行情報(コミット・日時)を付けて追記する。
+# (実行ごとの結果を蓄積して比較するため)
+#
+# 実行例: PYTHONPATH=. python benchmarks/bench_scraper.py --videos 100 1000 10000 100000 --output bench_scraper.jsonl
+#         PYTHONPATH=. python benchmarks/bench_scraper.py --videos 1000 --latency 0.05 --error-rate 0.1
+#         PYTHONPATH=. python benchmarks/bench_scraper.py --videos 1000 --latency 0.05 --batch-size 1 50
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from youtube_standin import FakeYouTube, SyntheticChannel  # noqa: E402
+
+CASES = ["get_video", "get_comments_for_video", "lambda_handler"]
+CHANNEL_ID = "UCbenchmark"
+BUCKET = "bench-data-lake"
+
+
+# 受け取ったデータを破棄し、送信バイト数だけを数えるS3クライアント
+class NullS3:
+    def __init__(self):
+        self.bytes_sent = 0
+        self.requests = 0
+
+    def put_object(self, Body, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        self.bytes_sent += len(Body)
+        self.requests += 1
+
+    def create_multipart_upload(self, **kwargs):
+        self.requests += 1
+        return {"UploadId": "bench"}
+
+    def upload_part(self, Body, PartNumber, **kwargs):
+        self.bytes_sent += len(Body)
+        self.requests += 1
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, **kwargs):
+        self.requests += 1
+
+    def abort_multipart_upload(self, **kwargs):
+        self.requests += 1
+
+
+# ハンドラーが get_client で取得するAWSクライアントの代替
+class NullEvents:
+    def put_events(self, Entries):
+        return {"FailedEntryCount": 0, "Entries": [{"EventId": str(uuid.uuid4())} for _ in Entries]}
+
+
+class StaticSecrets:
+    def get_secret_value(self, SecretId):
+        return {"SecretString": json.dumps({"API_KEY": "BENCHMARK_API_KEY"})}
+
+
+def peak_rss_mib():
+    # Linuxのru_maxrssはKiB単位
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+# /////////////////
+# 子プロセス側: 1つの計測を実行する
+# /////////////////
+def run_case(params):
+    os.environ.update(
+        {
+            "BUCKET_NAME": BUCKET,
+            "REGION_NAME": "ap-northeast-1",
+            "YOUTUBE_API_KEY_ARN": "bench/youtube-api-key",
+            "FAST_START": "false",
+            "YOUTUBE_REQUESTS_PER_SECOND": str(params["requests_per_second"]),
+            "POWERTOOLS_LOG_LEVEL": "CRITICAL",
+            "METRICS_ENABLED": "false",
+            "COMMENT_MAX_PER_VIDEO": str(params["comments_per_video"]),
+            "COMMENT_INCLUDE_REPLIES": "true" if params["replies_per_comment"] else "false",
+            "YOUTUBE_BATCH_SIZE": str(params["batch_size"]),
+        }
+    )
+    from src.lambda_func import app_lambda
+
+    channel = SyntheticChannel(
+        CHANNEL_ID, params["videos"], params["comments_per_video"], params["replies_per_comment"]
+    )
+    youtube = FakeYouTube(
+        [channel],
+        latency=params["latency"],
+        jitter=params["jitter"],
+        error_rate=params["error_rate"],
+        error_endpoints=params["error_endpoints"],
+        seed=params["seed"],
+    )
+    s3 = NullS3()
+    baseline_rss = peak_rss_mib()
+
+    # ハンドラー以外の計測では、ハンドラーと同じ設定のバッチ実行を直接渡す
+    batcher = None
+    if params["case"] != "lambda_handler" and params["batch_size"] > 1:
+        batcher = app_lambda.BatchExecutor(
+            youtube,
+            max_batch_size=params["batch_size"],
+            max_wait=app_lambda.YOUTUBE_BATCH_WAIT_MS / 1000,
+        )
+
+    result = {"status": "ok"}
+    started = time.perf_counter()
+    try:
+        if params["case"] == "get_video":
+            result["rows"] = len(app_lambda.get_video(youtube, CHANNEL_ID, batcher=batcher))
+
+        elif params["case"] == "get_comments_for_video":
+            video_ids = [channel.video_id(index) for index in range(min(params["comment_videos"], channel.video_count))]
+            result["rows"] = sum(
+                len(
+                    app_lambda.get_comments_for_video(
+                        youtube,
+                        video_id,
+                        max_comments_per_video=0,
+                        include_replies=bool(params["replies_per_comment"]),
+                        batcher=batcher,
+                    )
+                )
+                for video_id in video_ids
+            )
+
+        else:
+            clients = {"s3": s3, "events": NullEvents(), "secretsmanager": StaticSecrets()}
+            context = type("Context", (), {"aws_request_id": "bench-execution-id"})()
+            with patch.object(
+                app_lambda, "get_client", lambda service_name, **kwargs: clients[service_name]
+            ), patch.object(app_lambda, "build_youtube_service", lambda api_key: youtube):
+                response = app_lambda.lambda_handler(
+                    {"CHANNEL_ID": CHANNEL_ID, "ARTIST_NAME_SLUG": "benchmark"}, context
+                )
+            result["status"] = "ok" if response["statusCode"] == 200 else f"partial: {response['failed_channels']}"
+    except Exception as e:
+        result["status"] = f"failed: {type(e).__name__}: {e}"
+    finally:
+        if batcher is not None:
+            batcher.close()
+    elapsed = time.perf_counter() - started
+
+    return {
+        **result,
+        "wall_seconds": round(elapsed, 3),
+        "baseline_rss_mib": baseline_rss,
+        "peak_rss_mib": peak_rss_mib(),
+        "api_calls": youtube.call_counts(),
+        "api_calls_total": sum(youtube.call_counts().values()),
+        "api_errors": youtube.error_counts(),
+        "round_trips": youtube.round_trip_count(),
+        "s3_bytes_written": s3.bytes_sent,
+        "s3_requests": s3.requests,
+    }
+
+
+# /////////////////
+# 親プロセス側
+# /////////////////
+def measure(params):
+    completed = subprocess.run(
+        [sys.executable, __file__, "--child", json.dumps(params)],
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {
+        "benchmark": "scraper",
+        **params,
+        **json.loads(completed.stdout.strip().splitlines()[-1]),
+    }
+
+
+def run_metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "run_id": uuid.uuid4().hex[:12],
+        "run_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--videos", type=int, nargs="+", default=[100, 1_000, 10_000])
+    parser.add_argument("--comments-per-video", type=int, default=20)
+    parser.add_argument("--replies-per-comment", type=int, default=0, help="1以上で返信も取得する")
+    parser.add_argument("--comment-videos", type=int, default=100, help="get_comments_for_video を実行する動画数")
+    parser.add_argument("--latency", type=float, default=0.0, help="1リクエストあたりの応答時間(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="応答時間のばらつき(latencyに対する割合)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-endpoints", nargs="+", default=["commentThreads.list"])
+    parser.add_argument("--requests-per-second", type=float, default=0, help="0以下で流量制限なし")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[50], help="1以下でバッチリクエストを使用しない")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", default=None, help="結果を追記するJSON Linesファイル")
+    parser.add_argument("--child", default=None)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_case(json.loads(args.child)), ensure_ascii=False))
+        return
+
+    metadata = run_metadata()
+    for videos in args.videos:
+        for case, batch_size in [(case, size) for case in args.cases for size in args.batch_size]:
+            for repeat in range(args.repeat):
+                result = measure(
+                    {
+                        "case": case,
+                        "videos": videos,
+                        "comments_per_video": args.comments_per_video,
+                        "replies_per_comment": args.replies_per_comment,
+                        "comment_videos": args.comment_videos,
+                        "latency": args.latency,
+                        "jitter": args.jitter,
+                        "error_rate": args.error_rate,
+                        "error_endpoints": args.error_endpoints,
+                        "requests_per_second": args.requests_per_second,
+                        "batch_size": batch_size,
+                        "seed": args.seed,
+                        "repeat": repeat,
+                    }
+                )
+                line = json.dumps({**metadata, **result}, ensure_ascii=False)
+                print(line)
+                if args.output:
+                    with open(args.output, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+# /////////////////
+# パイプライン全体のオフライン実行(Lambda → EventBridge → Glue → クリーンアップ)
+# /////////////////
+# AWS・GCPに接続せずに、デプロイ前のパイプライン全体をローカルで通しで実行し、
+# ステージごとの処理時間・バイト数・行数を表示する(スループットの劣化をデプロイ前に検出するため)。
+#
+#   1. lambda_handler: YouTube APIの代替(youtube_standin)とmoto(S3・Secrets Manager・EventBridge)に対して実行
+#   2. eventbridge: ハンドラーがバスへ送信した完了イベントからdetailを取り出す
+#   3. glue_*: detailの input_keys をローカルへ取得し、Glueジョブと同じ加工処理をローカルのPySparkで実行
+#      (DQレポートはmotoのS3、processed zoneはローカルのディレクトリ、BigQueryはローカルのParquetで代替)
+#   4. clean_up: Step Functionsの失敗時の分岐(Catch)と同じイベントで clean_up_lambda.lambda_handler を実行
+#
+# 実行例: PYTHONPATH=. python benchmarks/run_pipeline_offline.py --videos 500 --comments-per-video 20
+#         PYTHONPATH=. python benchmarks/run_pipeline_offline.py --recording recorded_channel.json --json
+# (Glueの段階はJava 17が必要。JAVA_HOMEを設定して実行する)
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from youtube_standin import (  # noqa: E402
+    FakeYouTube,
+    SyntheticChannel,
+    load_recorded_channels,
+    record_channel,
+)
+
+BUCKET = "offline-data-lake"
+REGION = "ap-northeast-1"
+SECRET_NAME = "offline/youtube-api-key"
+EVENT_BUS = "youtube-pipeline-event-bus"
+BQ_DATASET = "offline_dataset"
+TABLES = ["channel", "video", "comment"]
+
+
+# app_lambdaはimport時に環境変数を読み込むため、importより前に設定する
+def configure_environment(raw_format, verbose, comment_max_per_video=10, include_replies=False, batch_size=50):
+    os.environ.update(
+        {
+            "BUCKET_NAME": BUCKET,
+            "REGION_NAME": REGION,
+            "AWS_DEFAULT_REGION": REGION,
+            "YOUTUBE_API_KEY_ARN": SECRET_NAME,
+            "RAW_FORMAT": raw_format,
+            "FAST_START": "false",
+            "COMMENT_MAX_PER_VIDEO": str(comment_max_per_video),
+            "COMMENT_INCLUDE_REPLIES": "true" if include_replies else "false",
+            "YOUTUBE_BATCH_SIZE": str(batch_size),
+            # motoのS3は一覧取得と削除の同時実行に対応していないため、削除は1スレッドで行う
+            "DELETE_MAX_WORKERS": "1",
+        }
+    )
+    if not verbose:
+        os.environ.setdefault("POWERTOOLS_LOG_LEVEL", "WARNING")
+        os.environ.setdefault("METRICS_ENABLED", "false")
+
+
+# /////////////////
+# ステージごとの計測
+# /////////////////
+class StageRecorder:
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, channel_id=None):
+        metrics = {"stage": name, "channel_id": channel_id, "seconds": None, "rows": None, "bytes": None, "status": "ok"}
+        started = time.perf_counter()
+        try:
+            yield metrics
+        except Exception as e:
+            metrics["status"] = f"failed: {type(e).__name__}: {e}"
+            raise
+        finally:
+            metrics["seconds"] = round(time.perf_counter() - started, 3)
+            self.stages.append(metrics)
+
+    def print_table(self):
+        print(f"{'stage':<24}{'channel_id':<18}{'seconds':>10}{'rows':>12}{'bytes':>14}  status")
+        for metrics in self.stages:
+            print(
+                f"{metrics['stage']:<24}{metrics['channel_id'] or '':<18}{metrics['seconds']:>10.3f}"
+                f"{'' if metrics['rows'] is None else metrics['rows']:>12}"
+                f"{'' if metrics['bytes'] is None else metrics['bytes']:>14}  {metrics['status']}"
+            )
+
+
+def channel_id_from_detail(detail):
+    return detail["processed_base_path"].split("channel=")[1].split("/")[0]
+
+
+def s3_prefix_bytes(s3, prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    return sum(
+        obj["Size"]
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix)
+        for obj in page.get("Contents", [])
+    )
+
+
+def local_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(
+            os.path.getsize(os.path.join(root, name)) for name in files if not name.endswith(".crc")
+        )
+    return total
+
+
+def count_raw_rows(path, raw_format):
+    if raw_format == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_metadata(path).num_rows
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+# /////////////////
+# 1-2. Lambda → EventBridge
+# /////////////////
+def setup_aws(boto3, aws_cache, api_key):
+    s3 = boto3.client("s3", region_name=REGION)
+    s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION})
+    boto3.client("secretsmanager", region_name=REGION).create_secret(
+        Name=SECRET_NAME, SecretString=json.dumps({"API_KEY": api_key})
+    )
+
+    # ハンドラーが使うEventBridgeクライアント(aws_cacheで共有される)の送信内容を記録する。
+    # (実環境ではルールのターゲットのStep Functionsが受け取る。motoのルール→ターゲット配送は使わない)
+    boto3.client("events", region_name=REGION).create_event_bus(Name=EVENT_BUS)
+    events = aws_cache.get_client("events")
+    sent = []
+    original_put_events = events.put_events
+
+    def put_events(Entries):
+        response = original_put_events(Entries=Entries)
+        sent.extend(
+            entry
+            for entry, result in zip(Entries, response.get("Entries", []))
+            if not result.get("ErrorCode")
+        )
+        return response
+
+    events.put_events = put_events
+    return s3, sent
+
+
+def run_lambda(recorder, app_lambda, youtube, s3, channels):
+    event = {
+        "CHANNELS": [
+            {"CHANNEL_ID": channel.channel_id, "ARTIST_NAME_SLUG": channel.channel_id.lower()}
+            for channel in channels
+        ],
+        "POWERTOOLS_SERVICE_NAME": "youtube-scraper-offline",
+    }
+    context = type("Context", (), {"aws_request_id": str(uuid.uuid4())})()
+
+    with recorder.stage("lambda_handler") as metrics, patch.object(
+        app_lambda, "build_youtube_service", lambda api_key: youtube
+    ):
+        response = app_lambda.lambda_handler(event, context)
+        metrics["bytes"] = s3_prefix_bytes(s3, "channel=")
+        metrics["api_calls"] = youtube.call_counts()
+        metrics["response"] = response
+    return response
+
+
+# Step FunctionsのPassステート(decoded_payload)と同様に、イベントのDetailをデコードする
+def receive_details(recorder, sent, expected):
+    with recorder.stage("eventbridge") as metrics:
+        details = [
+            json.loads(entry["Detail"])
+            for entry in sent
+            if entry["EventBusName"] == EVENT_BUS and entry["DetailType"] == "ScrapingCompleted"
+        ]
+        metrics["rows"] = len(details)
+        metrics["bytes"] = sum(len(entry["Detail"].encode("utf-8")) for entry in sent)
+    if len(details) < expected:
+        raise RuntimeError(f"完了イベントを受信できませんでした(受信 {len(details)} / 期待 {expected})")
+    return details
+
+
+# /////////////////
+# 3. Glue(ローカルのPySpark)
+# /////////////////
+def create_spark(work_dir):
+    from pyspark.sql import SparkSession
+
+    spark = (
+        SparkSession.builder.master("local[*]")
+        .appName("run_pipeline_offline")
+        .config("spark.ui.enabled", "false")
+        .config("spark.ui.showConsoleProgress", "false")
+        .config("spark.sql.shuffle.partitions", "4")
+        .config("spark.sql.session.timeZone", "UTC")
+        .config("spark.sql.warehouse.dir", os.path.join(work_dir, "spark-warehouse"))
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+    return spark
+
+
+# input_keys はファイル、または "/" で終わるパートファイルのプレフィックス(コメント)。
+# プレフィックスの場合はディレクトリとして取得し、Glueと同様にディレクトリごと読み込む
+def list_keys(s3, key):
+    if not key.endswith("/"):
+        return [key]
+    paginator = s3.get_paginator("list_objects_v2")
+    return [
+        obj["Key"]
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=key)
+        for obj in page.get("Contents", [])
+    ]
+
+
+def download_raw(recorder, s3, detail, raw_dir):
+    local_paths = []
+    downloaded = []
+    with recorder.stage("raw_download", channel_id_from_detail(detail)) as metrics:
+        for uri in detail["input_keys"]:
+            key = uri[len(f"s3://{BUCKET}/"):]
+            for object_key in list_keys(s3, key):
+                path = os.path.join(raw_dir, object_key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                s3.download_file(BUCKET, object_key, path)
+                downloaded.append(path)
+            local_paths.append(os.path.join(raw_dir, key))
+        metrics["bytes"] = sum(os.path.getsize(path) for path in downloaded)
+        metrics["rows"] = sum(count_raw_rows(path, detail["raw_format"]) for path in downloaded)
+    return dict(zip(TABLES, local_paths))
+
+
+# BigQuery出力の代替: データセット.テーブルごとのディレクトリへParquetを追記する
+def write_bigquery_standin(df, warehouse_dir, table):
+    df.write.mode("append").parquet(os.path.join(warehouse_dir, table))
+
+
+def run_glue(recorder, spark, s3, detail, raw_paths, work_dir, inject_failure):
+    from src.glue.glue_dq import run_spark_dq
+    from src.glue.glue_processed import (
+        TABLE_KEYS,
+        build_snapshot,
+        channel_id_from_path,
+        merge_partitions,
+        snapshot_path,
+        table_path,
+        write_partitions,
+        write_snapshot,
+    )
+    from src.glue.glue_transforms import (
+        channel_schema,
+        comment_schema,
+        materialize,
+        read_raw,
+        release,
+        transform_channel,
+        transform_comment,
+        transform_video,
+        video_schema,
+    )
+
+    schemas = {"channel": channel_schema, "video": video_schema, "comment": comment_schema}
+    transforms = {"channel": transform_channel, "video": transform_video, "comment": transform_comment}
+    channel_id = channel_id_from_path(detail["processed_base_path"])
+    processed_zone = os.path.join(work_dir, "processed")
+    warehouse_dir = os.path.join(work_dir, "bigquery", BQ_DATASET)
+    snapshot_date = time.strftime("%Y-%m-%d", time.gmtime())
+
+    frames, retained = {}, []
+    try:
+        with recorder.stage("glue_transform", channel_id) as metrics:
+            for table in TABLES:
+                frames[table] = materialize(
+                    transforms[table](
+                        read_raw(spark, schemas[table], raw_paths[table], detail["raw_format"])
+                    )
+                )
+            metrics["rows"] = sum(df.count() for df in frames.values())
+
+        with recorder.stage("glue_dq", channel_id) as metrics:
+            report_prefix = f"{detail['report_base_path'].split('/', 1)[1]}"
+            for table, df in frames.items():
+                run_spark_dq(df, table, f"s3://{BUCKET}/{report_prefix}{table}/", s3=s3)
+            metrics["bytes"] = s3_prefix_bytes(s3, report_prefix)
+
+        # Glueジョブと同じく、パーティションの書き換えはBigQueryへの差分出力が成功した後に行う
+        with recorder.stage("processed_merge", channel_id) as metrics:
+            merges, rows = {}, 0
+            for table, df in frames.items():
+                path = table_path(processed_zone, table)
+                merged, delta, existing, _ = merge_partitions(
+                    spark, df, path, TABLE_KEYS[table], channel_id
+                )
+                retained.extend(existing)
+                merges[table] = (path, merged, delta)
+                rows += merged.count()
+            metrics["rows"] = rows
+
+        with recorder.stage("stats_snapshot", channel_id) as metrics:
+            rows = 0
+            for table in ("channel", "video"):
+                snapshot = build_snapshot(frames[table], table, channel_id, snapshot_date)
+                write_snapshot(snapshot, snapshot_path(processed_zone, table), table)
+                rows += snapshot.count()
+            metrics["rows"] = rows
+            metrics["bytes"] = sum(
+                local_bytes(snapshot_path(processed_zone, table)) for table in ("channel", "video")
+            )
+
+        with recorder.stage("bigquery_standin", channel_id) as metrics:
+            if inject_failure == "bigquery":
+                raise RuntimeError("BigQuery出力の失敗を注入しました。")
+            before = local_bytes(warehouse_dir)
+            for table, (_, _, delta) in merges.items():
+                write_bigquery_standin(delta, warehouse_dir, f"{detail['artist_name_slug']}_{table}")
+            metrics["rows"] = sum(delta.count() for _, _, delta in merges.values())
+            metrics["bytes"] = local_bytes(warehouse_dir) - before
+
+        with recorder.stage("processed_write", channel_id) as metrics:
+            for path, merged, _ in merges.values():
+                write_partitions(merged, path)
+            metrics["bytes"] = sum(
+                local_bytes(table_path(processed_zone, table)) for table in TABLES
+            )
+    finally:
+        release(*frames.values(), *retained)
+
+
+# /////////////////
+# 4. クリーンアップ(失敗時の分岐)
+# /////////////////
+def run_clean_up(recorder, s3, detail, error):
+    from src.clean_up import clean_up_lambda
+
+    # Step FunctionsのCatch(ResultPath: $.ErrorDetails)からLambda Invokeへ渡されるイベントと同じ形
+    event = {
+        "decoded_payload": detail,
+        "ErrorDetails": {"Error": type(error).__name__, "Cause": str(error)},
+    }
+    with recorder.stage("clean_up", channel_id_from_detail(detail)) as metrics:
+        result = clean_up_lambda.lambda_handler(event, None)
+        report = result.get("cleanup_report", {})
+        metrics["rows"] = report.get("deleted")
+        metrics["bytes"] = s3_prefix_bytes(s3, report.get("prefix", "channel="))
+        metrics["cleanup_report"] = report
+    return report
+
+
+def build_channels(args):
+    if args.recording:
+        return load_recorded_channels(args.recording)
+    return [
+        SyntheticChannel(
+            f"UCoffline{index:04d}", args.videos, args.comments_per_video, args.replies_per_comment
+        )
+        for index in range(args.channels)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--videos", type=int, default=200)
+    parser.add_argument("--comments-per-video", type=int, default=20)
+    parser.add_argument("--replies-per-comment", type=int, default=0)
+    parser.add_argument(
+        "--comment-max-per-video", type=int, default=10, help="Lambdaが動画ごとに取得するコメント数の上限(0で無制限)"
+    )
+    parser.add_argument("--include-replies", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=50, help="1以下でバッチリクエストを使用しない")
+    parser.add_argument("--recording", default=None, help="記録したチャンネルのJSON(youtube_standin.RecordedChannelの形式)")
+    parser.add_argument("--save-recording", default=None, help="使用したチャンネルのデータをJSONに書き出す")
+    parser.add_argument("--raw-format", choices=["json", "parquet"], default="json")
+    parser.add_argument(
+        "--outcome",
+        choices=["failure", "success"],
+        default="failure",
+        help="failure: Glueの後に失敗時の分岐(クリーンアップ)を実行する",
+    )
+    parser.add_argument("--inject-failure", choices=["none", "bigquery"], default="none")
+    parser.add_argument("--skip-glue", action="store_true")
+    parser.add_argument("--work-dir", default=None)
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    configure_environment(
+        args.raw_format, args.verbose, args.comment_max_per_video, args.include_replies, args.batch_size
+    )
+
+    import boto3
+    from moto import mock_aws
+
+    from src.lambda_func import app_lambda, aws_cache
+
+    channels = build_channels(args)
+    if args.save_recording:
+        with open(args.save_recording, "w", encoding="utf-8") as f:
+            json.dump([record_channel(channel) for channel in channels], f, ensure_ascii=False)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="pipeline_offline_")
+    recorder = StageRecorder()
+    youtube = FakeYouTube(channels)
+    failed = None
+
+    with mock_aws():
+        aws_cache.clear_clients()
+        s3, sent = setup_aws(boto3, aws_cache, api_key="OFFLINE_API_KEY")
+
+        response = run_lambda(recorder, app_lambda, youtube, s3, channels)
+        details = receive_details(recorder, sent, len(response["succeeded_channels"]))
+
+        spark = None if args.skip_glue else create_spark(work_dir)
+        try:
+            for detail in details:
+                error = None
+                if spark is not None:
+                    try:
+                        raw_paths = download_raw(recorder, s3, detail, os.path.join(work_dir, "raw"))
+                        run_glue(recorder, spark, s3, detail, raw_paths, work_dir, args.inject_failure)
+                    except Exception as e:
+                        error = failed = e
+                if error is None and args.outcome == "failure":
+                    error = RuntimeError("オフライン実行で失敗時の分岐を指定しました。")
+                if error is not None:
+                    run_clean_up(recorder, s3, detail, error)
+        finally:
+            if spark is not None:
+                spark.stop()
+            aws_cache.clear_clients()
+
+    if args.json:
+        print(json.dumps({"stages": recorder.stages}, ensure_ascii=False, default=str))
+    else:
+        recorder.print_table()
+        print(f"YouTube API calls: {youtube.call_counts()} (HTTP round trips: {youtube.round_trip_count()})")
+
+    # 出力先を指定しなかった場合の作業ディレクトリは削除する
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if failed is not None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
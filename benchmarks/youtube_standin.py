@@ -0,0 +1,396 @@
+# /////////////////
+# YouTube Data APIの代替(オフライン実行・ベンチマーク用)
+# /////////////////
+# googleapiclientのサービスオブジェクトと同じ呼び出し方
+#   youtube.videos().list(part=..., id=...).execute(http=...)
+# に応答する。app_lambda.build_youtube_service の代わりに返すことで、
+# MeteredYouTube(クォータ計上)や execute_request を含めてLambdaの処理をそのまま実行できる。
+#
+# 応答ごとの遅延(latency)と、指定したエンドポイントへのエラー(HttpError)の注入ができる。
+# new_batch_http_request() のバッチリクエストでは、遅延はHTTPの往復(バッチ)ごとに1回、エラーはサブリクエストごとに注入する。
+#
+# チャンネルのデータは次のどちらかから作る。
+#   - SyntheticChannel: 動画数・コメント数を指定して決定的に生成する(動画は要求されるたびに生成し、全件を保持しない)
+#   - RecordedChannel: 記録したAPIのitems(JSON)をそのまま返す
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+BASE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def format_timestamp(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def uploads_playlist_id(channel_id):
+    # 実際のAPIと同様、アップロード動画のプレイリストIDは "UC" を "UU" に置き換えたもの
+    return "UU" + channel_id[2:] if channel_id.startswith("UC") else f"UU{channel_id}"
+
+
+# /////////////////
+# 合成データのチャンネル
+# /////////////////
+class SyntheticChannel:
+    def __init__(self, channel_id, video_count=100, comments_per_video=20, replies_per_comment=0):
+        self.channel_id = channel_id
+        self.video_count = video_count
+        self.comments_per_video = comments_per_video
+        self.replies_per_comment = replies_per_comment
+
+    def channel_item(self):
+        return {
+            "id": self.channel_id,
+            "snippet": {
+                "title": f"Synthetic {self.channel_id}",
+                "publishedAt": format_timestamp(BASE_TIME - timedelta(days=3650)),
+            },
+            "statistics": {
+                "subscriberCount": str(1000 + self.video_count * 37),
+                "viewCount": str(self.video_count * 100_000),
+                "videoCount": str(self.video_count),
+            },
+            "contentDetails": {"relatedPlaylists": {"uploads": uploads_playlist_id(self.channel_id)}},
+        }
+
+    # プレイリストの並び(新しい順)でindex番目の動画
+    def video_id(self, index):
+        return f"{self.channel_id}-v{index:06d}"
+
+    def video_index(self, video_id):
+        prefix = f"{self.channel_id}-v"
+        if not video_id.startswith(prefix):
+            return None
+        index = int(video_id[len(prefix):])
+        return index if index < self.video_count else None
+
+    def published_at(self, index):
+        return format_timestamp(BASE_TIME - timedelta(hours=6 * index))
+
+    def playlist_item(self, index):
+        video_id = self.video_id(index)
+        return {
+            "snippet": {"title": f"動画 #{index}", "publishedAt": self.published_at(index)},
+            "contentDetails": {"videoId": video_id, "videoPublishedAt": self.published_at(index)},
+        }
+
+    def video_item(self, video_id):
+        index = self.video_index(video_id)
+        if index is None:
+            return None
+        return {
+            "id": video_id,
+            "snippet": {
+                "title": f"動画 #{index}",
+                "publishedAt": self.published_at(index),
+                "tags": ["music", "official"] if index % 3 else [],
+            },
+            "statistics": {
+                "viewCount": str(index * 7919 % 10_000_000),
+                "likeCount": str(index * 31 % 50_000),
+                "commentCount": str(self.comments_per_video * (1 + self.replies_per_comment)),
+            },
+            "contentDetails": {"duration": f"PT{index % 3}H{index % 60}M{index % 59}S"},
+        }
+
+    def comment_snippet(self, number, text):
+        return {
+            "authorDisplayName": f"user{number}",
+            "publishedAt": format_timestamp(BASE_TIME + timedelta(minutes=number)),
+            "textDisplay": text,
+            "likeCount": number % 100,
+        }
+
+    # 実際のAPIと同様、返信のIDは "<スレッドのID>.<返信のID>"
+    def replies(self, thread_id):
+        if self.video_index(thread_id.rsplit("-c", 1)[0]) is None:
+            return None
+        return [
+            {"id": f"{thread_id}.r{number:04d}", "snippet": self.comment_snippet(number, f"返信 {number}")}
+            for number in range(self.replies_per_comment)
+        ]
+
+    def comment_threads(self, video_id):
+        if self.video_index(video_id) is None:
+            return None
+        return [
+            {
+                "id": f"{video_id}-c{number:05d}",
+                "snippet": {
+                    "topLevelComment": {"snippet": self.comment_snippet(number, f"コメント {number}")},
+                    "totalReplyCount": self.replies_per_comment,
+                },
+            }
+            for number in range(self.comments_per_video)
+        ]
+
+
+# /////////////////
+# 記録したデータのチャンネル
+# /////////////////
+# 記録の形式: {"channel": channelsのitem, "videos": [videosのitem(新しい順)],
+#             "comment_threads": {video_id: [commentThreadsのitem]},
+#             "replies": {スレッドのID: [commentsのitem]}}
+class RecordedChannel:
+    def __init__(self, recording):
+        self.channel = recording["channel"]
+        self.channel_id = self.channel["id"]
+        self.videos = recording["videos"]
+        self.videos_by_id = {video["id"]: video for video in self.videos}
+        self.threads = recording.get("comment_threads", {})
+        self.thread_replies = recording.get("replies", {})
+        self.video_count = len(self.videos)
+
+    def channel_item(self):
+        return self.channel
+
+    def playlist_item(self, index):
+        video = self.videos[index]
+        return {
+            "snippet": {"title": video["snippet"]["title"], "publishedAt": video["snippet"]["publishedAt"]},
+            "contentDetails": {"videoId": video["id"], "videoPublishedAt": video["snippet"]["publishedAt"]},
+        }
+
+    def video_item(self, video_id):
+        return self.videos_by_id.get(video_id)
+
+    def comment_threads(self, video_id):
+        if video_id not in self.videos_by_id:
+            return None
+        return self.threads.get(video_id, [])
+
+    def replies(self, thread_id):
+        return self.thread_replies.get(thread_id)
+
+
+def record_channel(channel):
+    # 任意のチャンネル(合成データなど)を記録の形式に書き出す
+    videos = [
+        channel.video_item(channel.playlist_item(index)["contentDetails"]["videoId"])
+        for index in range(channel.video_count)
+    ]
+    comment_threads = {video["id"]: channel.comment_threads(video["id"]) for video in videos}
+    return {
+        "channel": channel.channel_item(),
+        "videos": videos,
+        "comment_threads": comment_threads,
+        "replies": {
+            thread["id"]: replies
+            for threads in comment_threads.values()
+            for thread in threads
+            if (replies := channel.replies(thread["id"]))
+        },
+    }
+
+
+def load_recorded_channels(path):
+    with open(path, encoding="utf-8") as f:
+        recordings = json.load(f)
+    if isinstance(recordings, dict):
+        recordings = [recordings]
+    return [RecordedChannel(recording) for recording in recordings]
+
+
+# /////////////////
+# サービスオブジェクト
+# /////////////////
+class FakeRequest:
+    def __init__(self, service, endpoint, handler, kwargs):
+        self.service = service
+        self.endpoint = endpoint
+        self.handler = handler
+        self.kwargs = kwargs
+
+    def execute(self, http=None, num_retries=0):
+        self.service.record_round_trip()
+        self.service.simulate_network()
+        return self.execute_in_batch()
+
+    def execute_in_batch(self):
+        self.service.record_call(self.endpoint)
+        self.service.inject_error(self.endpoint)
+        return self.handler(**self.kwargs)
+
+
+class FakeBatch:
+    def __init__(self, service):
+        self.service = service
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback, request_id))
+
+    def execute(self, http=None):
+        self.service.record_round_trip()
+        self.service.simulate_network()
+        for request, callback, request_id in self.requests:
+            try:
+                response = request.execute_in_batch()
+            except Exception as e:
+                callback(request_id, None, e)
+            else:
+                callback(request_id, response, None)
+
+
+class FakeResource:
+    def __init__(self, service, name, handler):
+        self.service = service
+        self.name = name
+        self.handler = handler
+
+    def list(self, **kwargs):
+        return FakeRequest(self.service, f"{self.name}.list", self.handler, kwargs)
+
+
+# commentThreadsに含まれる返信の最大件数
+INLINE_REPLIES = 5
+
+# 注入するエラー(一時的なサーバーエラー)の応答
+INJECTED_ERROR_STATUS = 503
+INJECTED_ERROR_CONTENT = b'{"error": {"code": 503, "message": "The service is currently unavailable.", "errors": [{"reason": "backendError"}]}}'
+
+
+class FakeYouTube:
+    # latency: 1リクエストあたりの応答時間(秒)。jitterの割合だけ一様にばらつかせる
+    # error_rate: error_endpoints へのリクエストがエラーになる割合(seedで再現可能)
+    def __init__(
+        self,
+        channels,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        error_endpoints=("commentThreads.list",),
+        seed=0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_endpoints = set(error_endpoints)
+        self._random = random.Random(seed)
+        self.errors = Counter()
+        self.channels_by_id = {channel.channel_id: channel for channel in channels}
+        self.channels_by_playlist = {
+            channel.channel_item()["contentDetails"]["relatedPlaylists"]["uploads"]: channel
+            for channel in channels
+        }
+        self.calls = Counter()
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    def record_call(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def record_round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+
+    def round_trip_count(self):
+        with self._lock:
+            return self.round_trips
+
+    def call_counts(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def error_counts(self):
+        with self._lock:
+            return dict(self.errors)
+
+    def simulate_network(self):
+        with self._lock:
+            delay = self.latency * (1 + self.jitter * (2 * self._random.random() - 1))
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def inject_error(self, endpoint):
+        with self._lock:
+            fail = endpoint in self.error_endpoints and self._random.random() < self.error_rate
+            if fail:
+                self.errors[endpoint] += 1
+
+        if fail:
+            import httplib2
+            from googleapiclient.errors import HttpError
+
+            raise HttpError(httplib2.Response({"status": INJECTED_ERROR_STATUS}), INJECTED_ERROR_CONTENT)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self)
+
+    def channels(self):
+        return FakeResource(self, "channels", self._list_channels)
+
+    def playlistItems(self):
+        return FakeResource(self, "playlistItems", self._list_playlist_items)
+
+    def videos(self):
+        return FakeResource(self, "videos", self._list_videos)
+
+    def commentThreads(self):
+        return FakeResource(self, "commentThreads", self._list_comment_threads)
+
+    def comments(self):
+        return FakeResource(self, "comments", self._list_comments)
+
+    def _find_video_channel(self, video_id):
+        for channel in self.channels_by_id.values():
+            if channel.video_item(video_id) is not None:
+                return channel
+        return None
+
+    def _list_channels(self, part, id, **kwargs):
+        channel = self.channels_by_id.get(id)
+        return {"items": [channel.channel_item()] if channel else []}
+
+    def _list_playlist_items(self, part, playlistId, maxResults=5, pageToken=None, **kwargs):
+        channel = self.channels_by_playlist[playlistId]
+        start = int(pageToken or 0)
+        end = min(start + maxResults, channel.video_count)
+        response = {"items": [channel.playlist_item(index) for index in range(start, end)]}
+        if end < channel.video_count:
+            response["nextPageToken"] = str(end)
+        return response
+
+    def _list_videos(self, part, id, **kwargs):
+        items = []
+        for video_id in id.split(","):
+            channel = self._find_video_channel(video_id)
+            if channel is not None:
+                items.append(channel.video_item(video_id))
+        return {"items": items}
+
+    def _paginate(self, items, maxResults, pageToken):
+        start = int(pageToken or 0)
+        end = min(start + maxResults, len(items))
+        response = {"items": items[start:end]}
+        if end < len(items):
+            response["nextPageToken"] = str(end)
+        return response
+
+    # part に replies を含む場合、実際のAPIと同様にスレッドごとの返信を最大5件まで含める
+    def _list_comment_threads(self, part, videoId, maxResults=20, pageToken=None, **kwargs):
+        channel = self._find_video_channel(videoId)
+        threads = channel.comment_threads(videoId) if channel else None
+        if threads is None:
+            raise LookupError(f"videoNotFound: {videoId}")
+        response = self._paginate(threads, maxResults, pageToken)
+        if "replies" in part:
+            response["items"] = [
+                {**thread, "replies": {"comments": replies[:INLINE_REPLIES]}}
+                if (replies := channel.replies(thread["id"]))
+                else thread
+                for thread in response["items"]
+            ]
+        return response
+
+    def _list_comments(self, part, parentId, maxResults=20, pageToken=None, **kwargs):
+        for channel in self.channels_by_id.values():
+            replies = channel.replies(parentId)
+            if replies is not None:
+                return self._paginate(replies, maxResults, pageToken)
+        raise LookupError(f"commentNotFound: {parentId}")
@@ -2,35 +2,142 @@ import os
 import boto3
 import json
 import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import BotoCoreError, ClientError
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# boto3クライアントを初期化
-s3 = boto3.resource("s3")
-glue = boto3.client("glue")
-
 # 環境変数 (Glueカタログを削除する場合に利用)
 GLUE_DATABASE_NAME = os.environ.get("GLUE_DATABASE_NAME")
 
-
-def delete_s3_prefix(bucket_name, prefix):
+# 削除処理の設定
+DELETE_BATCH_SIZE = 1000  # DeleteObjectsの1回あたりの上限
+DELETE_MAX_WORKERS = int(os.environ.get("DELETE_MAX_WORKERS", "8"))
+DELETE_MAX_ATTEMPTS = int(os.environ.get("DELETE_MAX_ATTEMPTS", "3"))
+CLEANUP_DRY_RUN = os.environ.get("CLEANUP_DRY_RUN", "false").lower() == "true"
+
+# エラー内容の記録件数の上限(ログ・戻り値が大きくなりすぎないようにする)
+MAX_REPORTED_ERRORS = 20
+
+# boto3クライアントは初回の利用時に生成し、ウォームスタート時は再利用する
+_s3_client = None
+
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client("s3")
+    return _s3_client
+
+
+# /////////////////
+# S3プレフィックス配下の削除
+# /////////////////
+# 一覧の取得(1000件ごと)と削除を並行して進め、DeleteObjectsの部分的な失敗(Errors)は
+# 失敗したキーだけを再試行する。結果は削除件数・失敗件数・処理時間をまとめて返す。
+def iter_key_batches(s3, bucket_name, prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=bucket_name, Prefix=prefix, PaginationConfig={"PageSize": DELETE_BATCH_SIZE}
+    ):
+        keys = [obj["Key"] for obj in page.get("Contents", [])]
+        if keys:
+            yield keys
+
+
+def delete_batch(s3, bucket_name, keys, max_attempts=DELETE_MAX_ATTEMPTS):
+    pending = list(keys)
+    deleted = 0
+    errors = []
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = s3.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": [{"Key": key} for key in pending], "Quiet": True},
+            )
+            errors = response.get("Errors", [])
+        except ClientError as e:
+            # リクエスト全体の失敗(SlowDownなど)はバッチ全体を再試行する
+            errors = [
+                {"Key": key, "Code": e.response["Error"]["Code"], "Message": str(e)}
+                for key in pending
+            ]
+        except BotoCoreError as e:
+            # 接続エラー・読み取りタイムアウトなども、他のバッチを止めずにこのバッチだけを再試行・報告する
+            errors = [{"Key": key, "Code": type(e).__name__, "Message": str(e)} for key in pending]
+
+        deleted += len(pending) - len(errors)
+        pending = [error["Key"] for error in errors]
+        if not pending:
+            break
+        if attempt < max_attempts:
+            time.sleep(0.2 * 2 ** (attempt - 1))
+
+    return {"deleted": deleted, "errors": errors}
+
+
+def delete_s3_prefix(
+    bucket_name,
+    prefix,
+    s3=None,
+    max_workers=DELETE_MAX_WORKERS,
+    max_attempts=DELETE_MAX_ATTEMPTS,
+    dry_run=False,
+):
+    s3 = s3 or get_s3_client()
     logger.info(
         f"S3バケットの削除を開始します。 ターゲットプレフィックス: s3://{bucket_name}/{prefix}"
+        + (" (dry-run)" if dry_run else "")
     )
 
-    try:
-        bucket = s3.Bucket(bucket_name)
-        delete_response = bucket.objects.filter(Prefix=prefix).delete()
-
-        deleted_count = sum(len(d.get("Deleted", [])) for d in delete_response)
-        logger.info(
-            f"S3クリーンアップが完了しました。削除されたオブジェクト総数: {deleted_count}"
-        )
-
-    except Exception as e:
-        # クリーンアップ自体の失敗はログに記録し、Lambdaを停止させません。
-        logger.error(f"Error deleting S3 prefix {prefix} in {bucket_name}: {e}")
+    started = time.perf_counter()
+    report = {
+        "bucket": bucket_name,
+        "prefix": prefix,
+        "dry_run": dry_run,
+        "listed": 0,
+        "deleted": 0,
+        "failed": 0,
+        "batches": 0,
+        "errors": [],
+    }
+
+    def collect(future):
+        result = future.result()
+        report["deleted"] += result["deleted"]
+        report["failed"] += len(result["errors"])
+        room = MAX_REPORTED_ERRORS - len(report["errors"])
+        report["errors"].extend(result["errors"][:room])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        for keys in iter_key_batches(s3, bucket_name, prefix):
+            report["listed"] += len(keys)
+            report["batches"] += 1
+            if dry_run:
+                continue
+
+            # 一覧の取得が削除より先行しすぎないよう、実行中のバッチ数を制限する
+            if len(in_flight) >= max_workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            in_flight.add(executor.submit(delete_batch, s3, bucket_name, keys, max_attempts))
+
+        for future in in_flight:
+            collect(future)
+
+    report["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+
+    if report["failed"]:
+        logger.error(f"S3クリーンアップで削除できなかったオブジェクトがあります: {json.dumps(report)}")
+    else:
+        logger.info(f"S3クリーンアップが完了しました。削除されたオブジェクト総数: {report['deleted']}")
+    return report
 
 
 def lambda_handler(event, context):
@@ -64,8 +171,12 @@ def lambda_handler(event, context):
         final_cleanup_key = cleanup_base_prefix + "/"
         logger.info(f"Identified execution-wide cleanup key: {final_cleanup_key}")
 
-        # 関連する S3 上のすべてのデータを削除
-        delete_s3_prefix(bucket_name, final_cleanup_key)
+        # 関連する S3 上のすべてのデータを削除(イベントの dry_run で削除対象の確認のみも可能)
+        # イベントの値は文字列("true"/"false")でも渡されるため、環境変数と同じく文字列として判定する
+        dry_run = str(event.get("dry_run", CLEANUP_DRY_RUN)).lower() == "true"
+        event["cleanup_report"] = delete_s3_prefix(
+            bucket_name, final_cleanup_key, dry_run=dry_run
+        )
 
         return event
 
@@ -1,57 +1,106 @@
 import sys
 import json
-from datetime import datetime
-
-from awsglue.transforms import *
-from awsgluedq.transforms import EvaluateDataQuality
-from awsglue.dynamicframe import DynamicFrame
-from awsglue.utils import getResolvedOptions
-from pyspark.context import SparkContext
-from awsglue.context import GlueContext
-from awsglue.job import Job
-from pyspark.sql import functions as F
-from pyspark.sql.types import StructType, StructField, StringType, LongType
-from pyspark.sql.window import Window
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+
+from src.glue.glue_catalog import register_table_partitions
+from src.glue.glue_dq import RULESETS, ruleset_to_dqdl, run_spark_dq
+from src.glue.glue_metrics import emit_metrics, emit_sink_metrics
+from src.glue.glue_processed import (
+    PARTITION_COLUMNS,
+    SNAPSHOT_COLUMNS,
+    SNAPSHOT_PARTITION_COLUMNS,
+    TABLE_KEYS,
+    build_snapshot,
+    channel_id_from_path,
+    merge_partitions,
+    snapshot_path,
+    table_path,
+    write_partitions,
+    write_snapshot,
+)
+from src.glue.glue_profile import (
+    apply_profile,
+    choose_profile,
+    coalesce_for_output,
+    list_input_files,
+)
+from src.glue.glue_sinks import SinkError, run_sink_stages
+from src.glue.glue_transforms import (
+    channel_schema,
+    video_schema,
+    comment_schema,
+    materialize,
+    read_raw,
+    release,
+    transform_channel,
+    transform_video,
+    transform_comment,
+)
+
+# awsglue / awsgluedq はGlueの実行環境にのみ存在するため、使用する関数内で読み込む。
+# (加工処理は glue_transforms に分離し、ローカルのPySparkでテスト・計測できるようにしている)
 
 # @params: [JOB_NAME]
-args = getResolvedOptions(
-    sys.argv,
-    [
-        "JOB_NAME",
-        "s3_input_path_channel",  # 動的
-        "s3_input_path_video",  # 動的
-        "s3_input_path_comment",  # 動的
-        "processed_base_path",  # 動的
-        "report_base_path",  # 動的
-        "artist_name_slug",  # 動的
-        "correlation_id",  # 動的
-        "gcp_project_id",  # 静的
-        "bq_dataset",  # 静的
-    ],
-)
+JOB_ARGUMENTS = [
+    "JOB_NAME",
+    "s3_input_path_channel",  # 動的
+    "s3_input_path_video",  # 動的
+    "s3_input_path_comment",  # 動的
+    "processed_base_path",  # 動的
+    "report_base_path",  # 動的
+    "artist_name_slug",  # 動的
+    "correlation_id",  # 動的
+    "gcp_project_id",  # 静的
+    "bq_dataset",  # 静的
+]
+
+# 省略可能な引数と既定値
+OPTIONAL_JOB_ARGUMENTS = {
+    "raw_format": None,  # json / parquet(省略時は入力パスの拡張子から判別)
+    "materialize": "persist",  # persist / checkpoint / local_checkpoint / none
+    "storage_level": "MEMORY_AND_DISK",
+    "checkpoint_dir": None,
+    "execution_profile": "auto",  # auto(入力データ量から選択) / default(Sparkの既定値)
+    "sink_parallelism": "3",  # S3・BigQueryへの出力を同時に実行する数
+    "dq_backend": "spark",  # spark(glue_dqで1回の集計で評価) / glue(Glue Data Quality)
+    # partitioned: 日付パーティションのprocessed zoneへ差分マージし、BigQueryへは差分のみ出力する
+    # workflow   : ワークフローごとのprefixへ全件を上書きし、BigQueryへも全件を出力する(従来の動作)
+    "processed_layout": "partitioned",
+    "processed_zone_path": None,  # 省略時は s3://<processed_base_pathのバケット>/processed/
+    "channel_id": None,  # 省略時は processed_base_path の channel=<id> から取得する
+    "snapshot_date": None,  # 統計値スナップショットの日付(YYYY-MM-DD)。省略時は実行日(UTC)
+    "glue_database": None,  # 書き込んだテーブル・パーティションを登録するデータベース。省略時は登録しない
+}
+
+# ログ・メトリクスに付与するジョブ情報(main()で設定する)
+LOG_CONTEXT = {"service": None, "correlation_id": None, "artist_name_slug": None}
 
-sc = SparkContext()
-glueContext = GlueContext(sc)
-spark = glueContext.spark_session
-job = Job(glueContext)
-job.init(args["JOB_NAME"], args)
-spark.sparkContext.setLogLevel("ERROR")
-spark_logger = glueContext.get_logger()
 
 # ////////////
-# 環境変数呼び出し
+# 引数の読み込み
 # ////////////
-JOB_NAME = args["JOB_NAME"]
-S3_INPUT_PATH_CHANNEL = args["s3_input_path_channel"]
-S3_INPUT_PATH_VIDEO = args["s3_input_path_video"]
-S3_INPUT_PATH_COMMENT = args["s3_input_path_comment"]
-PROCESSED_BASE_PATH = args["processed_base_path"]
-REPORT_BASE_PATH = args["report_base_path"]
-ARTIST_NAME_SLUG = args["artist_name_slug"]
+def resolve_args(argv):
+    from awsglue.utils import getResolvedOptions
+
+    args = getResolvedOptions(argv, JOB_ARGUMENTS)
 
-CORRELATION_ID = args["correlation_id"]
-GCP_PROJECT_ID = args["gcp_project_id"]
-BQ_DATASET = args["bq_dataset"]
+    # getResolvedOptionsは指定した引数が無いとエラーになるため、渡された引数のみ解決する
+    present = [name for name in OPTIONAL_JOB_ARGUMENTS if f"--{name}" in argv]
+    optional_args = getResolvedOptions(argv, present) if present else {}
+    for name, default in OPTIONAL_JOB_ARGUMENTS.items():
+        args[name] = optional_args.get(name, default)
+
+    # 生データの形式。引数が無い旧形式の呼び出しではパスの拡張子から判別する
+    if args["raw_format"] is None:
+        if args["s3_input_path_video"].endswith(".parquet"):
+            args["raw_format"] = "parquet"
+        else:
+            args["raw_format"] = "json"
+
+    return args
 
 
 # ////////////
@@ -61,8 +110,8 @@ def log_json(message, level="INFO", extra={}):
     log_data = {
         "timestamp": datetime.now().isoformat(),
         "log_level": level,
-        "service": JOB_NAME,
-        "correlation_id": CORRELATION_ID,
+        "service": LOG_CONTEXT["service"],
+        "correlation_id": LOG_CONTEXT["correlation_id"],
         "message": message,
     }
     log_data.update(extra)
@@ -70,43 +119,44 @@ def log_json(message, level="INFO", extra={}):
     print(json.dumps(log_data))
 
 
+# 処理段階ごとの所要時間を記録する。
+# metric を指定した場合は、段階名を metric としてEMFのメトリクスも出力する
+# (行数・バイト数は with の中で返される辞書に Rows / Bytes として設定する)
+@contextmanager
+def log_stage(stage, extra={}, metric=None):
+    log_json(f"{stage}を開始しました。", extra={"stage": stage, **extra})
+    values = {}
+    started = time.perf_counter()
+    try:
+        yield values
+    except Exception:
+        if metric is not None:
+            latency = round((time.perf_counter() - started) * 1000, 3)
+            emit_metrics(metric, {**values, "Latency": latency, "Errors": 1}, LOG_CONTEXT)
+        raise
+    elapsed_seconds = round(time.perf_counter() - started, 3)
+    log_json(
+        f"{stage}が完了しました。",
+        extra={"stage": stage, "elapsed_seconds": elapsed_seconds, **extra},
+    )
+    if metric is not None:
+        emit_metrics(
+            metric, {**values, "Latency": round(elapsed_seconds * 1000, 3), "Errors": 0}, LOG_CONTEXT
+        )
+
+
 # ////////////
 # DQの関数
 # ////////////
-def run_data_quality_check(df, glueContext, df_name, result_s3_prefix):
-    dyf_to_check = DynamicFrame.fromDF(df, glueContext, df_name)
+def run_glue_dq(df, glueContext, df_name, result_s3_prefix):
+    from awsgluedq.transforms import EvaluateDataQuality
+    from awsglue.dynamicframe import DynamicFrame
 
-    if df_name == "channel":
-        dqdl_ruleset = """
-        Rules = [
-            IsComplete "channel_id",
-            IsUnique "channel_id",
-            Completeness "published_at" >= 0.90
-        ]
-        """
-
-    elif df_name == "video":
-        dqdl_ruleset = """
-        Rules = [
-            IsComplete "video_id",
-            IsUnique "video_id",
-            Completeness "total_seconds" >= 0.90,
-            Completeness "published_at" >= 0.90
-        ]
-        """
-
-    elif df_name == "comment":
-        dqdl_ruleset = """
-        Rules = [
-            IsComplete "comment_id",
-            IsUnique "comment_id",
-            Completeness "published_at" >= 0.90
-        ]
-        """
+    dyf_to_check = DynamicFrame.fromDF(df, glueContext, df_name)
 
     dq_results = EvaluateDataQuality().process_rows(
         frame=dyf_to_check,
-        ruleset=dqdl_ruleset,
+        ruleset=ruleset_to_dqdl(RULESETS[df_name]),
         publishing_options={
             "dataQualityEvaluationContext": f"{df_name}",
             "enableDataQualityCloudWatchMetrics": False,
@@ -119,17 +169,35 @@ def run_data_quality_check(df, glueContext, df_name, result_s3_prefix):
         },
     )
 
+    outcomes_dyf = dq_results[EvaluateDataQuality.DATA_QUALITY_RULE_OUTCOMES_KEY]
+    return [
+        {
+            "Rule": row["Rule"],
+            "Outcome": row["Outcome"],
+            "FailureReason": row["FailureReason"],
+            "EvaluatedMetrics": dict(row["EvaluatedMetrics"]),
+        }
+        for row in outcomes_dyf.toDF().collect()
+    ]
+
+
+# DQの実行方式
+# spark: ルールセットを1回の集計で評価し、レポートをresult_s3_prefixへ出力する(glue_dq)
+# glue : Glue Data Quality(EvaluateDataQuality)で評価する
+def run_data_quality_check(df, glueContext, df_name, result_s3_prefix, backend="spark"):
+    if backend == "spark":
+        outcomes = run_spark_dq(df, df_name, result_s3_prefix)
+    elif backend == "glue":
+        outcomes = run_glue_dq(df, glueContext, df_name, result_s3_prefix)
+    else:
+        raise ValueError(f"不明なDQの実行方式です: {backend}")
+
     # ////////////
     # GlueJobの停止設定(DQを満たさない場合Jobの停止)
     # ////////////
-    dq_failed_rules = []
-
-    outcomes_dyf = dq_results[EvaluateDataQuality.DATA_QUALITY_RULE_OUTCOMES_KEY]
-    outcomes_df = outcomes_dyf.toDF()
-    dq_failed_count = outcomes_df.filter(F.col("Outcome") == "Failed").count()
+    dq_failed_rules = [outcome for outcome in outcomes if outcome["Outcome"] == "Failed"]
 
-    if dq_failed_count > 0:
-        dq_failed_rules = outcomes_df.filter(F.col("Outcome") == "Failed").collect()
+    if dq_failed_rules:
         for rule in dq_failed_rules:
             log_json(
                 "DQ Rule Failed. Data will NOT be committed.",
@@ -145,224 +213,346 @@ def run_data_quality_check(df, glueContext, df_name, result_s3_prefix):
 
     assert (
         len(dq_failed_rules) == 0
-    ), f"FATAL ERROR: The job failed due to failing DQ rules for {df_name}. Run ID: {CORRELATION_ID}. Pipeline interrupted."
+    ), f"FATAL ERROR: The job failed due to failing DQ rules for {df_name}. Run ID: {LOG_CONTEXT['correlation_id']}. Pipeline interrupted."
 
     return
 
 
 # ////////////
-# スキーマ設計
-# ////////////
-# channelデータのスキーマ設計
-channel_schema = StructType(
-    [
-        StructField("channel_id", StringType(), False),
-        StructField("channel_name", StringType(), False),
-        StructField("published_at", StringType(), False),
-        StructField("subscriber_count", LongType(), False),
-        StructField("total_views", LongType(), False),
-        StructField("video_count", LongType(), False),
-    ]
-)
-
-# videoデータのスキーマ設計
-video_schema = StructType(
-    [
-        StructField("video_id", StringType(), False),
-        StructField("title", StringType(), False),
-        StructField("published_at", StringType(), False),
-        StructField("view_count", LongType(), False),
-        StructField("like_count", LongType(), False),
-        StructField("comment_count", LongType(), False),
-        StructField("duration", StringType(), False),
-        StructField("tags", StringType(), False),
-    ]
-)
-
-# commentデータのスキーマ設計
-comment_schema = StructType(
-    [
-        StructField("video_id", StringType(), False),
-        StructField("comment_id", StringType(), False),
-        StructField("author_display_name", StringType(), False),
-        StructField("published_at", StringType(), False),
-        StructField("text_display", StringType(), False),
-        StructField("like_count", LongType(), False),
-    ]
-)
-
-# ////////////
-# データの読み込み
+# S3・BigQueryへの書き込み
 # ////////////
-log_json("GlueJobを開始します。S3からデータの読み込みを開始しました。")
-
-df_channel = spark.read.schema(channel_schema).json(S3_INPUT_PATH_CHANNEL)
-df_video = spark.read.schema(video_schema).json(S3_INPUT_PATH_VIDEO)
-df_comment = spark.read.schema(comment_schema).json(S3_INPUT_PATH_COMMENT)
+def write_processed(df, path):
+    df.write.mode("overwrite").parquet(path)
 
-log_json("S3からデータの読み込みが完了しました。")
-
-# ////////////
-# データ型変換
-# ////////////
-log_json("データ型の変換を開始しました。")
 
-# channelデータ型変更
-df_channel = df_channel.withColumn(
-    "published_at", F.col("published_at").cast("timestamp")
-)
+def write_bigquery(df, glueContext, gcp_project_id, table):
+    from awsglue.dynamicframe import DynamicFrame
 
-# videoデータ型変更
-df_video = df_video.withColumn("published_at", F.col("published_at").cast("timestamp"))
+    dynamic_frame = DynamicFrame.fromDF(df, glueContext, "converted_frame")
 
-# durationを秒数に変換
-df_video = df_video.withColumn(
-    "total_seconds",
-    (
-        F.coalesce(
-            F.regexp_extract(F.col("duration"), r"(\d+)H", 1).cast(LongType()), F.lit(0)
-        )
-        * 3600
-    )
-    + (
-        F.coalesce(
-            F.regexp_extract(F.col("duration"), r"(\d+)M", 1).cast(LongType()), F.lit(0)
-        )
-        * 60
+    glueContext.write_dynamic_frame.from_options(
+        frame=dynamic_frame,
+        connection_type="bigquery",
+        connection_options={
+            "connectionName": "bigquery-connector-spark-connection",
+            "parentProject": gcp_project_id,
+            "writeMethod": "direct",
+            "table": table,
+        },
     )
-    + (
-        F.coalesce(
-            F.regexp_extract(F.col("duration"), r"(\d+)S", 1).cast(LongType()), F.lit(0)
-        )
-    ),
-)
-
-# commentデータ型変更
-df_comment = df_comment.withColumn(
-    "published_at", F.col("published_at").cast("timestamp")
-)
 
-log_json("データ型の変換が完了しました。")
 
 # ////////////
-# 欠損、重複値処理(必ず欠損→重複の順番で処理を行う)
+# Glueデータカタログへの登録
 # ////////////
-log_json("欠損値、重複値の処理を開始しました。")
+def register_catalog(database, catalog_entries, glue=None):
+    if glue is None:
+        import boto3
 
-# 欠損値の処理
-df_channel = df_channel.filter(F.col("channel_id").isNotNull())
+        glue = boto3.client("glue")
 
-df_video = df_video.filter(
-    F.col("video_id").isNotNull() & F.col("published_at").isNotNull()
-)
-
-df_comment = df_comment.filter(
-    F.col("comment_id").isNotNull() & F.col("published_at").isNotNull()
-)
-
-# 重複値の処理
-window_channel = Window.partitionBy("channel_id").orderBy(F.col("published_at").desc())
-df_channel_ranked = df_channel.withColumn("rank", F.row_number().over(window_channel))
-df_channel = df_channel_ranked.filter(F.col("rank") == 1).drop("rank")
-
-window_video = Window.partitionBy("video_id").orderBy(F.col("published_at").desc())
-df_video_ranked = df_video.withColumn("rank", F.row_number().over(window_video))
-df_video = df_video_ranked.filter(F.col("rank") == 1).drop("rank")
-
-window_comment = Window.partitionBy("comment_id").orderBy(F.col("published_at").desc())
-df_comment_ranked = df_comment.withColumn("rank", F.row_number().over(window_comment))
-df_comment = df_comment_ranked.filter(F.col("rank") == 1).drop("rank")
-
-log_json("欠損値、重複値の処理が完了しました。")
-
-# ////////////
-# DataQualityの実行
-# ////////////
-log_json("データクオリティーの実施を開始しました。S3へレポートの出力を行います。")
-
-run_data_quality_check(
-    df_channel, glueContext, "channel", f"s3://{REPORT_BASE_PATH}channel/"
-)
-
-run_data_quality_check(df_video, glueContext, "video", f"s3://{REPORT_BASE_PATH}video/")
-
-run_data_quality_check(
-    df_comment, glueContext, "comment", f"s3://{REPORT_BASE_PATH}comment/"
-)
-
-log_json("データクオリティーの実施が完了しました。S3へレポートを出力しました。")
+    for table_name, location, schema, partition_columns, partitions in catalog_entries:
+        try:
+            result = register_table_partitions(
+                glue, database, table_name, location, schema, partition_columns, partitions
+            )
+        except Exception as e:
+            log_json(
+                "データカタログへの登録に失敗しました。定期実行のクローラーで補完されます。",
+                level="ERROR",
+                extra={"table": table_name, "error": f"{type(e).__name__}: {e}"},
+            )
+        else:
+            log_json("データカタログへ登録しました。", extra=result)
 
-# ////////////
-# S3へデータの格納
-# ////////////
-log_json("S3へ加工データの格納を開始しました。")
 
-df_channel.write.mode("overwrite").parquet(
-    f"s3://{PROCESSED_BASE_PATH}processed_channel"
-)
-df_video.write.mode("overwrite").parquet(f"s3://{PROCESSED_BASE_PATH}processed_video")
-df_comment.write.mode("overwrite").parquet(
-    f"s3://{PROCESSED_BASE_PATH}processed_comment"
-)
+def main(argv=None):
+    from pyspark import SparkConf
+    from pyspark.context import SparkContext
+    from awsglue.context import GlueContext
+    from awsglue.job import Job
 
-log_json("S3へ加工データの格納が完了しました。")
+    args = resolve_args(sys.argv if argv is None else argv)
 
-# ////////////
-# BigQueryへデータの格納
-# ////////////
-# BQへチャンネルデータの格納
-log_json("BigQueryへのチャンネルデータの書き込みを開始しました。")
-
-dynamic_channel = DynamicFrame.fromDF(df_channel, glueContext, "converted_frame")
-
-glueContext.write_dynamic_frame.from_options(
-    frame=dynamic_channel,
-    connection_type="bigquery",
-    connection_options={
-        "connectionName": "bigquery-connector-spark-connection",
-        "parentProject": GCP_PROJECT_ID,
-        "writeMethod": "direct",
-        "table": f"{BQ_DATASET}.{ARTIST_NAME_SLUG}_channel",
-    },
-)
+    # 出力処理を並列に実行するため、FAIRスケジューラーを使用する
+    sc = SparkContext(conf=SparkConf().set("spark.scheduler.mode", "FAIR"))
+    glueContext = GlueContext(sc)
+    spark = glueContext.spark_session
+    job = Job(glueContext)
+    job.init(args["JOB_NAME"], args)
+    spark.sparkContext.setLogLevel("ERROR")
 
-log_json("BigQueryへのチャンネルデータの書き込みを完了しました。")
+    # ////////////
+    # 環境変数呼び出し
+    # ////////////
+    JOB_NAME = args["JOB_NAME"]
+    S3_INPUT_PATH_CHANNEL = args["s3_input_path_channel"]
+    S3_INPUT_PATH_VIDEO = args["s3_input_path_video"]
+    S3_INPUT_PATH_COMMENT = args["s3_input_path_comment"]
+    PROCESSED_BASE_PATH = args["processed_base_path"]
+    REPORT_BASE_PATH = args["report_base_path"]
+    ARTIST_NAME_SLUG = args["artist_name_slug"]
+
+    CORRELATION_ID = args["correlation_id"]
+    GCP_PROJECT_ID = args["gcp_project_id"]
+    BQ_DATASET = args["bq_dataset"]
+    RAW_FORMAT = args["raw_format"]
+    MATERIALIZE = args["materialize"]
+    STORAGE_LEVEL = args["storage_level"]
+    CHECKPOINT_DIR = args["checkpoint_dir"]
+    EXECUTION_PROFILE = args["execution_profile"]
+    SINK_PARALLELISM = int(args["sink_parallelism"])
+    DQ_BACKEND = args["dq_backend"]
+    PROCESSED_LAYOUT = args["processed_layout"]
+    PROCESSED_ZONE_PATH = (
+        args["processed_zone_path"]
+        or f"s3://{PROCESSED_BASE_PATH.split('/')[0]}/processed/"
+    )
+    CHANNEL_ID = args["channel_id"] or channel_id_from_path(PROCESSED_BASE_PATH)
+    SNAPSHOT_DATE = args["snapshot_date"] or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    GLUE_DATABASE = args["glue_database"]
+    # partitioned では上書き前の既存データを差分の計算まで保持する必要があるため、
+    # Executorの削除(オートスケーリング)で失われるローカルチェックポイントではなく
+    # S3へのチェックポイントを必須とする
+    if PROCESSED_LAYOUT == "partitioned" and not CHECKPOINT_DIR:
+        raise ValueError("processed_layout=partitioned では --checkpoint_dir の指定が必要です。")
+
+    LOG_CONTEXT.update(
+        service=JOB_NAME, correlation_id=CORRELATION_ID, artist_name_slug=ARTIST_NAME_SLUG
+    )
 
-# BQへビデオデータの格納
-log_json("BigQueryへのビデオデータの書き込みを開始しました。")
+    log_json("GlueJobを開始します。")
 
-dynamic_video = DynamicFrame.fromDF(df_video, glueContext, "converted_frame")
+    # ////////////
+    # 実行プロファイルの選択
+    # ////////////
+    # 入力データ量に応じてシャッフルのパーティション数や出力ファイル数を決める
+    # (小規模なチャンネルで既定の200パーティション・大量の小さなファイルになるのを防ぐ)
+    profile = None
+    input_bytes = None
+    if EXECUTION_PROFILE == "auto":
+        with log_stage("実行プロファイルの選択", metric="profile") as metrics:
+            input_paths = {
+                "channel": S3_INPUT_PATH_CHANNEL,
+                "video": S3_INPUT_PATH_VIDEO,
+                "comment": S3_INPUT_PATH_COMMENT,
+            }
+            # コメントは接頭辞(パートファイル)で渡されるため、圧縮の有無は一覧のキーから判定する
+            input_files = {table: list_input_files(path) for table, path in input_paths.items()}
+            input_sizes = {
+                table: sum(size for _, size in files) for table, files in input_files.items()
+            }
+            profile = choose_profile(
+                input_sizes,
+                {table: [key for key, _ in files] for table, files in input_files.items()},
+                RAW_FORMAT,
+            )
+            # partitioned の出力ファイル数はパーティション(チャンネル・公開日)ごとに1つで決まるため、
+            # テーブルごとの出力ファイル数は workflow レイアウトでのみ使用する
+            if PROCESSED_LAYOUT == "partitioned":
+                profile.pop("output_files")
+            apply_profile(spark, profile)
+            input_bytes = sum(input_sizes.values())
+            metrics["Bytes"] = input_bytes
+        log_json("実行プロファイルを適用しました。", extra={"execution_profile": profile})
 
-glueContext.write_dynamic_frame.from_options(
-    frame=dynamic_video,
-    connection_type="bigquery",
-    connection_options={
-        "connectionName": "bigquery-connector-spark-connection",
-        "parentProject": GCP_PROJECT_ID,
-        "writeMethod": "direct",
-        "table": f"{BQ_DATASET}.{ARTIST_NAME_SLUG}_video",
-    },
-)
+    # ////////////
+    # データの読み込み、データ型変換、欠損・重複値処理
+    # ////////////
+    # (ここでは処理内容の定義のみで、実際の計算は永続化の段階で行われる)
+    with log_stage(
+        "S3からのデータの読み込みと加工処理の定義", extra={"raw_format": RAW_FORMAT}, metric="read"
+    ) as metrics:
+        metrics["Bytes"] = input_bytes
+        df_channel = transform_channel(
+            read_raw(spark, channel_schema, S3_INPUT_PATH_CHANNEL, RAW_FORMAT)
+        )
+        df_video = transform_video(
+            read_raw(spark, video_schema, S3_INPUT_PATH_VIDEO, RAW_FORMAT)
+        )
+        df_comment = transform_comment(
+            read_raw(spark, comment_schema, S3_INPUT_PATH_COMMENT, RAW_FORMAT)
+        )
 
-log_json("BigQueryへのビデオデータの書き込みを完了しました。")
+    # ////////////
+    # 加工済みデータの永続化
+    # ////////////
+    # DQ・S3・BigQueryの各出力で読み込みと重複排除が再実行されないよう、1回だけ計算して保持する
+    materialize_options = {
+        "mode": MATERIALIZE,
+        "storage_level": STORAGE_LEVEL,
+        "checkpoint_dir": CHECKPOINT_DIR,
+    }
+    with log_stage("加工済みデータの永続化", extra=materialize_options, metric="transform") as metrics:
+        df_channel = materialize(df_channel, **materialize_options)
+        df_video = materialize(df_video, **materialize_options)
+        df_comment = materialize(df_comment, **materialize_options)
+
+        # 永続化したデータの件数(永続化しない場合は再計算になるため数えない)
+        if MATERIALIZE != "none":
+            row_counts = {
+                "channel": df_channel.count(),
+                "video": df_video.count(),
+                "comment": df_comment.count(),
+            }
+            metrics["Rows"] = sum(row_counts.values())
+            for table, rows in row_counts.items():
+                emit_metrics(f"transform_{table}", {"Rows": rows}, LOG_CONTEXT)
+
+    retained = []
+    try:
+        # ////////////
+        # DataQualityの実行
+        # ////////////
+        with log_stage(
+            "データクオリティーの実施(S3へレポートを出力)",
+            extra={"dq_backend": DQ_BACKEND},
+            metric="dq",
+        ):
+            run_data_quality_check(
+                df_channel,
+                glueContext,
+                "channel",
+                f"s3://{REPORT_BASE_PATH}channel/",
+                backend=DQ_BACKEND,
+            )
 
-# BQへコメントデータの格納
-log_json("BigQueryへのコメントデータの書き込みを開始しました。")
+            run_data_quality_check(
+                df_video,
+                glueContext,
+                "video",
+                f"s3://{REPORT_BASE_PATH}video/",
+                backend=DQ_BACKEND,
+            )
 
-dynamic_comment = DynamicFrame.fromDF(df_comment, glueContext, "converted_frame")
+            run_data_quality_check(
+                df_comment,
+                glueContext,
+                "comment",
+                f"s3://{REPORT_BASE_PATH}comment/",
+                backend=DQ_BACKEND,
+            )
 
-glueContext.write_dynamic_frame.from_options(
-    frame=dynamic_comment,
-    connection_type="bigquery",
-    connection_options={
-        "connectionName": "bigquery-connector-spark-connection",
-        "parentProject": GCP_PROJECT_ID,
-        "writeMethod": "direct",
-        "table": f"{BQ_DATASET}.{ARTIST_NAME_SLUG}_comment",
-    },
-)
+        # ////////////
+        # S3・BigQueryへデータの格納
+        # ////////////
+        # テーブルごとのS3・BigQueryへの出力は互いに独立しているため並列に実行する。
+        # 1つでも失敗した場合はSinkErrorとなり、job.commit()は実行されない。
+        # partitioned の場合、processed zoneのパーティションの書き換えはBigQueryへの差分出力が
+        # すべて成功した後に行う。(先に書き換えると、BigQueryが失敗した際に再実行時の差分が
+        # 書き換え後のデータとの比較となり、今回の変更が失われるため。
+        # 書き換えに失敗した場合は再実行で同じ差分を再度出力する)
+        frames = {"channel": df_channel, "video": df_video, "comment": df_comment}
+        sinks = []
+        partition_sinks = []
+        # データカタログへ登録する (テーブル名, 場所, スキーマ, パーティション列, パーティションの値)
+        catalog_entries = []
+        if PROCESSED_LAYOUT == "partitioned":
+            # 今回のデータを含むパーティションを既存データとマージし、新規・変更行のみをBigQueryへ出力する
+            with log_stage(
+                "processed zoneとの差分マージ",
+                extra={"processed_zone_path": PROCESSED_ZONE_PATH},
+                metric="merge",
+            ):
+                for table, df in frames.items():
+                    path = table_path(PROCESSED_ZONE_PATH, table)
+                    merged, delta, existing, partitions = merge_partitions(
+                        spark, df, path, TABLE_KEYS[table], CHANNEL_ID, CHECKPOINT_DIR
+                    )
+                    retained.extend(existing)
+                    catalog_entries.append(
+                        (f"processed_{table}", path, merged.schema, PARTITION_COLUMNS, partitions)
+                    )
+                    partition_sinks.append(
+                        (f"s3_processed_{table}", partial(write_partitions, merged, path))
+                    )
+                    frames[table] = delta
+        else:
+            for table, df in frames.items():
+                sinks.append(
+                    (
+                        f"s3_processed_{table}",
+                        partial(
+                            write_processed,
+                            coalesce_for_output(df, profile, table),
+                            f"s3://{PROCESSED_BASE_PATH}processed_{table}",
+                        ),
+                    )
+                )
+
+        # 再生数・登録者数などの統計値は実行日ごとのスナップショットとして追記する
+        for table in SNAPSHOT_COLUMNS:
+            snapshot = build_snapshot(
+                {"channel": df_channel, "video": df_video}[table], table, CHANNEL_ID, SNAPSHOT_DATE
+            )
+            sinks.append(
+                (
+                    f"s3_snapshot_{table}",
+                    partial(
+                        write_snapshot, snapshot, snapshot_path(PROCESSED_ZONE_PATH, table), table
+                    ),
+                )
+            )
+            catalog_entries.append(
+                (
+                    f"{table}_stats_snapshot",
+                    snapshot_path(PROCESSED_ZONE_PATH, table),
+                    snapshot.schema,
+                    SNAPSHOT_PARTITION_COLUMNS,
+                    [(SNAPSHOT_DATE, CHANNEL_ID)],
+                )
+            )
 
-log_json("BigQueryへのコメントデータの書き込みを完了しました。")
-log_json("Glueジョブが正常に完了しました。")
+        for table, df in frames.items():
+            sinks.append(
+                (
+                    f"bigquery_{table}",
+                    partial(
+                        write_bigquery,
+                        df,
+                        glueContext,
+                        GCP_PROJECT_ID,
+                        f"{BQ_DATASET}.{ARTIST_NAME_SLUG}_{table}",
+                    ),
+                )
+            )
 
-job.commit()
+        with log_stage(
+            "S3・BigQueryへの加工データの格納",
+            extra={"sink_parallelism": SINK_PARALLELISM},
+            metric="sinks",
+        ):
+            try:
+                sink_results = run_sink_stages(
+                    spark,
+                    [sinks, partition_sinks],
+                    max_parallelism=SINK_PARALLELISM,
+                    log=log_json,
+                )
+            except SinkError as e:
+                emit_sink_metrics(e.results, LOG_CONTEXT)
+                raise
+            emit_sink_metrics(sink_results, LOG_CONTEXT)
+        log_json("すべての出力処理が完了しました。", extra={"sinks": sink_results})
+
+        # ////////////
+        # Glueデータカタログへの登録
+        # ////////////
+        # 今回書き込んだパーティションだけを登録する(クローラーは定期的な整合処理としてのみ実行する)。
+        # 登録に失敗してもデータの書き込みは完了しているため、ジョブは失敗させずにログへ記録する。
+        if GLUE_DATABASE:
+            with log_stage(
+                "Glueデータカタログへの登録", extra={"glue_database": GLUE_DATABASE}, metric="catalog"
+            ):
+                register_catalog(GLUE_DATABASE, catalog_entries)
+    finally:
+        # すべての出力が終わった(または失敗した)時点で保持していたデータを解放する
+        release(df_channel, df_video, df_comment, *retained)
+
+    log_json("Glueジョブが正常に完了しました。")
+
+    job.commit()
+
+
+if __name__ == "__main__":
+    main()
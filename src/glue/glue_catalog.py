@@ -0,0 +1,125 @@
+from pyspark.sql.types import (
+    DateType,
+    DoubleType,
+    IntegerType,
+    LongType,
+    StringType,
+    TimestampType,
+)
+
+# ////////////
+# Glueデータカタログへの直接登録
+# ////////////
+# ジョブが書き込んだテーブルとパーティションを、クローラーを実行せずにデータカタログへ登録する。
+# テーブルの列は書き込んだDataFrameのスキーマ(glue_transformsのStructTypeから加工したもの)から作成する。
+# クローラーは登録漏れを補う定期的な整合処理としてのみ使用する。
+HIVE_TYPES = {
+    StringType: "string",
+    LongType: "bigint",
+    IntegerType: "int",
+    DoubleType: "double",
+    TimestampType: "timestamp",
+    DateType: "date",
+}
+
+# BatchCreatePartitionの1回あたりの上限
+MAX_PARTITIONS_PER_REQUEST = 100
+
+
+def hive_columns(schema, exclude=()):
+    return [
+        {"Name": field.name, "Type": HIVE_TYPES[type(field.dataType)]}
+        for field in schema.fields
+        if field.name not in exclude
+    ]
+
+
+def storage_descriptor(location, columns):
+    return {
+        "Columns": columns,
+        "Location": location,
+        "InputFormat": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+        "OutputFormat": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+        "SerdeInfo": {
+            "SerializationLibrary": "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe",
+            "Parameters": {"serialization.format": "1"},
+        },
+    }
+
+
+def ensure_table(glue, database, table_name, location, schema, partition_columns):
+    partition_keys = [
+        {"Name": column, "Type": HIVE_TYPES[type(schema[column].dataType)]}
+        for column in partition_columns
+    ]
+    table_input = {
+        "Name": table_name,
+        "TableType": "EXTERNAL_TABLE",
+        "Parameters": {"classification": "parquet", "EXTERNAL": "TRUE"},
+        "StorageDescriptor": storage_descriptor(
+            location, hive_columns(schema, exclude=partition_columns)
+        ),
+        "PartitionKeys": partition_keys,
+    }
+
+    try:
+        current = glue.get_table(DatabaseName=database, Name=table_name)["Table"]
+    except glue.exceptions.EntityNotFoundException:
+        glue.create_table(DatabaseName=database, TableInput=table_input)
+        return "created"
+
+    # 列が変わった場合(列の追加など)のみ定義を更新する
+    if (
+        current["StorageDescriptor"]["Columns"] != table_input["StorageDescriptor"]["Columns"]
+        or current.get("PartitionKeys", []) != partition_keys
+    ):
+        glue.update_table(DatabaseName=database, TableInput=table_input)
+        return "updated"
+    return "unchanged"
+
+
+def partition_location(location, partition_columns, values):
+    path = "/".join(f"{column}={value}" for column, value in zip(partition_columns, values))
+    return f"{location.rstrip('/')}/{path}/"
+
+
+def register_partitions(glue, database, table_name, location, schema, partition_columns, partitions):
+    # partitions はパーティション列の値のタプルのリスト。登録済みのパーティションはそのまま残す
+    columns = hive_columns(schema, exclude=partition_columns)
+    partition_inputs = [
+        {
+            "Values": [str(value) for value in values],
+            "StorageDescriptor": storage_descriptor(
+                partition_location(location, partition_columns, values), columns
+            ),
+        }
+        for values in sorted(set(partitions), key=lambda values: [str(value) for value in values])
+        # 値がNULLのパーティション(__HIVE_DEFAULT_PARTITION__)は登録しない
+        if all(value is not None for value in values)
+    ]
+
+    created, errors = 0, []
+    for start in range(0, len(partition_inputs), MAX_PARTITIONS_PER_REQUEST):
+        chunk = partition_inputs[start:start + MAX_PARTITIONS_PER_REQUEST]
+        response = glue.batch_create_partition(
+            DatabaseName=database, TableName=table_name, PartitionInputList=chunk
+        )
+        failed = [
+            error
+            for error in response.get("Errors", [])
+            if error["ErrorDetail"]["ErrorCode"] != "AlreadyExistsException"
+        ]
+        errors.extend(failed)
+        created += len(chunk) - len(response.get("Errors", []))
+
+    if errors:
+        raise RuntimeError(f"パーティションの登録に失敗しました({table_name}): {errors}")
+    return {"table": table_name, "requested": len(partition_inputs), "created": created}
+
+
+def register_table_partitions(glue, database, table_name, location, schema, partition_columns, partitions):
+    table_status = ensure_table(glue, database, table_name, location, schema, partition_columns)
+    result = register_partitions(
+        glue, database, table_name, location, schema, partition_columns, partitions
+    )
+    return {**result, "table_status": table_status}
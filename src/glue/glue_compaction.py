@@ -0,0 +1,447 @@
+import argparse
+import io
+import json
+import os
+import re
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+# ////////////
+# ワークフローごとの加工済みデータの小ファイル統合(コンパクション)
+# ////////////
+# channel=<id>/workflow=<id>/processed_data/processed_<table>/ の小さなParquetファイルを、
+# チャンネル・テーブルごとに目標サイズのファイルへまとめる(Glue Python shellジョブ、またはローカルで実行)。
+#
+#   channel=<id>/compacted/processed_<table>/data/<compaction_id>/part-00000.parquet
+#   channel=<id>/compacted/processed_<table>/_manifest/v00000001.json   (現在のファイル一覧。最大の版が有効)
+#   channel=<id>/compacted/processed_<table>/_symlink_format_manifest/manifest   (Athena用)
+#
+# 統合後のデータは、データカタログの compacted_processed_<table> テーブル(SymlinkTextInputFormat、
+# channel_id でパーティション分割し、パーティションの場所はチャンネルごとの _symlink_format_manifest/)から読む。
+# 旧レイアウトの読み手はこのテーブルへ移行する(統合元の workflow=<id>/ 配下は保持期間の後に削除されるため、
+# クローラーが作成したテーブルからは統合済みのワークフローのデータが見えなくなる)。
+# compacted/ 配下はクローラーの対象から除外している。
+#
+# - 統合後のファイルの一覧は新しい版のマニフェストを1回のPUTで作成して切り替える(読み手は旧版か新版のどちらかを見る)。
+#   版の作成は条件付き書き込み(IfNoneMatch)で行い、同時に実行されたコンパクションとの競合を検出する。
+# - 取り込み中のワークフローを読まないよう、_SUCCESSがあり、一定時間更新のないディレクトリのみ対象とする。
+# - 統合元のファイルはすぐには削除せず、保持期間を過ぎた後のコンパクションで削除する(実行中のクエリを壊さないため)。
+#   カタログのテーブルを登録しない実行(--glue_database の指定なし)では、読み手がいないため統合元を削除しない。
+# - 統合後の行には元のディレクトリを示す workflow 列を付与する。
+#
+# 対象は旧レイアウト(--processed_layout=workflow)の出力のみ。
+# partitioned レイアウト(processed/<table>/channel_id=/published_date=)は、Glueジョブが実行のたびに
+# 対象パーティションを1ファイルに書き直すため小ファイルが溜まらず、このジョブの対象外とする。
+# そのためTerraformでは定期実行を既定で無効にしている(旧レイアウトを使う場合のみ有効にする)。
+TABLES = ["channel", "video", "comment"]
+
+DEFAULT_TARGET_BYTES = 128 * 1024 * 1024
+DEFAULT_MIN_AGE = timedelta(hours=6)
+DEFAULT_RETENTION = timedelta(hours=24)
+
+
+class ConcurrentCompactionError(Exception):
+    pass
+
+
+def log_json(message, level="INFO", extra={}):
+    log_data = {
+        "timestamp": datetime.now().isoformat(),
+        "log_level": level,
+        "service": "youtube-processed-compaction",
+        "message": message,
+    }
+    log_data.update(extra)
+
+    print(json.dumps(log_data, ensure_ascii=False, default=str))
+
+
+# ////////////
+# S3の一覧取得
+# ////////////
+def list_objects(s3, bucket, prefix):
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get("Contents", []))
+    return objects
+
+
+def list_prefixes(s3, bucket, prefix):
+    prefixes = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        prefixes.extend(item["Prefix"] for item in page.get("CommonPrefixes", []))
+    return prefixes
+
+
+def compacted_prefix(channel_prefix, table):
+    return f"{channel_prefix}compacted/processed_{table}/"
+
+
+# 統合対象のワークフローのディレクトリ(書き込みが完了し、min_age以上更新のないもの)
+def find_sealed_sources(s3, bucket, channel_prefix, table, min_age, now):
+    sources = []
+    for workflow_prefix in list_prefixes(s3, bucket, f"{channel_prefix}workflow="):
+        prefix = f"{workflow_prefix}processed_data/processed_{table}/"
+        objects = list_objects(s3, bucket, prefix)
+        if not objects:
+            continue
+
+        names = {obj["Key"][len(prefix):] for obj in objects}
+        last_modified = max(obj["LastModified"] for obj in objects)
+        if "_SUCCESS" not in names or now - last_modified < min_age:
+            continue
+
+        sources.append(
+            {
+                "prefix": prefix,
+                "workflow": re.search(r"workflow=([^/]+)/", workflow_prefix).group(1),
+                "keys": [obj["Key"] for obj in objects],
+                "files": [
+                    {"key": obj["Key"], "size": obj["Size"]}
+                    for obj in objects
+                    if obj["Key"].endswith(".parquet")
+                ],
+            }
+        )
+    return sources
+
+
+# ////////////
+# マニフェスト
+# ////////////
+def load_manifest(s3, bucket, table_prefix):
+    keys = sorted(
+        obj["Key"]
+        for obj in list_objects(s3, bucket, f"{table_prefix}_manifest/")
+        if obj["Key"].endswith(".json")
+    )
+    if not keys:
+        return {"version": 0, "files": [], "sources": [], "retired": []}
+    body = s3.get_object(Bucket=bucket, Key=keys[-1])["Body"].read()
+    return json.loads(body)
+
+
+def publish_manifest(s3, bucket, table_prefix, manifest):
+    key = f"{table_prefix}_manifest/v{manifest['version']:08d}.json"
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(manifest, ensure_ascii=False).encode("utf-8"),
+            ContentType="application/json",
+            IfNoneMatch="*",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+            raise ConcurrentCompactionError(
+                f"同じ版のマニフェストが既に作成されています: s3://{bucket}/{key}"
+            ) from e
+        raise
+
+    # AthenaのSymlinkTextInputFormat用(1回のPUTで置き換える)
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{table_prefix}_symlink_format_manifest/manifest",
+        Body="".join(f"s3://{bucket}/{file['key']}\n" for file in manifest["files"]).encode("utf-8"),
+    )
+    return key
+
+
+def manifest_files(s3, bucket, channel_prefix, table):
+    return [file["key"] for file in load_manifest(s3, bucket, compacted_prefix(channel_prefix, table))["files"]]
+
+
+# ////////////
+# ファイルの統合
+# ////////////
+# ファイルをキー順に並べ、合計サイズが目標を超えない単位にまとめる(目標以上のファイルは単独)
+def plan_bins(files, target_bytes):
+    bins, current, current_bytes = [], [], 0
+    for file in sorted(files, key=lambda f: f["key"]):
+        if current and current_bytes + file["size"] > target_bytes:
+            bins.append(current)
+            current, current_bytes = [], 0
+        current.append(file)
+        current_bytes += file["size"]
+    if current:
+        bins.append(current)
+    return bins
+
+
+def read_parquet(s3, bucket, key):
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    return pq.read_table(io.BytesIO(body))
+
+
+def conform_batch(batch, schema):
+    # 統合後のスキーマに合わせて列を揃える(無い列はnull、型は昇格後の型へ変換する)
+    columns = [
+        batch.column(field.name).cast(field.type)
+        if field.name in batch.schema.names
+        else pa.nulls(batch.num_rows, field.type)
+        for field in schema
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def rewrite_bin(s3, bucket, files, output_key):
+    # 1GBのPython shellでも処理できるよう、統合元は一時ディレクトリへ落としてから行グループ単位で書き出す
+    # (メモリに載るのは1行グループ分のみ)
+    with tempfile.TemporaryDirectory() as workdir:
+        sources = []
+        for index, file in enumerate(files):
+            local_path = os.path.join(workdir, f"source-{index:05d}.parquet")
+            s3.download_file(bucket, file["key"], local_path)
+            parquet_file = pq.ParquetFile(local_path)
+            sources.append((file, parquet_file))
+
+        schemas = []
+        for file, parquet_file in sources:
+            schema = parquet_file.schema_arrow
+            if "workflow" not in schema.names:
+                schema = schema.append(pa.field("workflow", pa.string()))
+            schemas.append(schema)
+        schema = pa.unify_schemas(schemas, promote_options="default")
+
+        output_path = os.path.join(workdir, "output.parquet")
+        rows = 0
+        # Sparkの出力と同じ物理型(INT96)でタイムスタンプを書き込む
+        with pq.ParquetWriter(
+            output_path, schema, compression="snappy", use_deprecated_int96_timestamps=True
+        ) as writer:
+            for file, parquet_file in sources:
+                for batch in parquet_file.iter_batches():
+                    if "workflow" not in batch.schema.names:
+                        batch = batch.append_column(
+                            "workflow", pa.array([file["workflow"]] * batch.num_rows, pa.string())
+                        )
+                    writer.write_batch(conform_batch(batch, schema))
+                    rows += batch.num_rows
+                parquet_file.close()
+
+        size = os.path.getsize(output_path)
+        s3.upload_file(output_path, bucket, output_key)
+    return {"key": output_key, "size": size, "rows": rows}, schema
+
+
+# ////////////
+# 統合後のデータのカタログ登録
+# ////////////
+SYMLINK_INPUT_FORMAT = "org.apache.hadoop.hive.ql.io.SymlinkTextInputFormat"
+SYMLINK_OUTPUT_FORMAT = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
+PARQUET_SERDE = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+
+
+def hive_type(arrow_type):
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "string"
+    if pa.types.is_int64(arrow_type):
+        return "bigint"
+    if pa.types.is_integer(arrow_type):
+        return "int"
+    if pa.types.is_floating(arrow_type):
+        return "double"
+    if pa.types.is_boolean(arrow_type):
+        return "boolean"
+    if pa.types.is_timestamp(arrow_type):
+        return "timestamp"
+    if pa.types.is_date(arrow_type):
+        return "date"
+    return "string"
+
+
+def symlink_storage_descriptor(location, columns):
+    return {
+        "Columns": columns,
+        "Location": location,
+        "InputFormat": SYMLINK_INPUT_FORMAT,
+        "OutputFormat": SYMLINK_OUTPUT_FORMAT,
+        "SerdeInfo": {"SerializationLibrary": PARQUET_SERDE, "Parameters": {"serialization.format": "1"}},
+    }
+
+
+def register_compacted_table(glue, database, bucket, channel_prefix, table, schema):
+    table_name = f"compacted_processed_{table}"
+    # 既存の列は残し、新しい列だけを末尾に追加する(過去の統合済みファイルも読めるようにするため)
+    columns = [{"Name": field.name, "Type": hive_type(field.type)} for field in schema]
+    try:
+        current = glue.get_table(DatabaseName=database, Name=table_name)["Table"]
+    except glue.exceptions.EntityNotFoundException:
+        current = None
+
+    existing = current["StorageDescriptor"]["Columns"] if current else []
+    known = {column["Name"] for column in existing}
+    merged = existing + [column for column in columns if column["Name"] not in known]
+    table_input = {
+        "Name": table_name,
+        "TableType": "EXTERNAL_TABLE",
+        "Parameters": {"classification": "parquet", "EXTERNAL": "TRUE"},
+        "StorageDescriptor": symlink_storage_descriptor(f"s3://{bucket}/compacted_tables/{table_name}/", merged),
+        "PartitionKeys": [{"Name": "channel_id", "Type": "string"}],
+    }
+    if current is None:
+        glue.create_table(DatabaseName=database, TableInput=table_input)
+    elif merged != existing:
+        glue.update_table(DatabaseName=database, TableInput=table_input)
+
+    channel_id = channel_prefix.rstrip("/").split("=", 1)[1]
+    location = f"s3://{bucket}/{compacted_prefix(channel_prefix, table)}_symlink_format_manifest/"
+    response = glue.batch_create_partition(
+        DatabaseName=database,
+        TableName=table_name,
+        PartitionInputList=[
+            {"Values": [channel_id], "StorageDescriptor": symlink_storage_descriptor(location, merged)}
+        ],
+    )
+    errors = [
+        error for error in response.get("Errors", [])
+        if error["ErrorDetail"]["ErrorCode"] != "AlreadyExistsException"
+    ]
+    if errors:
+        raise RuntimeError(f"パーティションの登録に失敗しました({table_name}): {errors}")
+
+
+def delete_keys(s3, bucket, keys):
+    keys = list(keys)
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True},
+        )
+
+
+def compact_table(
+    s3,
+    bucket,
+    channel_prefix,
+    table,
+    target_bytes=DEFAULT_TARGET_BYTES,
+    min_age=DEFAULT_MIN_AGE,
+    retention=DEFAULT_RETENTION,
+    now=None,
+    glue=None,
+    database=None,
+):
+    now = now or datetime.now(timezone.utc)
+    table_prefix = compacted_prefix(channel_prefix, table)
+    manifest = load_manifest(s3, bucket, table_prefix)
+
+    compacted_sources = set(manifest["sources"])
+    sources = [
+        source
+        for source in find_sealed_sources(s3, bucket, channel_prefix, table, min_age, now)
+        if source["prefix"] not in compacted_sources
+    ]
+
+    # 保持期間を過ぎた統合元は、新しい版の公開とカタログへの登録の後に削除する
+    # (カタログに登録しない場合は、統合後のデータの読み手がいないため削除しない)
+    expired = [
+        entry for entry in manifest["retired"]
+        if database is not None and now - datetime.fromisoformat(entry["retired_at"]) >= retention
+    ]
+    if not sources and not expired:
+        return {"table": table, "version": manifest["version"], "compacted_sources": 0}
+
+    # 新しい統合元のファイルと、目標の半分に満たない既存の統合済みファイルをまとめ直す
+    candidates = [
+        {**file, "workflow": source["workflow"]}
+        for source in sources
+        for file in source["files"]
+    ]
+    small_files = [file for file in manifest["files"] if file["size"] < target_bytes // 2] if sources else []
+    candidates.extend(small_files)
+
+    compaction_id = f"{now.strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}"
+    written = []
+    schemas = []
+    for index, files in enumerate(plan_bins(candidates, target_bytes)):
+        output_key = f"{table_prefix}data/{compaction_id}/part-{index:05d}.parquet"
+        entry, schema = rewrite_bin(s3, bucket, files, output_key)
+        written.append(entry)
+        schemas.append(schema)
+
+    small_keys = {file["key"] for file in small_files}
+    retired_at = now.isoformat()
+    new_manifest = {
+        "version": manifest["version"] + 1,
+        "created_at": retired_at,
+        "files": [file for file in manifest["files"] if file["key"] not in small_keys] + written,
+        "sources": sorted(compacted_sources | {source["prefix"] for source in sources}),
+        "retired": [entry for entry in manifest["retired"] if entry not in expired]
+        + [{"keys": source["keys"], "retired_at": retired_at} for source in sources]
+        + ([{"keys": sorted(small_keys), "retired_at": retired_at}] if small_keys else []),
+    }
+
+    try:
+        publish_manifest(s3, bucket, table_prefix, new_manifest)
+    except ConcurrentCompactionError:
+        # 公開できなかった今回の出力は参照されないため削除する
+        delete_keys(s3, bucket, [file["key"] for file in written])
+        raise
+
+    if database is not None and schemas:
+        register_compacted_table(
+            glue, database, bucket, channel_prefix, table, pa.unify_schemas(schemas, promote_options="default")
+        )
+
+    delete_keys(s3, bucket, [key for entry in expired for key in entry["keys"]])
+
+    return {
+        "table": table,
+        "version": new_manifest["version"],
+        "compacted_sources": len(sources),
+        "input_files": len(candidates),
+        "output_files": len(written),
+        "deleted_objects": sum(len(entry["keys"]) for entry in expired),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--channel_id", default=None)  # 省略時はすべてのチャンネル
+    parser.add_argument("--tables", default=",".join(TABLES))
+    parser.add_argument("--target_mb", type=int, default=DEFAULT_TARGET_BYTES // (1024 * 1024))
+    parser.add_argument("--min_age_hours", type=float, default=DEFAULT_MIN_AGE.total_seconds() / 3600)
+    parser.add_argument("--retention_hours", type=float, default=DEFAULT_RETENTION.total_seconds() / 3600)
+    # 統合後のデータを登録するデータカタログのデータベース(省略時は登録せず、統合元も削除しない)
+    parser.add_argument("--glue_database", default=None)
+    # Glueが付与する引数(--job-bookmark-option など)は無視する
+    args, _ = parser.parse_known_args(argv)
+
+    s3 = boto3.client("s3")
+    glue = boto3.client("glue") if args.glue_database else None
+    if args.channel_id:
+        channel_prefixes = [f"channel={args.channel_id}/"]
+    else:
+        channel_prefixes = list_prefixes(s3, args.bucket, "channel=")
+
+    for channel_prefix in channel_prefixes:
+        for table in args.tables.split(","):
+            result = compact_table(
+                s3,
+                args.bucket,
+                channel_prefix,
+                table,
+                target_bytes=args.target_mb * 1024 * 1024,
+                min_age=timedelta(hours=args.min_age_hours),
+                retention=timedelta(hours=args.retention_hours),
+                glue=glue,
+                database=args.glue_database,
+            )
+            log_json(
+                "コンパクションが完了しました。",
+                extra={"channel_prefix": channel_prefix, **result},
+            )
+
+
+if __name__ == "__main__":
+    main()
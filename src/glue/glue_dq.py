@@ -0,0 +1,182 @@
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from pyspark.sql import functions as F
+
+
+# ////////////
+# ルールの定義
+# ////////////
+# テーブルごとのルールセット。(ルールの種類, 列名[, 閾値]) のリストで定義する。
+# Glue Data Quality(DQDL)で評価する場合も、この定義からルールセットの文字列を生成する。
+RULESETS = {
+    "channel": [
+        ("IsComplete", "channel_id"),
+        ("IsUnique", "channel_id"),
+        ("Completeness", "published_at", 0.90),
+    ],
+    "video": [
+        ("IsComplete", "video_id"),
+        ("IsUnique", "video_id"),
+        ("Completeness", "total_seconds", 0.90),
+        ("Completeness", "published_at", 0.90),
+    ],
+    "comment": [
+        ("IsComplete", "comment_id"),
+        ("IsUnique", "comment_id"),
+        ("Completeness", "published_at", 0.90),
+    ],
+}
+
+
+def rule_to_dqdl(rule):
+    rule_type, column, *threshold = rule
+    if threshold:
+        return f'{rule_type} "{column}" >= {threshold[0]:.2f}'
+    return f'{rule_type} "{column}"'
+
+
+def ruleset_to_dqdl(rules):
+    return "Rules = [\n    " + ",\n    ".join(rule_to_dqdl(rule) for rule in rules) + "\n]"
+
+
+# ////////////
+# ルールの種類
+# ////////////
+# ルールの種類ごとに「集計に必要な列(aggregate)」と「集計結果からの判定(evaluate)」を登録する。
+# すべてのルールの集計列を1回の集計(1つのSparkジョブ)にまとめて計算する。
+RULE_TYPES = {}
+
+
+def register_rule(rule_type, aggregate, evaluate):
+    RULE_TYPES[rule_type] = {"aggregate": aggregate, "evaluate": evaluate}
+
+
+def _completeness(metrics, column):
+    if metrics["row_count"] == 0:
+        return 0.0
+    return metrics[f"non_null:{column}"] / metrics["row_count"]
+
+
+def _completeness_aggregate(column):
+    return {f"non_null:{column}": F.count(F.col(column))}
+
+
+def _evaluate_completeness(metrics, column, threshold):
+    completeness = _completeness(metrics, column)
+    metric = {f"Column.{column}.Completeness": completeness}
+    if completeness < threshold:
+        return False, f"Value: {completeness:.4f} does not meet the constraint requirement!", metric
+    return True, None, metric
+
+
+def _is_unique_aggregate(column):
+    return {
+        f"non_null:{column}": F.count(F.col(column)),
+        f"distinct:{column}": F.countDistinct(F.col(column)),
+    }
+
+
+def _evaluate_is_unique(metrics, column):
+    non_null = metrics[f"non_null:{column}"]
+    uniqueness = metrics[f"distinct:{column}"] / non_null if non_null else 0.0
+    metric = {f"Column.{column}.Uniqueness": uniqueness}
+    if uniqueness < 1.0:
+        return False, f"Value: {uniqueness:.4f} does not meet the constraint requirement!", metric
+    return True, None, metric
+
+
+def _evaluate_is_complete(metrics, column):
+    return _evaluate_completeness(metrics, column, 1.0)
+
+
+register_rule("IsComplete", _completeness_aggregate, _evaluate_is_complete)
+register_rule("Completeness", _completeness_aggregate, _evaluate_completeness)
+register_rule("IsUnique", _is_unique_aggregate, _evaluate_is_unique)
+
+
+# ////////////
+# ルールの評価
+# ////////////
+# 戻り値はGlue Data Qualityのルール結果(DATA_QUALITY_RULE_OUTCOMES_KEY)と同じ項目を持つ辞書のリスト
+def evaluate_rules(df, rules):
+    aggregates = {"row_count": F.count(F.lit(1))}
+    for rule_type, column, *_ in rules:
+        aggregates.update(RULE_TYPES[rule_type]["aggregate"](column))
+
+    # 同じ列への集計は1つにまとめ、すべてのルールを1回の集計で計算する
+    row = df.agg(*[expr.alias(name) for name, expr in aggregates.items()]).collect()[0]
+    metrics = row.asDict()
+
+    outcomes = []
+    for rule in rules:
+        rule_type, column, *threshold = rule
+        passed, failure_reason, evaluated_metrics = RULE_TYPES[rule_type]["evaluate"](
+            metrics, column, *threshold
+        )
+        outcomes.append(
+            {
+                "Rule": rule_to_dqdl(rule),
+                "Outcome": "Passed" if passed else "Failed",
+                "FailureReason": failure_reason,
+                "EvaluatedMetrics": evaluated_metrics,
+            }
+        )
+    return outcomes
+
+
+# ////////////
+# レポートの出力
+# ////////////
+# Glue Data Qualityの結果出力(resultsS3Prefix)と同じ項目のJSONを1ファイル出力する
+def build_report(outcomes, evaluation_context, started_on, completed_on):
+    passed = sum(1 for outcome in outcomes if outcome["Outcome"] == "Passed")
+    return {
+        "ResultId": f"dqresult-{uuid.uuid4().hex}",
+        "Score": passed / len(outcomes) if outcomes else 1.0,
+        "EvaluationContext": evaluation_context,
+        "StartedOn": started_on.isoformat(),
+        "CompletedOn": completed_on.isoformat(),
+        "RuleResults": [
+            {
+                "Name": f"Rule_{index}",
+                "Description": outcome["Rule"],
+                "Result": "PASS" if outcome["Outcome"] == "Passed" else "FAIL",
+                "EvaluationMessage": outcome["FailureReason"],
+                "EvaluatedMetrics": outcome["EvaluatedMetrics"],
+            }
+            for index, outcome in enumerate(outcomes, start=1)
+        ],
+    }
+
+
+def write_report(report, result_prefix, s3=None):
+    body = json.dumps(report, ensure_ascii=False).encode("utf-8")
+    file_name = f"{report['ResultId']}.json"
+
+    parsed = urlsplit(result_prefix)
+    if parsed.scheme in ("s3", "s3a", "s3n"):
+        if s3 is None:
+            import boto3
+
+            s3 = boto3.client("s3")
+        key = parsed.path.lstrip("/") + file_name
+        s3.put_object(Bucket=parsed.netloc, Key=key, Body=body, ContentType="application/json")
+        return f"s3://{parsed.netloc}/{key}"
+
+    os.makedirs(result_prefix, exist_ok=True)
+    path = os.path.join(result_prefix, file_name)
+    with open(path, "wb") as f:
+        f.write(body)
+    return path
+
+
+def run_spark_dq(df, df_name, result_prefix, rules=None, s3=None):
+    started_on = datetime.now(timezone.utc)
+    outcomes = evaluate_rules(df, RULESETS[df_name] if rules is None else rules)
+    report = build_report(outcomes, df_name, started_on, datetime.now(timezone.utc))
+    write_report(report, result_prefix, s3=s3)
+    return outcomes
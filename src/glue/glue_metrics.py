@@ -0,0 +1,61 @@
+import json
+import time
+
+# ////////////
+# 処理段階ごとのメトリクス(CloudWatch Embedded Metric Format)
+# ////////////
+# 段階ごとの所要時間・行数・バイト数をEMF形式のJSONとして1段階1行でドライバーの標準出力へ出力する。
+# Lambda側は aws-lambda-powertools の Metrics で出力するが、Glueの実行環境には含まれないため、
+# ここではGlueで使う分(Latency・Rows・Bytes・Errors)だけを最小限の形式で出力する。
+# 名前空間・ディメンション(service, stage, artist_name_slug)はLambda側と揃え、
+# correlation_id はディメンションにせずプロパティとして付与する。
+METRICS_NAMESPACE = "YouTubePipeline"
+
+METRIC_UNITS = {
+    "Latency": "Milliseconds",
+    "Rows": "Count",
+    "Bytes": "Bytes",
+    "Errors": "Count",
+}
+
+
+def emf_record(stage, values, context):
+    dimensions = {"service": context.get("service"), "stage": stage}
+    if context.get("artist_name_slug"):
+        dimensions["artist_name_slug"] = context["artist_name_slug"]
+
+    values = {name: value for name, value in values.items() if value is not None}
+    return {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": METRIC_UNITS.get(name, "None")} for name in values],
+                }
+            ],
+        },
+        **dimensions,
+        **values,
+        "correlation_id": context.get("correlation_id"),
+    }
+
+
+def emit_metrics(stage, values, context):
+    print(json.dumps(emf_record(stage, values, context), ensure_ascii=False))
+
+
+# run_sinks の結果(出力ごとの所要時間・状態)を出力ごとのメトリクスにする
+def emit_sink_metrics(results, context):
+    for result in results:
+        if result.get("elapsed_seconds") is None:
+            continue
+        emit_metrics(
+            f"sink_{result['name']}",
+            {
+                "Latency": round(result["elapsed_seconds"] * 1000, 3),
+                "Errors": 1 if result["status"] == "failed" else 0,
+            },
+            context,
+        )
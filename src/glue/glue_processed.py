@@ -0,0 +1,157 @@
+import re
+from functools import reduce
+
+from pyspark.sql import functions as F
+from pyspark.sql.utils import AnalysisException
+
+from src.glue.glue_transforms import materialize
+
+# ////////////
+# 加工済みデータ(processed zone)の配置
+# ////////////
+# 加工済みデータはワークフローごとではなく、テーブルごとの1つの場所に蓄積する。
+#   {processed_zone_path}/{table}/channel_id=.../published_date=YYYY-MM-DD/part-*.parquet
+# 実行ごとに、今回のデータを含むパーティションだけを既存データとマージして上書きする(動的パーティション上書き)。
+PARTITION_COLUMNS = ["channel_id", "published_date"]
+
+# テーブルごとの主キー(マージ・差分判定に使用する)
+TABLE_KEYS = {"channel": "channel_id", "video": "video_id", "comment": "comment_id"}
+
+
+# processed_base_path(.../channel=<id>/workflow=<id>/processed_data/)からチャンネルIDを取得する
+def channel_id_from_path(path):
+    match = re.search(r"channel=([^/]+)/", path)
+    if match is None:
+        raise ValueError(f"パスからチャンネルIDを取得できません: {path}")
+    return match.group(1)
+
+
+def table_path(processed_zone_path, table):
+    return f"{processed_zone_path.rstrip('/')}/{table}"
+
+
+def with_partition_columns(df, channel_id):
+    if "channel_id" not in df.columns:
+        df = df.withColumn("channel_id", F.lit(channel_id))
+    return df.withColumn("published_date", F.to_date("published_at"))
+
+
+def read_partitions(spark, path, schema, partitions):
+    # 今回のデータを含むパーティションだけを読み込む(パーティションの枝刈りで対象ディレクトリのみ一覧する)
+    if not partitions:
+        return None
+
+    dates_by_channel = {}
+    for channel_id, published_date in partitions:
+        dates_by_channel.setdefault(channel_id, []).append(published_date)
+
+    conditions = []
+    for channel_id, dates in dates_by_channel.items():
+        known_dates = [date for date in dates if date is not None]
+        date_condition = F.col("published_date").isin(known_dates)
+        if len(known_dates) < len(dates):
+            date_condition = date_condition | F.col("published_date").isNull()
+        conditions.append((F.col("channel_id") == channel_id) & date_condition)
+
+    try:
+        existing = spark.read.schema(schema).parquet(path)
+    except AnalysisException:
+        # 初回実行(まだテーブルのディレクトリが存在しない)
+        return None
+    return existing.filter(reduce(lambda left, right: left | right, conditions))
+
+
+def _row_hash(columns):
+    return F.sha2(F.to_json(F.struct(*columns)), 256)
+
+
+# ////////////
+# 既存データとのマージと差分の抽出
+# ////////////
+# 戻り値は (書き込むパーティションの全データ, 新規・変更行のみの差分, 解放対象のDataFrameのリスト,
+# 今回のデータを含むパーティションの値のリスト)。
+# 既存データは上書きで置き換わる前に1回だけ読み込んで保持し、マージ結果と差分の両方から参照する。
+def merge_partitions(spark, df, path, key, channel_id, checkpoint_dir=None):
+    batch = with_partition_columns(df, channel_id)
+    partitions = [
+        (row["channel_id"], row["published_date"])
+        for row in batch.select(*PARTITION_COLUMNS).distinct().collect()
+    ]
+
+    existing = read_partitions(spark, path, batch.schema, partitions)
+    if existing is None:
+        return batch, df, [], partitions
+
+    # 既存データは上書き後に差分の計算(BigQuery出力)から参照されても読み直さないよう、系譜を切り離して保持する。
+    # (persistではSparkが上書きしたパスのキャッシュを破棄するため、上書き後のファイルを読み直してしまう)
+    existing = materialize(
+        existing,
+        mode="checkpoint" if checkpoint_dir else "local_checkpoint",
+        checkpoint_dir=checkpoint_dir,
+    )
+
+    # 今回のデータに含まれないキーの既存行はそのまま残し、含まれるキーは今回の行で置き換える
+    unchanged = existing.join(batch.select(key), key, "left_anti")
+    merged = unchanged.unionByName(batch)
+
+    # 差分: 既存行と全列が一致しない行(新規のキー、または値が変わったキー)
+    value_columns = df.columns
+    delta = (
+        batch.withColumn("row_hash", _row_hash(value_columns))
+        .join(
+            existing.select(key, _row_hash(value_columns).alias("row_hash")),
+            [key, "row_hash"],
+            "left_anti",
+        )
+        .select(*value_columns)
+    )
+    return merged, delta, [existing], partitions
+
+
+def write_partitions(df, path):
+    # パーティションごとに1ファイルにまとめ、今回含まれるパーティションのみを置き換える
+    (
+        df.repartition(*PARTITION_COLUMNS)
+        .write.mode("overwrite")
+        .option("partitionOverwriteMode", "dynamic")
+        .partitionBy(*PARTITION_COLUMNS)
+        .parquet(path)
+    )
+
+
+# ////////////
+# 統計値のスナップショット(追記のみの時系列テーブル)
+# ////////////
+# 再生数・登録者数などは加工済みデータでは毎回上書きされるため、実行日ごとの値を細い表として蓄積する。
+#   {processed_zone_path}/{table}_stats_snapshot/snapshot_date=YYYY-MM-DD/channel_id=.../part-*.parquet
+# 日付の範囲で読む用途が中心のため snapshot_date を先頭のパーティションとし、ファイル内はキー順に並べる。
+# 同じ日に再実行した場合は、そのチャンネルのその日のスナップショットだけが置き換わる。
+SNAPSHOT_PARTITION_COLUMNS = ["snapshot_date", "channel_id"]
+
+SNAPSHOT_COLUMNS = {
+    "channel": ["channel_id", "subscriber_count", "total_views", "video_count"],
+    "video": ["channel_id", "video_id", "view_count", "like_count", "comment_count"],
+}
+
+
+def snapshot_path(processed_zone_path, table):
+    return table_path(processed_zone_path, f"{table}_stats_snapshot")
+
+
+def build_snapshot(df, table, channel_id, snapshot_date):
+    if "channel_id" not in df.columns:
+        df = df.withColumn("channel_id", F.lit(channel_id))
+    return df.select(
+        F.lit(snapshot_date).cast("date").alias("snapshot_date"), *SNAPSHOT_COLUMNS[table]
+    )
+
+
+def write_snapshot(df, path, table):
+    (
+        df.repartition(*SNAPSHOT_PARTITION_COLUMNS)
+        .sortWithinPartitions(TABLE_KEYS[table])
+        .write.mode("overwrite")
+        .option("partitionOverwriteMode", "dynamic")
+        .partitionBy(*SNAPSHOT_PARTITION_COLUMNS)
+        .parquet(path)
+    )
@@ -0,0 +1,109 @@
+import math
+import os
+from urllib.parse import urlsplit
+
+
+# ////////////
+# 入力データ量の計測
+# ////////////
+# 入力パス(s3://bucket/key またはローカルパス)配下のファイルの (キー, サイズ) の一覧を返す。
+# S3の場合はキーを接頭辞として一覧を取得するため、単一ファイルとディレクトリのどちらにも対応する。
+def list_input_files(path, s3=None):
+    parsed = urlsplit(path)
+    if parsed.scheme in ("s3", "s3a", "s3n"):
+        if s3 is None:
+            import boto3
+
+            s3 = boto3.client("s3")
+        files = []
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=parsed.netloc, Prefix=parsed.path.lstrip("/")):
+            files.extend((obj["Key"], obj["Size"]) for obj in page.get("Contents", []))
+        return files
+
+    if os.path.isdir(path):
+        return [
+            (os.path.join(root, name), os.path.getsize(os.path.join(root, name)))
+            for root, _, names in os.walk(path)
+            for name in names
+        ]
+    return [(path, os.path.getsize(path))] if os.path.exists(path) else []
+
+
+def input_size_bytes(path, s3=None):
+    return sum(size for _, size in list_input_files(path, s3))
+
+
+# 形式ごとの1行あたりの平均サイズ(実データの計測値を丸めたもの)
+ESTIMATED_BYTES_PER_ROW = {"json": 250, "json.gz": 25, "parquet": 25}
+
+
+# path には入力パス、またはパートファイルのキーの一覧(接頭辞を入力とする場合)を渡す
+def estimate_rows(size_bytes, path, raw_format="json"):
+    keys = [path] if isinstance(path, str) else list(path)
+    if raw_format == "json" and keys and all(key.endswith(".gz") for key in keys):
+        raw_format = "json.gz"
+    return math.ceil(size_bytes / ESTIMATED_BYTES_PER_ROW[raw_format])
+
+
+# ////////////
+# 実行プロファイルの選択
+# ////////////
+# 推定行数の合計から規模(small / medium / large)を判定し、シャッフルのパーティション数、
+# AQEによるパーティション結合、ブロードキャストの閾値、テーブルごとの出力ファイル数を決める。
+ROWS_PER_SHUFFLE_PARTITION = 200_000
+ROWS_PER_OUTPUT_FILE = 1_000_000
+MAX_SHUFFLE_PARTITIONS = 2000
+
+PROFILE_TIERS = [
+    # (名前, 推定行数の上限, AQEの目標パーティションサイズ, ブロードキャストの閾値)
+    ("small", 100_000, 16 * 1024 * 1024, 64 * 1024 * 1024),
+    ("medium", 5_000_000, 64 * 1024 * 1024, 32 * 1024 * 1024),
+    ("large", None, 128 * 1024 * 1024, 10 * 1024 * 1024),
+]
+
+
+def choose_profile(input_sizes, input_paths, raw_format="json"):
+    estimated_rows = {
+        table: estimate_rows(size_bytes, input_paths[table], raw_format)
+        for table, size_bytes in input_sizes.items()
+    }
+    total_rows = sum(estimated_rows.values())
+
+    for name, max_rows, advisory_bytes, broadcast_bytes in PROFILE_TIERS:
+        if max_rows is None or total_rows <= max_rows:
+            break
+
+    shuffle_partitions = min(
+        MAX_SHUFFLE_PARTITIONS, max(1, math.ceil(total_rows / ROWS_PER_SHUFFLE_PARTITION))
+    )
+
+    return {
+        "name": name,
+        "input_bytes": dict(input_sizes),
+        "estimated_rows": estimated_rows,
+        "shuffle_partitions": shuffle_partitions,
+        "output_files": {
+            table: max(1, math.ceil(rows / ROWS_PER_OUTPUT_FILE))
+            for table, rows in estimated_rows.items()
+        },
+        "spark_conf": {
+            "spark.sql.shuffle.partitions": str(shuffle_partitions),
+            "spark.sql.adaptive.enabled": "true",
+            "spark.sql.adaptive.coalescePartitions.enabled": "true",
+            "spark.sql.adaptive.advisoryPartitionSizeInBytes": str(advisory_bytes),
+            "spark.sql.autoBroadcastJoinThreshold": str(broadcast_bytes),
+        },
+    }
+
+
+def apply_profile(spark, profile):
+    for key, value in profile["spark_conf"].items():
+        spark.conf.set(key, value)
+
+
+# 出力ファイル数の指定がある場合はパーティションをまとめてから書き込む
+def coalesce_for_output(df, profile, table):
+    if profile is None:
+        return df
+    return df.coalesce(profile["output_files"][table])
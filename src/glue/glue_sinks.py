@@ -0,0 +1,85 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ////////////
+# 出力処理の並列実行
+# ////////////
+# テーブルごとのS3出力・BigQuery出力は互いに独立しているため、ドライバーから同時に投入する。
+# 各出力はSparkのFAIRスケジューラーのプール(出力ごとに1つ)で実行し、
+# 1つの大きな出力がクラスターを占有して他の出力が待たされないようにする。
+# (FAIRスケジューラーは SparkContext 生成時に spark.scheduler.mode=FAIR の指定が必要)
+class SinkError(Exception):
+    def __init__(self, results):
+        self.results = results
+        self.failures = [result for result in results if result["status"] == "failed"]
+        details = ", ".join(f"{result['name']}: {result['error']}" for result in self.failures)
+        super().__init__(f"{len(self.failures)}件の出力処理に失敗しました。({details})")
+
+
+def run_sinks(spark, sinks, max_parallelism=3, fail_fast=True, log=None):
+    # sinks は (出力名, 引数なしの書き込み関数) のリスト。
+    # すべて成功した場合のみ各出力の結果を返し、1つでも失敗した場合はSinkErrorを送出する。
+    # fail_fast=True の場合、失敗後に未着手の出力は実行せずskippedとする。
+    results = {name: {"name": name, "status": "pending"} for name, _ in sinks}
+    failed = []
+
+    def run(name, write):
+        if fail_fast and failed:
+            results[name]["status"] = "skipped"
+            return
+
+        if spark is not None:
+            spark.sparkContext.setLocalProperty("spark.scheduler.pool", f"sink_{name}")
+        if log is not None:
+            log(f"出力処理を開始しました。({name})", extra={"sink": name})
+
+        started = time.perf_counter()
+        try:
+            write()
+        except Exception as e:
+            failed.append(name)
+            results[name].update(status="failed", error=f"{type(e).__name__}: {e}")
+        else:
+            results[name]["status"] = "succeeded"
+        finally:
+            results[name]["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+            if spark is not None:
+                spark.sparkContext.setLocalProperty("spark.scheduler.pool", None)
+
+        if log is not None:
+            log(
+                f"出力処理が終了しました。({name})",
+                level="INFO" if results[name]["status"] == "succeeded" else "ERROR",
+                extra={"sink": name, **results[name]},
+            )
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallelism, len(sinks)))) as executor:
+        for future in [executor.submit(run, name, write) for name, write in sinks]:
+            future.result()
+
+    ordered = [results[name] for name, _ in sinks]
+    if failed:
+        raise SinkError(ordered)
+    return ordered
+
+
+# 出力を段階に分けて順に実行する。前の段階の出力がすべて成功した場合のみ次の段階へ進む。
+# (stages は sinks のリストのリスト。失敗時は未実行の段階の出力も skipped としてSinkErrorに含める)
+def run_sink_stages(spark, stages, max_parallelism=3, fail_fast=True, log=None):
+    results = []
+    for index, sinks in enumerate(stages):
+        if not sinks:
+            continue
+        try:
+            results += run_sinks(
+                spark, sinks, max_parallelism=max_parallelism, fail_fast=fail_fast, log=log
+            )
+        except SinkError as e:
+            skipped = [
+                {"name": name, "status": "skipped"}
+                for later in stages[index + 1:]
+                for name, _ in later
+            ]
+            raise SinkError(results + e.results + skipped)
+    return results
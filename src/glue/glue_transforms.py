@@ -0,0 +1,174 @@
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, StringType, LongType
+from pyspark.sql.window import Window
+
+# ////////////
+# スキーマ設計
+# ////////////
+# channelデータのスキーマ設計
+channel_schema = StructType(
+    [
+        StructField("channel_id", StringType(), False),
+        StructField("channel_name", StringType(), False),
+        StructField("published_at", StringType(), False),
+        StructField("subscriber_count", LongType(), False),
+        StructField("total_views", LongType(), False),
+        StructField("video_count", LongType(), False),
+    ]
+)
+
+# videoデータのスキーマ設計
+video_schema = StructType(
+    [
+        StructField("video_id", StringType(), False),
+        StructField("title", StringType(), False),
+        StructField("published_at", StringType(), False),
+        StructField("view_count", LongType(), False),
+        StructField("like_count", LongType(), False),
+        StructField("comment_count", LongType(), False),
+        StructField("duration", StringType(), False),
+        StructField("tags", StringType(), False),
+    ]
+)
+
+# commentデータのスキーマ設計
+comment_schema = StructType(
+    [
+        StructField("video_id", StringType(), False),
+        StructField("comment_id", StringType(), False),
+        StructField("author_display_name", StringType(), False),
+        StructField("published_at", StringType(), False),
+        StructField("text_display", StringType(), False),
+        StructField("like_count", LongType(), False),
+    ]
+)
+
+
+# ////////////
+# データの読み込み
+# ////////////
+def read_raw(spark, schema, path, raw_format="json"):
+    # Parquetは列の型がLambda側で確定しているため、JSONのような型推論・パースを行わない
+    if raw_format == "parquet":
+        return spark.read.schema(schema).parquet(path)
+    return spark.read.schema(schema).json(path)
+
+
+# ////////////
+# データ型変換
+# ////////////
+def cast_timestamps(df, columns=("published_at",)):
+    return df.withColumns({column: F.col(column).cast("timestamp") for column in columns})
+
+
+# ISO 8601の期間表記(例: PT3M12S, P1DT2H, P1W)を秒数に変換する。
+# 正規表現を使わず、単位の文字で区切る文字列関数(substring_index)のみで各要素を取り出す。
+# (日付部分 "P..W..D" と時刻部分 "T..H..M..S" に分け、単位の直前の数値を切り出す)
+# Pで始まらない値はNULLとする。
+def _duration_unit(part, unit, preceding_units):
+    value = F.substring_index(part, unit, 1)
+    for preceding_unit in preceding_units:
+        value = F.substring_index(value, preceding_unit, -1)
+    return F.when(part.contains(unit), value.cast(LongType())).otherwise(F.lit(0))
+
+
+def duration_to_seconds(column):
+    date_part = F.substring_index(column, "T", 1)
+    time_part = F.when(column.contains("T"), F.substring_index(column, "T", -1)).otherwise(
+        F.lit("")
+    )
+
+    total = (
+        _duration_unit(date_part, "W", ["P"]) * 7 * 86400
+        + _duration_unit(date_part, "D", ["P", "W"]) * 86400
+        + _duration_unit(time_part, "H", []) * 3600
+        + _duration_unit(time_part, "M", ["H"]) * 60
+        + _duration_unit(time_part, "S", ["H", "M"])
+    )
+    return F.when(column.startswith("P"), total)
+
+
+def add_total_seconds(df, duration_column="duration"):
+    return df.withColumn("total_seconds", duration_to_seconds(F.col(duration_column)))
+
+
+# ////////////
+# 欠損、重複値処理(必ず欠損→重複の順番で処理を行う)
+# ////////////
+def drop_nulls(df, required_columns):
+    condition = F.lit(True)
+    for column in required_columns:
+        condition = condition & F.col(column).isNotNull()
+    return df.filter(condition)
+
+
+def dedup_latest(df, key_column, order_column="published_at"):
+    # キーごとに最新(order_columnの降順で先頭)の1行だけを残す
+    window = Window.partitionBy(key_column).orderBy(F.col(order_column).desc())
+    return (
+        df.withColumn("rank", F.row_number().over(window))
+        .filter(F.col("rank") == 1)
+        .drop("rank")
+    )
+
+
+# ////////////
+# テーブルごとの加工処理
+# ////////////
+def transform_channel(df):
+    df = cast_timestamps(df)
+    df = drop_nulls(df, ["channel_id"])
+    return dedup_latest(df, "channel_id")
+
+
+def transform_video(df):
+    df = cast_timestamps(df)
+    df = add_total_seconds(df)
+    df = drop_nulls(df, ["video_id", "published_at"])
+    return dedup_latest(df, "video_id")
+
+
+def transform_comment(df):
+    df = cast_timestamps(df)
+    df = drop_nulls(df, ["comment_id", "published_at"])
+    return dedup_latest(df, "comment_id")
+
+
+# ////////////
+# 加工済みデータの永続化
+# ////////////
+# 加工済みのDataFrameはDQ・S3出力・BigQuery出力の複数のアクションから参照されるため、
+# 1回だけ計算して保持する(保持しない場合、アクションごとに読み込みと重複排除が再実行される)。
+#   persist          : storage_levelで指定した方式でキャッシュする
+#   checkpoint       : checkpoint_dirへ書き出し、系譜(lineage)を切り離す
+#   local_checkpoint : Executorのローカルストレージへ書き出し、系譜を切り離す
+#   none             : 永続化しない
+MATERIALIZE_MODES = ("persist", "checkpoint", "local_checkpoint", "none")
+
+
+def materialize(df, mode="persist", storage_level="MEMORY_AND_DISK", checkpoint_dir=None):
+    from pyspark import StorageLevel
+
+    if mode == "none":
+        return df
+    if mode == "persist":
+        df = df.persist(getattr(StorageLevel, storage_level))
+        # 最初のアクションで確定させ、以降の処理時間に計算コストが混ざらないようにする
+        df.count()
+        return df
+    if mode == "checkpoint":
+        if not checkpoint_dir:
+            raise ValueError("checkpointモードではcheckpoint_dirの指定が必要です。")
+        df.sparkSession.sparkContext.setCheckpointDir(checkpoint_dir)
+        return df.checkpoint(eager=True)
+    if mode == "local_checkpoint":
+        return df.localCheckpoint(eager=True)
+
+    raise ValueError(f"未対応の永続化方式です: {mode}")
+
+
+def release(*dfs):
+    # persistで保持したデータを解放する(チェックポイントの場合はキャッシュが無いため何もしない)
+    for df in dfs:
+        if df.is_cached:
+            df.unpersist()
@@ -1,11 +1,42 @@
+import heapq
+import itertools
 import json
 import os
-from io import StringIO
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-import pandas as pd
-from googleapiclient.discovery import build
 from aws_lambda_powertools import Logger
 
+from .aws_cache import SecretCache, client_cache_stats, get_client
+from .metrics import measure_stage
+from .response_cache import LocalCacheStore, ResponseCache, S3CacheStore
+from .s3_writer import (
+    RollingRawWriter,
+    open_raw_writer,
+    raw_object_key,
+    raw_part_prefix,
+)
+from .watermark import (
+    build_watermark,
+    incremental_cutoff,
+    load_watermark,
+    parse_timestamp,
+    save_pending_watermark,
+    watermark_key,
+)
+from .youtube_client import (
+    BatchExecutor,
+    MeteredYouTube,
+    QuotaBudget,
+    QuotaBudgetExceeded,
+    RateLimiter,
+    build_youtube_service,
+    execute_request,
+    is_api_key_error,
+    prewarm_in_background,
+)
+
 logger = Logger()
 
 # /////////////////
@@ -16,32 +47,94 @@ REGION_NAME = os.environ.get("REGION_NAME")
 SECRET_ARN = os.environ.get("YOUTUBE_API_KEY_ARN")
 EVENT_SOURCE = "my-scraper"  # 後で変更
 EVENT_DETAIL_TYPE = "ScrapingCompleted"  # 後で変更
+COMMENT_FETCH_WORKERS = int(os.environ.get("COMMENT_FETCH_WORKERS", "8"))
+# コメント取得の上限(動画ごと・実行全体。0以下で無制限)と返信の取得有無
+COMMENT_MAX_PER_VIDEO = int(os.environ.get("COMMENT_MAX_PER_VIDEO", "10"))  # 本来は100に変更
+COMMENT_MAX_PER_RUN = int(os.environ.get("COMMENT_MAX_PER_RUN", "0"))
+COMMENT_INCLUDE_REPLIES = os.environ.get("COMMENT_INCLUDE_REPLIES", "false").lower() == "true"
+# 動画ごとに取得済みで未出力のページを保持する上限
+COMMENT_QUEUE_SIZE = int(os.environ.get("COMMENT_QUEUE_SIZE", "4"))
+# コメントのパートファイル1つあたりの上限
+COMMENT_PART_MAX_RECORDS = int(os.environ.get("COMMENT_PART_MAX_RECORDS", "100000"))
+COMMENT_PART_MAX_MB = int(os.environ.get("COMMENT_PART_MAX_MB", "64"))
+# APIリクエスト数の上限(バッチリクエストではサブリクエスト1件を1リクエストとして数える)
+YOUTUBE_REQUESTS_PER_SECOND = float(os.environ.get("YOUTUBE_REQUESTS_PER_SECOND", "10"))
+VIDEO_FETCH_WORKERS = int(os.environ.get("VIDEO_FETCH_WORKERS", "4"))
+VIDEO_QUEUE_SIZE = int(os.environ.get("VIDEO_QUEUE_SIZE", "8"))
+SCRAPE_MODE = os.environ.get("SCRAPE_MODE", "full")  # full / incremental
+STATS_REFRESH_WINDOW_DAYS = int(os.environ.get("STATS_REFRESH_WINDOW_DAYS", "7"))
+RAW_COMPRESSION = os.environ.get("RAW_COMPRESSION", "none")  # none / gzip
+RAW_FORMAT = os.environ.get("RAW_FORMAT", "json")  # json / parquet
+FAST_START = os.environ.get("FAST_START", "true").lower() == "true"
+SECRET_CACHE_TTL_SECONDS = int(os.environ.get("SECRET_CACHE_TTL_SECONDS", "300"))
+CHANNEL_FANOUT_WORKERS = int(os.environ.get("CHANNEL_FANOUT_WORKERS", "4"))
+MAX_EVENTS_PER_PUT = 10  # put_eventsの1回あたりの上限
+# 1回の実行で使用するYouTube APIクォータの上限と、必須の取得用に残しておく割合
+YOUTUBE_QUOTA_BUDGET = int(os.environ.get("YOUTUBE_QUOTA_BUDGET", "10000"))
+YOUTUBE_QUOTA_RESERVE_RATIO = float(os.environ.get("YOUTUBE_QUOTA_RESERVE_RATIO", "0.1"))
+# YouTube APIレスポンスのETagキャッシュ(none / s3 / local)
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "none")
+RESPONSE_CACHE_PREFIX = os.environ.get("RESPONSE_CACHE_PREFIX", "cache/youtube_api")
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", "/tmp/youtube_api_cache")
+RESPONSE_CACHE_MAX_AGE_DAYS = int(os.environ.get("RESPONSE_CACHE_MAX_AGE_DAYS", "30"))
+RESPONSE_CACHE_MAX_MB = int(os.environ.get("RESPONSE_CACHE_MAX_MB", "256"))
+# videos().list・commentThreads().list などをまとめて送信するバッチリクエスト(1以下で無効)
+YOUTUBE_BATCH_SIZE = int(os.environ.get("YOUTUBE_BATCH_SIZE", "50"))
+YOUTUBE_BATCH_WAIT_MS = float(os.environ.get("YOUTUBE_BATCH_WAIT_MS", "20"))
+
+if FAST_START:
+    prewarm_in_background()
+
+# ウォームスタート時に再利用するYouTubeサービスオブジェクト(APIキーごと)
+# (複数チャンネルのスレッドが同時にAPIキーを再取得する場合があるため、ロックを取って更新する)
+_youtube_services = {}
+_youtube_services_lock = threading.Lock()
+_secret_cache = SecretCache(SECRET_CACHE_TTL_SECONDS)
 
 
 # シークレットを取得する関数
-def get_youtube_api_key(secret_arn):
-    try:
-        secretsmanager_client = boto3.client("secretsmanager")
-        response = secretsmanager_client.get_secret_value(SecretId=secret_arn)
-        secret_data = json.loads(response["SecretString"])
+def load_youtube_api_key(secret_arn):
+    secretsmanager_client = get_client("secretsmanager")
+    response = secretsmanager_client.get_secret_value(SecretId=secret_arn)
+    secret_data = json.loads(response["SecretString"])
 
-        api_key = secret_data.get("API_KEY")
-        if not api_key:
-            raise KeyError("Secret内に 'API_KEY' が存在しません。")
+    api_key = secret_data.get("API_KEY")
+    if not api_key:
+        raise KeyError("Secret内に 'API_KEY' が存在しません。")
 
-        return api_key
+    return api_key
+
+
+# ウォームスタート時はTTL内であればキャッシュしたAPIキーを返す
+def get_youtube_api_key(secret_arn, force_refresh=False):
+    try:
+        return _secret_cache.get(
+            secret_arn, load_youtube_api_key, force_refresh=force_refresh
+        )
 
     except Exception as e:
         logger.error(f"予期しないエラーが発生しました: {e}")
         raise
 
 
+# YouTubeサービスオブジェクトをコンテナ内で1回だけ生成する
+def get_youtube_service(api_key):
+    with _youtube_services_lock:
+        youtube = _youtube_services.get(api_key)
+        if youtube is None:
+            youtube = build_youtube_service(api_key)
+            # APIキーがローテーションされた場合は古いサービスを破棄する
+            _youtube_services.clear()
+            _youtube_services[api_key] = youtube
+    return youtube
+
+
 # /////////////////
 # チャンネル情報の取得
 # /////////////////
 def get_channel(youtube, channel_id):
-    channels_response = (
-        youtube.channels().list(part="snippet,statistics", id=channel_id).execute()
+    channels_response = execute_request(
+        youtube.channels().list(part="snippet,statistics", id=channel_id)
     )
 
     channel_data = channels_response["items"][0]
@@ -63,79 +156,232 @@ def get_channel(youtube, channel_id):
 # /////////////////
 # 動画情報の取得
 # /////////////////
-def get_video(youtube, channel_id):
-    channels_response = (
-        youtube.channels()
-        .list(part="statistics, contentDetails, brandingSettings", id=channel_id)
-        .execute()
+def parse_video(video_data):
+    tags = video_data["snippet"].get("tags", [])
+
+    return {
+        "video_id": video_data["id"],
+        "title": video_data["snippet"]["title"],
+        "published_at": video_data["snippet"]["publishedAt"],
+        "view_count": int(video_data["statistics"].get("viewCount", 0)),
+        "like_count": int(video_data["statistics"].get("likeCount", 0)),
+        "comment_count": int(video_data["statistics"].get("commentCount", 0)),
+        "duration": video_data["contentDetails"]["duration"],
+        "tags": ",".join(tags),
+    }
+
+
+def get_video_batch(youtube, video_ids, batcher=None):
+    videos_response = execute_request(
+        youtube.videos().list(
+            part="snippet,statistics,contentDetails", id=",".join(video_ids)
+        ),
+        batcher=batcher,
     )
+    return [parse_video(video_data) for video_data in videos_response["items"]]
 
-    playlist_id = channels_response["items"][0]["contentDetails"]["relatedPlaylists"][
-        "uploads"
-    ]
-    all_videos_data = []
+
+def iter_playlist_video_ids(youtube, playlist_id, published_after=None):
+    # プレイリストを1ページずつ辿り、動画IDのバッチ(最大50件)を返す
+    # アップロード動画のプレイリストは新しい順のため、published_afterより古い動画に
+    # 到達した時点でページングを打ち切る
     next_page_token = None
 
     while True:
-        playlist_response = (
-            youtube.playlistItems()
-            .list(
+        playlist_response = execute_request(
+            youtube.playlistItems().list(
                 part="snippet,contentDetails",
                 playlistId=playlist_id,
                 maxResults=50,
                 pageToken=next_page_token,
             )
-            .execute()
         )
 
         video_ids = []
+        reached_cutoff = False
         for item in playlist_response["items"]:
+            video_published_at = item["contentDetails"].get("videoPublishedAt")
+            if (
+                published_after is not None
+                and video_published_at
+                and parse_timestamp(video_published_at) < published_after
+            ):
+                reached_cutoff = True
+                break
             video_ids.append(item["contentDetails"]["videoId"])
 
         if video_ids:
-            videos_response = (
-                youtube.videos()
-                .list(part="snippet,statistics,contentDetails", id=",".join(video_ids))
-                .execute()
-            )
-
-            for video_data in videos_response["items"]:
-                video_id = video_data["id"]
-                title = video_data["snippet"]["title"]
-                published_at = video_data["snippet"]["publishedAt"]
-                view_count = video_data["statistics"].get("viewCount", 0)
-                like_count = video_data["statistics"].get("likeCount", 0)
-                comment_count = video_data["statistics"].get("commentCount", 0)
-                duration = video_data["contentDetails"]["duration"]
-                tags = video_data["snippet"].get("tags", [])
-
-                all_videos_data.append(
-                    {
-                        "video_id": video_id,
-                        "title": title,
-                        "published_at": published_at,
-                        "view_count": int(view_count),
-                        "like_count": int(like_count),
-                        "comment_count": int(comment_count),
-                        "duration": duration,
-                        "tags": ",".join(tags),
-                    }
-                )
+            yield video_ids
 
         next_page_token = playlist_response.get("nextPageToken")
 
-        if not next_page_token:
+        if reached_cutoff or not next_page_token:
             break
 
-    return all_videos_data
+
+def iter_videos(
+    youtube,
+    channel_id,
+    max_workers=VIDEO_FETCH_WORKERS,
+    queue_size=VIDEO_QUEUE_SIZE,
+    published_after=None,
+    batcher=None,
+):
+    # 動画情報をAPIから取得した順に1件ずつ返す(全件をメモリに保持しない)
+    # (batcherを渡した場合、videos().list は他の呼び出しとまとめてバッチリクエストで送信する)
+    channels_response = execute_request(
+        youtube.channels().list(
+            part="statistics, contentDetails, brandingSettings", id=channel_id
+        )
+    )
+
+    playlist_id = channels_response["items"][0]["contentDetails"]["relatedPlaylists"][
+        "uploads"
+    ]
+
+    if max_workers <= 1:
+        for video_ids in iter_playlist_video_ids(
+            youtube, playlist_id, published_after=published_after
+        ):
+            yield from get_video_batch(youtube, video_ids, batcher=batcher)
+        return
+
+    for videos in iter_video_batches_pipelined(
+        youtube,
+        playlist_id,
+        max_workers,
+        queue_size,
+        published_after=published_after,
+        batcher=batcher,
+    ):
+        yield from videos
+
+
+def get_video(
+    youtube,
+    channel_id,
+    max_workers=VIDEO_FETCH_WORKERS,
+    queue_size=VIDEO_QUEUE_SIZE,
+    published_after=None,
+    batcher=None,
+):
+    return list(
+        iter_videos(
+            youtube,
+            channel_id,
+            max_workers=max_workers,
+            queue_size=queue_size,
+            published_after=published_after,
+            batcher=batcher,
+        )
+    )
+
+
+# /////////////////
+# 動画情報の取得(パイプライン実行)
+# /////////////////
+# プレイリストのページング(producer)と videos().list による詳細取得(consumer)を
+# 有界キューで繋ぎ、両者のレイテンシを重ねて実行する。出力順は逐次実行と同じ。
+# 取得済みで未出力のバッチ数も queue_size + max_workers 以下に抑える。
+def iter_video_batches_pipelined(
+    youtube, playlist_id, max_workers, queue_size, published_after=None, batcher=None
+):
+    batch_queue = queue.Queue(maxsize=max(1, queue_size))
+    in_flight = threading.Semaphore(max(1, queue_size) + max_workers)
+    results = {}
+    results_ready = threading.Condition()
+    errors = []
+    stop = threading.Event()
+    state = {"batch_count": None}
+
+    def fail(e):
+        with results_ready:
+            errors.append(e)
+            results_ready.notify_all()
+
+    def produce():
+        batch_count = 0
+        try:
+            for video_ids in iter_playlist_video_ids(
+                youtube, playlist_id, published_after=published_after
+            ):
+                # 出力側が追いつくまで新しいバッチを投入しない
+                while not in_flight.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set() or errors:
+                    return
+                batch_queue.put((batch_count, video_ids))
+                batch_count += 1
+        except Exception as e:
+            fail(e)
+        finally:
+            for _ in range(max_workers):
+                batch_queue.put(None)
+            with results_ready:
+                state["batch_count"] = batch_count
+                results_ready.notify_all()
+
+    def hydrate():
+        while True:
+            task = batch_queue.get()
+            if task is None:
+                return
+
+            seq, video_ids = task
+            # 既にエラーが出ている場合はキューを空にするだけにする
+            if errors or stop.is_set():
+                continue
+
+            try:
+                videos = get_video_batch(youtube, video_ids, batcher=batcher)
+            except Exception as e:
+                fail(e)
+                continue
+
+            with results_ready:
+                results[seq] = videos
+                results_ready.notify_all()
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [
+        threading.Thread(target=hydrate, daemon=True) for _ in range(max_workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        seq = 0
+        while True:
+            with results_ready:
+                while (
+                    seq not in results
+                    and not errors
+                    and (state["batch_count"] is None or seq < state["batch_count"])
+                ):
+                    results_ready.wait()
+
+                if errors:
+                    raise errors[0]
+                if seq not in results:
+                    break
+                videos = results.pop(seq)
+
+            in_flight.release()
+            yield videos
+            seq += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
 
 
 # /////////////////
 # アップロードした動画のIDを取得
 # /////////////////
 def get_uploads_playlist_id(youtube, channel_id):
-    channels_response = (
-        youtube.channels().list(part="contentDetails", id=channel_id).execute()
+    channels_response = execute_request(
+        youtube.channels().list(part="contentDetails", id=channel_id)
     )
     return channels_response["items"][0]["contentDetails"]["relatedPlaylists"][
         "uploads"
@@ -145,120 +391,566 @@ def get_uploads_playlist_id(youtube, channel_id):
 # /////////////////
 # コメント情報の取得
 # /////////////////
-def get_comments_for_video(youtube, video_id, max_comments_per_video=100):
-    comments_data = []
-    # コメント無効か動画対策
-    try:
-        comment_threads_response = (
-            youtube.commentThreads()
-            .list(
+# 実行全体(全チャンネル)で取得するコメント数の上限
+class CommentBudget:
+    def __init__(self, limit):
+        self.limit = limit if limit > 0 else float("inf")
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+
+def parse_comment(video_id, comment_id, comment):
+    return {
+        "video_id": video_id,
+        "comment_id": comment_id,
+        "author_display_name": comment["authorDisplayName"],
+        "published_at": comment["publishedAt"],
+        "text_display": comment["textDisplay"],
+        "like_count": comment["likeCount"],
+    }
+
+
+# 1つのスレッド(トップレベルコメント)への返信。
+# commentThreadsに含まれる返信は最大5件のため、それより多い場合は comments().list で全件を辿る。
+# (返信のcomment_idは "<スレッドのID>.<返信のID>" の形式で、スレッドとの対応はIDから分かる)
+def iter_replies(youtube, video_id, thread, rate_limiter=None, batcher=None):
+    total_reply_count = thread["snippet"].get("totalReplyCount", 0)
+    inline_replies = thread.get("replies", {}).get("comments", [])
+    if total_reply_count <= len(inline_replies):
+        for reply in inline_replies:
+            yield parse_comment(video_id, reply["id"], reply["snippet"])
+        return
+
+    next_page_token = None
+    while True:
+        replies_response = execute_request(
+            youtube.comments().list(
                 part="snippet",
+                parentId=thread["id"],
+                maxResults=100,
+                pageToken=next_page_token,
+                textFormat="html",
+            ),
+            rate_limiter=rate_limiter,
+            batcher=batcher,
+        )
+        for reply in replies_response["items"]:
+            yield parse_comment(video_id, reply["id"], reply["snippet"])
+
+        next_page_token = replies_response.get("nextPageToken")
+        if not next_page_token:
+            break
+
+
+# 1本の動画のコメントを、スレッド→そのスレッドへの返信の順に1件ずつ返す。
+# commentThreadsのページを辿り、動画ごとの上限(max_comments_per_video)・実行全体の上限(comment_budget)に
+# 達した時点で以降のAPI呼び出しを行わずに終了する。
+def iter_comments_for_video(
+    youtube,
+    video_id,
+    max_comments_per_video=100,
+    rate_limiter=None,
+    include_replies=False,
+    comment_budget=None,
+    batcher=None,
+):
+    limit = max_comments_per_video if max_comments_per_video > 0 else float("inf")
+    count = 0
+    next_page_token = None
+
+    while True:
+        comment_threads_response = execute_request(
+            youtube.commentThreads().list(
+                part="snippet,replies" if include_replies else "snippet",
                 videoId=video_id,
-                maxResults=min(100, max_comments_per_video),
-                pageToken=None,
+                maxResults=int(min(100, limit - count)),
+                pageToken=next_page_token,
                 order="relevance",
-            )
-            .execute()
+            ),
+            rate_limiter=rate_limiter,
+            batcher=batcher,
         )
 
         for item in comment_threads_response["items"]:
-            comment = item["snippet"]["topLevelComment"]["snippet"]
-            comments_data.append(
-                {
-                    "video_id": video_id,
-                    "comment_id": item["id"],
-                    "author_display_name": comment["authorDisplayName"],
-                    "published_at": comment["publishedAt"],
-                    "text_display": comment["textDisplay"],
-                    "like_count": comment["likeCount"],
-                }
-            )
+            comments = [
+                parse_comment(video_id, item["id"], item["snippet"]["topLevelComment"]["snippet"])
+            ]
+            if include_replies:
+                comments = itertools.chain(
+                    comments,
+                    iter_replies(youtube, video_id, item, rate_limiter=rate_limiter, batcher=batcher),
+                )
+            for comment in comments:
+                if count >= limit or (comment_budget is not None and not comment_budget.acquire()):
+                    return
+                count += 1
+                yield comment
 
+        next_page_token = comment_threads_response.get("nextPageToken")
+        if not next_page_token or count >= limit:
+            break
+
+
+def get_comments_for_video(
+    youtube,
+    video_id,
+    max_comments_per_video=100,
+    rate_limiter=None,
+    include_replies=False,
+    batcher=None,
+):
+    # コメント無効か動画対策(途中で失敗した場合は取得済みのコメントを返す)
+    comments = []
+    try:
+        for comment in iter_comments_for_video(
+            youtube,
+            video_id,
+            max_comments_per_video=max_comments_per_video,
+            rate_limiter=rate_limiter,
+            include_replies=include_replies,
+            batcher=batcher,
+        ):
+            comments.append(comment)
     except Exception as e:
         logger.exception(
-            f"コメント取得中にエラー発生。この動画はスキップします: {video_id}. エラー詳細: {e}"
+            f"コメント取得中にエラー発生。この動画の以降のコメントはスキップします: {video_id}. エラー詳細: {e}"
         )
-        return []
+    return comments
 
-    return comments_data
+
+# /////////////////
+# 複数動画のコメントを並列取得
+# /////////////////
+# 動画ごとに取得用のスレッドと有界キュー(queue_size ページ分)を用意し、取得したページから順に流す。
+# 出力は入力した動画の順番で、前の動画のコメントをすべて出力してから次の動画へ進む(取得の完了順に依存させない)。
+# 保持するのは最大 max_workers 本 × queue_size ページ分のみで、コメント数の多い動画でもメモリは増えない。
+# 取得中にエラーが発生した動画は、それ以降のコメントをスキップする(出力済みのコメントはそのまま残る)。
+COMMENT_PAGE_SIZE = 100
+_END_OF_VIDEO = object()
+
+
+def iter_comments_for_videos(
+    youtube,
+    video_ids,
+    max_comments_per_video=100,
+    max_workers=COMMENT_FETCH_WORKERS,
+    requests_per_second=YOUTUBE_REQUESTS_PER_SECOND,
+    rate_limiter=None,
+    include_replies=False,
+    comment_budget=None,
+    queue_size=COMMENT_QUEUE_SIZE,
+    batcher=None,
+):
+    # 複数チャンネルを並列処理する場合は呼び出し元のリミッターを共有する
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(requests_per_second)
+
+    stop = threading.Event()
+
+    def put(pages, item):
+        # 出力側が止まった場合に備え、待機中も定期的に中断を確認する
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(video_id, pages):
+        page = []
+        try:
+            for comment in iter_comments_for_video(
+                youtube,
+                video_id,
+                max_comments_per_video=max_comments_per_video,
+                rate_limiter=rate_limiter,
+                include_replies=include_replies,
+                comment_budget=comment_budget,
+                batcher=batcher,
+            ):
+                page.append(comment)
+                if len(page) >= COMMENT_PAGE_SIZE:
+                    if not put(pages, page):
+                        return
+                    page = []
+        except QuotaBudgetExceeded as e:
+            # 予算による打ち切りは想定された動作のため、スタックトレースは出力しない
+            logger.warning(
+                f"クォータの予算に達したため、この動画の以降のコメントはスキップします: {video_id}. {e}"
+            )
+        except Exception as e:
+            logger.exception(
+                f"コメント取得中にエラー発生。この動画の以降のコメントはスキップします: {video_id}. エラー詳細: {e}"
+            )
+        if page and not put(pages, page):
+            return
+        put(pages, _END_OF_VIDEO)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        # 動画は入力順に投入するため、出力待ちの動画の取得は常に実行中(または完了済み)となる
+        video_pages = []
+        for video_id in video_ids:
+            pages = queue.Queue(maxsize=max(1, queue_size))
+            executor.submit(fetch, video_id, pages)
+            video_pages.append(pages)
+
+        for pages in video_pages:
+            while True:
+                page = pages.get()
+                if page is _END_OF_VIDEO:
+                    break
+                yield from page
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
 
 
 # /////////////////
-# lambda関数実行
+# クォータの残りに応じたコメント取得量の調整
 # /////////////////
-def lambda_handler(event, context):
-    # スケジューラーから引き継ぐ環境変数
-    CHANNEL_ID = event.get("CHANNEL_ID")
-    ARTIST_NAME_DISPLAY = event.get("ARTIST_NAME_DISPLAY")
-    ARTIST_NAME_SLUG = event.get("ARTIST_NAME_SLUG")
+# 1動画あたりの消費ユニット数を上限から見積もる(上限なしは見積もれないためNone)。
+#   commentThreads.list: 100件ごとに1ユニット
+#   comments.list(返信): 最悪の場合はスレッドごとに1回(スレッド数は1動画あたりの上限以下)
+COMMENT_THREADS_PER_REQUEST = 100
 
-    service_name = event.get("POWERTOOLS_SERVICE_NAME", "default_service")
-    logger = Logger(service=service_name)
 
-    current_execution_id = context.aws_request_id
-    logger.set_correlation_id(current_execution_id)
+def estimate_comment_units(max_comments_per_video, include_replies):
+    if max_comments_per_video <= 0:
+        return None
+    thread_pages = -(-max_comments_per_video // COMMENT_THREADS_PER_REQUEST)
+    return thread_pages + (max_comments_per_video if include_replies else 0)
 
-    logger.info(f"Lambdaハンドラー処理を開始します。{current_execution_id}")
 
-    s3 = boto3.client("s3", region_name=REGION_NAME)
+# 使用できるユニット数(allowance)に収まるよう、動画の網羅性より先に1動画あたりの取得量を減らす。
+#   1. 返信を含めたまま1動画あたりの件数を減らす
+#   2. 返信の取得をやめる
+#   3. 1動画あたり1ユニットも確保できない場合のみ、再生回数の少ない動画から対象を外す
+# 戻り値は (対象の動画ID, 1動画あたりの件数, 返信を含めるか)
+def plan_comment_fetch(video_ids, allowance, max_comments_per_video, include_replies):
+    if not video_ids:
+        return video_ids, max_comments_per_video, include_replies
+
+    requested = max_comments_per_video if max_comments_per_video > 0 else float("inf")
+    units_per_video = allowance // len(video_ids)
+
+    for replies in ([True, False] if include_replies else [False]):
+        if replies:
+            limit = units_per_video
+            while limit > 0 and estimate_comment_units(limit, True) > units_per_video:
+                limit -= 1
+        else:
+            limit = units_per_video * COMMENT_THREADS_PER_REQUEST
+        limit = min(requested, limit)
+        if limit >= 1:
+            return video_ids, int(limit), replies
+
+    return video_ids[:allowance], int(min(requested, COMMENT_THREADS_PER_REQUEST)), False
+
 
+def get_comments_for_videos(
+    youtube,
+    video_ids,
+    max_comments_per_video=100,
+    max_workers=COMMENT_FETCH_WORKERS,
+    requests_per_second=YOUTUBE_REQUESTS_PER_SECOND,
+    include_replies=False,
+    batcher=None,
+):
+    return list(
+        iter_comments_for_videos(
+            youtube,
+            video_ids,
+            max_comments_per_video=max_comments_per_video,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second,
+            include_replies=include_replies,
+            batcher=batcher,
+        )
+    )
+
+
+# /////////////////
+# lambda関数実行
+# /////////////////
+# 1回の起動で複数チャンネルを処理する場合は event["CHANNELS"] にチャンネルごとの
+# 設定を渡す(CHANNELS以外のキーは各チャンネルの既定値として引き継ぐ)
+def resolve_channel_events(event):
+    channels = event.get("CHANNELS")
+    if not channels:
+        return [event]
+
+    defaults = {key: value for key, value in event.items() if key != "CHANNELS"}
+    return [{**defaults, **channel} for channel in channels]
+
+
+# 最初のAPI呼び出しでキーが無効と判定された場合は、シークレットを強制的に再取得して再試行する
+def get_channel_with_key_refresh(youtube, channel_id, logger):
     try:
-        API_KEY = get_youtube_api_key(SECRET_ARN)  # 修正しました
-        youtube = build("youtube", "v3", developerKey=API_KEY)
+        return get_channel(youtube, channel_id), youtube
     except Exception as e:
-        logger.exception("初期化処理に失敗しました。Lambdaを終了します。")
-        raise e
+        if not is_api_key_error(e):
+            raise
+        logger.warning(
+            "APIキーが無効なため、シークレットを再取得して再試行します。",
+            extra={"channel_id": channel_id},
+        )
+        api_key = get_youtube_api_key(SECRET_ARN, force_refresh=True)
+        youtube = youtube.with_service(get_youtube_service(api_key))
+        return get_channel(youtube, channel_id), youtube
+
+
+# /////////////////
+# APIレスポンスキャッシュの生成
+# /////////////////
+def create_response_cache(s3, mode=RESPONSE_CACHE):
+    if mode == "s3":
+        store = S3CacheStore(s3, BUCKET_NAME, prefix=RESPONSE_CACHE_PREFIX)
+    elif mode == "local":
+        store = LocalCacheStore(RESPONSE_CACHE_DIR)
+    else:
+        return None
+
+    return ResponseCache(
+        store,
+        max_age_seconds=RESPONSE_CACHE_MAX_AGE_DAYS * 24 * 3600,
+        max_total_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+    )
+
+
+# /////////////////
+# チャンネル単位のスクレイピング
+# /////////////////
+# 生データの書き込みが終わった段階の行数・バイト数・S3へのリクエスト時間を記録する
+def record_writer_metrics(metrics, writer):
+    metrics["Rows"] = writer.record_count
+    metrics["Bytes"] = writer.bytes_written
+    metrics["UploadLatency"] = round(writer.upload_seconds * 1000, 3)
+
+
+def api_call_count(youtube):
+    return sum(youtube.usage_snapshot()["calls_by_endpoint"].values())
+
+
+def scrape_channel(
+    youtube,
+    s3,
+    channel_event,
+    current_execution_id,
+    logger,
+    rate_limiter,
+    quota_budget,
+    response_cache=None,
+    comment_budget=None,
+    batcher=None,
+):
+    CHANNEL_ID = channel_event.get("CHANNEL_ID")
+    ARTIST_NAME_DISPLAY = channel_event.get("ARTIST_NAME_DISPLAY")
+    ARTIST_NAME_SLUG = channel_event.get("ARTIST_NAME_SLUG")
+    # 差分取得の設定(FULL_RESCAN=trueでウォーターマークを無視して全件取得する)
+    scrape_mode = channel_event.get("SCRAPE_MODE", SCRAPE_MODE)
+    raw_format = channel_event.get("RAW_FORMAT", RAW_FORMAT)
+    # イベントの値は文字列("true"/"false")でも渡されるため、環境変数と同じく文字列として判定する
+    full_rescan = str(channel_event.get("FULL_RESCAN", False)).lower() == "true"
+    refresh_window_days = int(
+        channel_event.get("STATS_REFRESH_WINDOW_DAYS", STATS_REFRESH_WINDOW_DAYS)
+    )
+    max_comments_per_video = int(
+        channel_event.get("COMMENT_MAX_PER_VIDEO", COMMENT_MAX_PER_VIDEO)
+    )
+    include_replies = (
+        str(channel_event.get("COMMENT_INCLUDE_REPLIES", COMMENT_INCLUDE_REPLIES)).lower() == "true"
+    )
+
+    logger.info(
+        "チャンネルの処理を開始します。",
+        extra={"channel_id": CHANNEL_ID, "artist_name_slug": ARTIST_NAME_SLUG},
+    )
+
+    # API呼び出しごとに実行全体の予算とチャンネル単位の使用量を計上する
+    youtube = MeteredYouTube(youtube, quota_budget, response_cache=response_cache)
+
+    # 処理段階ごとのメトリクス(EMF)に付与する情報
+    metric_context = {
+        "service": logger.service,
+        "correlation_id": current_execution_id,
+        "artist_name_slug": ARTIST_NAME_SLUG,
+    }
+
+    with measure_stage("channel_fetch", metric_context) as metrics:
+        calls_before = api_call_count(youtube)
+        channel_records, youtube = get_channel_with_key_refresh(youtube, CHANNEL_ID, logger)
+        metrics["Rows"] = len(channel_records)
+        metrics["ApiCalls"] = api_call_count(youtube) - calls_before
+
+    raw_prefix = f"channel={CHANNEL_ID}/workflow={current_execution_id}/raw_data"
 
     # チャンネルデータの格納
-    output_channel = StringIO()
-    df_channel = pd.DataFrame(get_channel(youtube, CHANNEL_ID))
-    df_channel.to_json(output_channel, orient="records", lines=True, force_ascii=False)
-    channel_key = f"channel={CHANNEL_ID}/workflow={current_execution_id}/raw_data/data_channel.json"
-    s3.put_object(Bucket=BUCKET_NAME, Key=channel_key, Body=output_channel.getvalue())
+    channel_key = raw_object_key(raw_prefix, "channel", raw_format, RAW_COMPRESSION)
+    with measure_stage("channel_upload", metric_context) as metrics:
+        with open_raw_writer(
+            s3, BUCKET_NAME, channel_key, "channel", raw_format, compression=RAW_COMPRESSION
+        ) as writer:
+            writer.write_all(channel_records)
+        record_writer_metrics(metrics, writer)
     logger.info(
         "lambdaがS3へチャンネルデータを保存しました。",
         extra={"bucket": BUCKET_NAME, "s3_key": channel_key},
     )
 
     # ビデオデータの格納
-    output_video = StringIO()
-    df_videos = pd.DataFrame(get_video(youtube, CHANNEL_ID))
-    df_videos.to_json(output_video, orient="records", lines=True, force_ascii=False)
-    video_key = (
-        f"channel={CHANNEL_ID}/workflow={current_execution_id}/raw_data/data_video.json"
-    )
-    s3.put_object(Bucket=BUCKET_NAME, Key=video_key, Body=output_video.getvalue())
+    watermark = None
+    published_after = None
+    if scrape_mode == "incremental":
+        watermark = load_watermark(s3, BUCKET_NAME, CHANNEL_ID)
+        if not full_rescan:
+            published_after = incremental_cutoff(watermark, refresh_window_days)
+        logger.info(
+            "差分取得モードで動画情報を取得します。",
+            extra={
+                "channel_id": CHANNEL_ID,
+                "watermark": watermark,
+                "published_after": published_after.isoformat()
+                if published_after
+                else None,
+                "full_rescan": full_rescan,
+            },
+        )
+
+    if published_after is None:
+        videos = iter_videos(youtube, CHANNEL_ID, batcher=batcher)
+    else:
+        videos = iter_videos(
+            youtube, CHANNEL_ID, published_after=published_after, batcher=batcher
+        )
+
+    # 動画は取得した順にS3へ流し、コメント取得対象の上位動画と最新動画だけを保持する
+    # (取得・シリアライズ・アップロードは重なって実行されるため1つの段階として計測し、
+    # そのうちS3へのリクエストに要した時間を UploadLatency として記録する)
+    top_videos = []
+    latest_video = None
+    video_key = raw_object_key(raw_prefix, "video", raw_format, RAW_COMPRESSION)
+    with measure_stage("video_fetch_upload", metric_context) as metrics:
+        calls_before = api_call_count(youtube)
+        with open_raw_writer(
+            s3, BUCKET_NAME, video_key, "video", raw_format, compression=RAW_COMPRESSION
+        ) as writer:
+            for seq, video in enumerate(videos):
+                writer.write(video)
+
+                heapq.heappush(top_videos, (video["view_count"], -seq, video["video_id"]))
+                if len(top_videos) > 10:  # 本来は100に変更
+                    heapq.heappop(top_videos)
+
+                if scrape_mode == "incremental" and (
+                    latest_video is None
+                    or parse_timestamp(video["published_at"])
+                    > parse_timestamp(latest_video["published_at"])
+                ):
+                    latest_video = video
+        record_writer_metrics(metrics, writer)
+        metrics["ApiCalls"] = api_call_count(youtube) - calls_before
+
     logger.info(
         "lambdaがS3へビデオデータを保存しました。",
-        extra={"bucket": BUCKET_NAME, "s3_key": video_key},
+        extra={
+            "bucket": BUCKET_NAME,
+            "s3_key": video_key,
+            "record_count": writer.record_count,
+        },
+    )
+
+    # コメントデータの格納(再生回数の多い順)
+    top_video_ids = [video_id for _, _, video_id in sorted(top_videos, reverse=True)]
+
+    # クォータが残り少ない場合は、動画の網羅性より先に1動画あたりの取得量(件数・返信)を減らす
+    # (並列処理中の他のチャンネルと予算を奪い合わないよう、チャンネルごとに分けて確保した分で計画する)
+    reservation = quota_budget.claim_optional(CHANNEL_ID)
+    planned_video_ids, planned_max_comments, planned_include_replies = plan_comment_fetch(
+        top_video_ids,
+        reservation.units,
+        max_comments_per_video,
+        include_replies,
+    )
+    if (
+        len(planned_video_ids) < len(top_video_ids)
+        or planned_include_replies != include_replies
+        or (max_comments_per_video > 0 and planned_max_comments < max_comments_per_video)
+    ):
+        logger.warning(
+            "クォータの残りが少ないため、コメントの取得量を削減します。",
+            extra={
+                "channel_id": CHANNEL_ID,
+                "requested_videos": len(top_video_ids),
+                "allowed_videos": len(planned_video_ids),
+                "requested_max_comments_per_video": max_comments_per_video,
+                "allowed_max_comments_per_video": planned_max_comments,
+                "requested_include_replies": include_replies,
+                "allowed_include_replies": planned_include_replies,
+                "quota": quota_budget.snapshot(),
+            },
+        )
+    top_video_ids = planned_video_ids
+    max_comments_per_video = planned_max_comments
+    include_replies = planned_include_replies
+
+    # 計画の見積もりを超える分は、まだ計画していないチャンネルのために戻す
+    planned_units = len(top_video_ids) * (
+        estimate_comment_units(max_comments_per_video, include_replies) or 0
     )
+    reservation.release(max(0, reservation.units - planned_units))
+    youtube.reservation = reservation
 
-    # コメントデータの格納
-    top_videos_df = df_videos.sort_values(by="view_count", ascending=False).head(
-        10
-    )  # 本来は100に変更
-
-    all_comments = []
-    for index, row in top_videos_df.iterrows():
-        video_id = row["video_id"]
-        # video_title = row["title"]
-        comments = get_comments_for_video(
-            youtube, video_id, max_comments_per_video=10
-        )  # 本来は100に変更
-        all_comments.extend(comments)
-
-    output_comment = StringIO()
-    df_comments = pd.DataFrame(all_comments)
-    df_comments.to_json(output_comment, orient="records", lines=True, force_ascii=False)
-    comment_key = f"channel={CHANNEL_ID}/workflow={current_execution_id}/raw_data/data_comment.json"
-    s3.put_object(Bucket=BUCKET_NAME, Key=comment_key, Body=output_comment.getvalue())
+    # コメントは件数が多くなるため、一定の件数・サイズごとにパートファイルへ分割して書き込み、
+    # 後続にはパートファイルを格納したプレフィックスを渡す
+    comment_prefix = raw_part_prefix(raw_prefix, "comment")
+    try:
+        with measure_stage("comment_fetch_upload", metric_context) as metrics:
+            calls_before = api_call_count(youtube)
+            with RollingRawWriter(
+                s3,
+                BUCKET_NAME,
+                comment_prefix,
+                "comment",
+                raw_format,
+                compression=RAW_COMPRESSION,
+                max_records=COMMENT_PART_MAX_RECORDS,
+                max_bytes=COMMENT_PART_MAX_MB * 1024 * 1024,
+            ) as writer:
+                writer.write_all(
+                    iter_comments_for_videos(
+                        youtube,
+                        top_video_ids,
+                        max_comments_per_video=max_comments_per_video,
+                        rate_limiter=rate_limiter,
+                        include_replies=include_replies,
+                        comment_budget=comment_budget,
+                        batcher=batcher,
+                    )
+                )
+            record_writer_metrics(metrics, writer)
+            metrics["ApiCalls"] = api_call_count(youtube) - calls_before
+    finally:
+        # 使わなかった分は他のチャンネルのために戻す
+        reservation.release()
     logger.info(
         "lambdaがS3へコメントデータを保存しました。",
-        extra={"bucket": BUCKET_NAME, "s3_key": comment_key},
+        extra={
+            "bucket": BUCKET_NAME,
+            "s3_prefix": comment_prefix,
+            "record_count": writer.record_count,
+            "part_count": len(writer.part_keys),
+        },
     )
 
-    logger.info("Event Bridgeへ情報を引き継ぎます。")
-
     report_base_path = f"{BUCKET_NAME}/channel={CHANNEL_ID}/workflow={current_execution_id}/dq_reports/"
     processed_base_path = f"{BUCKET_NAME}/channel={CHANNEL_ID}/workflow={current_execution_id}/processed_data/"
 
@@ -268,36 +960,243 @@ def lambda_handler(event, context):
         "input_keys": [
             f"s3://{BUCKET_NAME}/{channel_key}",
             f"s3://{BUCKET_NAME}/{video_key}",
-            f"s3://{BUCKET_NAME}/{comment_key}",
+            f"s3://{BUCKET_NAME}/{comment_prefix}",
         ],
         "correlation_id": current_execution_id,
         "report_base_path": report_base_path,
         "processed_base_path": processed_base_path,
         "artist_name_display": ARTIST_NAME_DISPLAY,
         "artist_name_slug": ARTIST_NAME_SLUG,
+        "scrape_mode": scrape_mode,
+        "raw_format": raw_format,
+        # 実行全体("run")の集計はイベント送信直前に追記する
+        "quota_usage": {"channel": youtube.usage_snapshot()},
     }
 
-    logger.info(json.dumps(data_to_pass_to_sfn, indent=2))
+    # ウォーターマークは仮の位置に保存し、後続のGlueが成功した後にSFNが正式な位置へコピーする
+    new_watermark = None
+    if scrape_mode == "incremental":
+        new_watermark = build_watermark(
+            watermark,
+            [latest_video] if latest_video else [],
+            refresh_window_days,
+            current_execution_id,
+        )
+    if new_watermark:
+        data_to_pass_to_sfn["pending_watermark_key"] = save_pending_watermark(
+            s3, BUCKET_NAME, CHANNEL_ID, current_execution_id, new_watermark
+        )
+        data_to_pass_to_sfn["watermark_key"] = watermark_key(CHANNEL_ID)
+
+    return {
+        "channel_id": CHANNEL_ID,
+        "detail": data_to_pass_to_sfn,
+        "watermark": new_watermark,
+    }
+
+
+# /////////////////
+# 完了イベントの一括送信
+# /////////////////
+# put_events は1回あたり最大10件のため、10件ずつに分けて送信する。
+# 戻り値は (送信できたチャンネルの結果, 送信に失敗したチャンネルの情報)
+def publish_completion_events(events_client, results, logger):
+    published = []
+    failures = []
+
+    for start in range(0, len(results), MAX_EVENTS_PER_PUT):
+        end = start + MAX_EVENTS_PER_PUT
+        batch = results[start:end]
+        response = events_client.put_events(
+            Entries=[
+                {
+                    "Source": EVENT_SOURCE,
+                    "DetailType": EVENT_DETAIL_TYPE,
+                    # SFNに渡すデータをJSON文字列として 'Detail' に含める
+                    "Detail": json.dumps(result["detail"]),
+                    "EventBusName": "youtube-pipeline-event-bus",
+                }
+                for result in batch
+            ]
+        )
+        logger.info(f"Event Bridgeへ情報を引き継ぎました。data = {response}")
+
+        # Entriesは送信順に対応する(ErrorCodeを持つものが送信失敗)
+        entries = response.get("Entries")
+        if not isinstance(entries, list):
+            entries = [{}] * len(batch)
+        for result, entry in zip(batch, entries):
+            if entry.get("ErrorCode"):
+                logger.error(
+                    "Event Bridgeへの送信に失敗しました。",
+                    extra={"channel_id": result["channel_id"], "entry": entry},
+                )
+                failures.append(
+                    {
+                        "channel_id": result["channel_id"],
+                        "error": f"{entry['ErrorCode']}: {entry.get('ErrorMessage')}",
+                    }
+                )
+            else:
+                published.append(result)
+
+    return published, failures
+
+
+def lambda_handler(event, context):
+    service_name = event.get("POWERTOOLS_SERVICE_NAME", "default_service")
+    logger = Logger(service=service_name)
+
+    current_execution_id = context.aws_request_id
+    logger.set_correlation_id(current_execution_id)
+
+    logger.info(f"Lambdaハンドラー処理を開始します。{current_execution_id}")
+
+    # スケジューラーから引き継ぐ環境変数(チャンネルごと)
+    channel_events = resolve_channel_events(event)
+
+    s3 = get_client("s3", region_name=REGION_NAME)
+
+    try:
+        with measure_stage(
+            "secret_fetch", {"service": service_name, "correlation_id": current_execution_id}
+        ):
+            API_KEY = get_youtube_api_key(SECRET_ARN)  # 修正しました
+            youtube = get_youtube_service(API_KEY)
+    except Exception as e:
+        logger.exception("初期化処理に失敗しました。Lambdaを終了します。")
+        raise e
+
+    logger.info(
+        "キャッシュの利用状況",
+        extra={
+            "secret_cache": _secret_cache.stats(),
+            "client_cache": client_cache_stats(),
+        },
+    )
+
+    # リクエスト流量の上限とクォータの予算は全チャンネルで共有する
+    rate_limiter = RateLimiter(YOUTUBE_REQUESTS_PER_SECOND)
+    quota_limit = int(event.get("YOUTUBE_QUOTA_BUDGET", YOUTUBE_QUOTA_BUDGET))
+    quota_budget = QuotaBudget(
+        quota_limit, reserve=int(quota_limit * YOUTUBE_QUOTA_RESERVE_RATIO)
+    )
+    response_cache = create_response_cache(
+        s3, mode=event.get("RESPONSE_CACHE", RESPONSE_CACHE)
+    )
+    comment_budget = CommentBudget(int(event.get("COMMENT_MAX_PER_RUN", COMMENT_MAX_PER_RUN)))
+    # 全チャンネルの videos().list・コメントの取得をまとめてバッチリクエストで送信する
+    batch_size = int(event.get("YOUTUBE_BATCH_SIZE", YOUTUBE_BATCH_SIZE))
+    batcher = None
+    if batch_size > 1:
+        batcher = BatchExecutor(
+            youtube,
+            max_batch_size=batch_size,
+            max_wait=YOUTUBE_BATCH_WAIT_MS / 1000,
+            rate_limiter=rate_limiter,
+        )
+
+    # チャンネルごとの失敗は他のチャンネルへ波及させない
+    results = []
+    failures = []
+    errors = []
+    # コメント用の予算は、各チャンネルが計画する時点の残りを未確保のチャンネル数で等分して確保する
+    quota_budget.expect_claims(channel_event.get("CHANNEL_ID") for channel_event in channel_events)
+
+    def scrape_channel_with_claim(*args):
+        try:
+            return scrape_channel(*args)
+        finally:
+            # 予算を確保する前に失敗したチャンネルは、等分の対象から外す
+            quota_budget.withdraw_claim(args[2].get("CHANNEL_ID"))
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(CHANNEL_FANOUT_WORKERS, len(channel_events)))
+    ) as executor:
+        futures = [
+            executor.submit(
+                scrape_channel_with_claim,
+                youtube,
+                s3,
+                channel_event,
+                current_execution_id,
+                logger,
+                rate_limiter,
+                quota_budget,
+                response_cache,
+                comment_budget,
+                batcher,
+            )
+            for channel_event in channel_events
+        ]
+        for channel_event, future in zip(channel_events, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.exception(
+                    "チャンネルの処理に失敗しました。",
+                    extra={"channel_id": channel_event.get("CHANNEL_ID")},
+                )
+                failures.append(
+                    {"channel_id": channel_event.get("CHANNEL_ID"), "error": str(e)}
+                )
+                errors.append(e)
+
+    if batcher is not None:
+        batcher.close()
+        logger.info("バッチリクエストの利用状況", extra={"batch": batcher.stats()})
+
+    run_quota_usage = quota_budget.snapshot()
+    logger.info("YouTube APIクォータの使用状況", extra={"quota": run_quota_usage})
+
+    logger.info("Event Bridgeへ情報を引き継ぎます。")
+    for result in results:
+        result["detail"]["quota_usage"]["run"] = run_quota_usage
+        logger.info(json.dumps(result["detail"], indent=2))
     logger.info(f"送信Source: {EVENT_SOURCE}")
     logger.info(f"送信DetailType: {EVENT_DETAIL_TYPE}")
 
-    events_client = boto3.client("events")
-    response = events_client.put_events(
-        Entries=[
-            {
-                "Source": EVENT_SOURCE,
-                "DetailType": EVENT_DETAIL_TYPE,
-                # SFNに渡すデータをJSON文字列として 'Detail' に含める
-                "Detail": json.dumps(data_to_pass_to_sfn),
-                "EventBusName": "youtube-pipeline-event-bus",
-            }
-        ]
-    )
-    logger.info(f"Event Bridgeへ情報を引き継ぎました。data = {response}")
+    published = []
+    if results:
+        published, publish_failures = publish_completion_events(
+            get_client("events"), results, logger
+        )
+        failures.extend(publish_failures)
+
+    # ウォーターマークはGlueの成功後にSFNが確定する(失敗時はクリーンアップで仮の値ごと削除される)
+    for result in published:
+        if result["watermark"]:
+            logger.info(
+                "ウォーターマークを仮保存しました。後続の処理の成功後に確定します。",
+                extra={**result["watermark"], "pending_watermark_key": result["detail"]["pending_watermark_key"]},
+            )
+
+    # 期限切れ・容量超過のキャッシュを削除する(失敗しても処理結果には影響させない)
+    if response_cache is not None:
+        try:
+            eviction = response_cache.evict()
+        except Exception:
+            logger.exception("APIレスポンスキャッシュの削除に失敗しました。")
+            eviction = None
+        logger.info(
+            "APIレスポンスキャッシュの利用状況",
+            extra={"response_cache": response_cache.stats(), "eviction": eviction},
+        )
+
+    # すべてのチャンネルが失敗した場合はLambdaをエラー終了させる
+    if not published:
+        if errors:
+            raise errors[0]
+        raise RuntimeError(f"すべてのチャンネルの処理に失敗しました: {failures}")
 
     logger.info("lambdaハンドラーが完了しました。")
 
-    return {"statusCode": 200, "message": "Scraping and event publication complete."}
+    return {
+        "statusCode": 200 if not failures else 207,
+        "message": "Scraping and event publication complete.",
+        "succeeded_channels": [result["channel_id"] for result in published],
+        "failed_channels": failures,
+    }
 
 
 # 参考：EventBridgeに送信される情報の中身
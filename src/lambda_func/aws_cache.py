@@ -0,0 +1,88 @@
+import threading
+import time
+
+import boto3
+
+
+# /////////////////
+# boto3クライアントの共有
+# /////////////////
+# コンテナ内で生成したクライアントを再利用し、ウォームスタート時の生成コストを省く。
+# (boto3のクライアントはスレッドセーフなので並列処理からも共有できる)
+_clients = {}
+_clients_lock = threading.Lock()
+_client_stats = {"hits": 0, "misses": 0}
+
+
+def get_client(service_name, **kwargs):
+    cache_key = (service_name, tuple(sorted(kwargs.items())))
+
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            _client_stats["misses"] += 1
+            client = boto3.client(service_name, **kwargs)
+            _clients[cache_key] = client
+        else:
+            _client_stats["hits"] += 1
+
+    return client
+
+
+def client_cache_stats():
+    with _clients_lock:
+        return {**_client_stats, "size": len(_clients)}
+
+
+def clear_clients():
+    with _clients_lock:
+        _clients.clear()
+        _client_stats.update(hits=0, misses=0)
+
+
+# /////////////////
+# シークレットのTTL付きキャッシュ
+# /////////////////
+class SecretCache:
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._values = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def get(self, secret_id, loader, force_refresh=False):
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._values.get(secret_id)
+            if cached is not None and not force_refresh and cached[1] > now:
+                self.hits += 1
+                return cached[0]
+
+            if force_refresh:
+                self.refreshes += 1
+            else:
+                self.misses += 1
+
+        value = loader(secret_id)
+
+        with self._lock:
+            self._values[secret_id] = (value, time.monotonic() + self.ttl_seconds)
+
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits = self.misses = self.refreshes = 0
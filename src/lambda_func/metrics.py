@@ -0,0 +1,59 @@
+import os
+import time
+from contextlib import contextmanager
+
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
+
+# /////////////////
+# 処理段階ごとのメトリクス(CloudWatch Embedded Metric Format)
+# /////////////////
+# 段階ごとの所要時間・行数・バイト数を、Powertools の Metrics でEMF形式として1段階1行で出力する。
+# Lambdaのログに出力したEMFはCloudWatchがメトリクスとして取り込む(PutMetricDataは使用しない)。
+# ディメンションは service・stage・artist_name_slug とし、実行ごとに値が変わる correlation_id は
+# ディメンションにせずメタデータとして付与する(ログから実行単位で検索できる)。
+# 複数チャンネルを並列に処理するため、段階ごとに独立した EphemeralMetrics を使用する
+# (Metrics はインスタンス間でメトリクスを共有するため、スレッドごとの段階が混ざる)。
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "YouTubePipeline")
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+
+METRIC_UNITS = {
+    "Latency": MetricUnit.Milliseconds,
+    "UploadLatency": MetricUnit.Milliseconds,
+    "Rows": MetricUnit.Count,
+    "Bytes": MetricUnit.Bytes,
+    "ApiCalls": MetricUnit.Count,
+    "Errors": MetricUnit.Count,
+}
+
+
+def emit_metrics(stage, values, context):
+    if not METRICS_ENABLED:
+        return
+
+    metrics = EphemeralMetrics(namespace=METRICS_NAMESPACE, service=context.get("service"))
+    metrics.add_dimension(name="stage", value=stage)
+    if context.get("artist_name_slug"):
+        metrics.add_dimension(name="artist_name_slug", value=context["artist_name_slug"])
+    for name, value in values.items():
+        if value is not None:
+            metrics.add_metric(name=name, unit=METRIC_UNITS.get(name, MetricUnit.NoUnit), value=value)
+    if context.get("correlation_id"):
+        metrics.add_metadata(key="correlation_id", value=context["correlation_id"])
+    metrics.flush_metrics()
+
+
+# 処理段階の所要時間を計測し、終了時(失敗時も含む)にEMFを出力する。
+# 行数・バイト数などは with の中で返される辞書に設定する。
+@contextmanager
+def measure_stage(stage, context):
+    values = {}
+    started = time.perf_counter()
+    try:
+        yield values
+    except Exception:
+        values["Errors"] = 1
+        raise
+    finally:
+        values["Latency"] = round((time.perf_counter() - started) * 1000, 3)
+        values.setdefault("Errors", 0)
+        emit_metrics(stage, values, context)
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from botocore.exceptions import ClientError
+
+
+# /////////////////
+# キャッシュの保存先
+# /////////////////
+# エントリはキャッシュキーごとに1つのJSON(etag・レスポンス本体・保存時刻)として保存する。
+# entries() は (キー, 最終更新時刻(UNIX秒), サイズ) を返し、退避処理で使用する。
+class S3CacheStore:
+    def __init__(self, s3, bucket_name, prefix="cache/youtube_api"):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip("/")
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}.json"
+
+    def get(self, key):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return response["Body"].read()
+
+    def put(self, key, body):
+        self.s3.put_object(
+            Bucket=self.bucket_name,
+            Key=self._object_key(key),
+            Body=body,
+            ContentType="application/json",
+        )
+
+    def entries(self):
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=f"{self.prefix}/"):
+            for obj in page.get("Contents", []):
+                key = os.path.basename(obj["Key"])[: -len(".json")]
+                yield key, obj["LastModified"].timestamp(), obj["Size"]
+
+    def delete(self, keys):
+        keys = list(keys)
+        # delete_objects は1回あたり最大1000件
+        for start in range(0, len(keys), 1000):
+            end = start + 1000
+            self.s3.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={
+                    "Objects": [{"Key": self._object_key(key)} for key in keys[start:end]],
+                    "Quiet": True,
+                },
+            )
+
+
+class LocalCacheStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, body):
+        # 書き込み途中のファイルを読まれないよう、一時ファイルからリネームする
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, self._path(key))
+
+    def entries(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            yield name[: -len(".json")], stat.st_mtime, stat.st_size
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+# /////////////////
+# ETagによる条件付きリクエストのキャッシュ
+# /////////////////
+# 前回のレスポンスのETagを If-None-Match で送り、304 Not Modified が返った場合は
+# 保存済みのレスポンスを返す。キャッシュキーはリクエストURI(APIキーを除く)から生成するため、
+# APIキーのローテーション後もキャッシュを引き継げる。
+# 退避方針: max_age_seconds を過ぎたエントリは使用せず(通常のリクエストで取り直す)、
+# evict() で期限切れのエントリと、合計サイズが max_total_bytes を超える分を古い順に削除する。
+# videos.list は最大50件のIDをまとめて送るためURIがバッチの組み合わせごとに変わり、ほぼヒットしないので対象外とする。
+CACHED_ENDPOINTS = ("channels.list",)
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        store,
+        max_age_seconds=30 * 24 * 3600,
+        max_total_bytes=256 * 1024 * 1024,
+        max_entry_bytes=4 * 1024 * 1024,
+        endpoints=CACHED_ENDPOINTS,
+    ):
+        self.store = store
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stored": 0, "evicted": 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    @staticmethod
+    def request_key(request):
+        scheme, netloc, path, query, _ = urlsplit(request.uri)
+        params = sorted((k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k != "key")
+        normalized = urlunsplit((scheme, netloc, path, urlencode(params), ""))
+        return hashlib.sha256(f"{request.method} {normalized}".encode("utf-8")).hexdigest()
+
+    def load(self, key, now=None):
+        body = self.store.get(key)
+        if body is None:
+            return None
+
+        entry = json.loads(body)
+        now = time.time() if now is None else now
+        if now - entry["stored_at"] > self.max_age_seconds:
+            self._count("expired")
+            return None
+        return entry
+
+    def save(self, key, etag, payload):
+        body = json.dumps(
+            {"etag": etag, "stored_at": time.time(), "payload": payload},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        if len(body) > self.max_entry_bytes:
+            return
+        self.store.put(key, body)
+        self._count("stored")
+
+    # 送信前: 保存済みのETagがあれば If-None-Match を付与する
+    def prepare(self, request):
+        key = self.request_key(request)
+        entry = self.load(key)
+        if entry is not None:
+            request.headers["If-None-Match"] = entry["etag"]
+        return key, entry
+
+    # 応答後: 304の場合は保存済みのレスポンスを返し、それ以外は保存してから返す
+    # (バッチリクエストではサブリクエストごとに prepare と complete を呼び出す)
+    def complete(self, key, entry, response=None, error=None):
+        if error is not None:
+            resp = getattr(error, "resp", None)
+            if entry is not None and getattr(resp, "status", None) == 304:
+                self._count("hits")
+                return entry["payload"]
+            raise error
+
+        self._count("misses")
+        etag = response.get("etag") if isinstance(response, dict) else None
+        if etag:
+            self.save(key, etag, response)
+        return response
+
+    def execute(self, request, **kwargs):
+        key, entry = self.prepare(request)
+        try:
+            response = request.execute(**kwargs)
+        except Exception as e:
+            return self.complete(key, entry, error=e)
+        return self.complete(key, entry, response=response)
+
+    def evict(self, now=None):
+        now = time.time() if now is None else now
+        entries = sorted(self.store.entries(), key=lambda entry: entry[1])
+
+        expired = [key for key, modified, _ in entries if now - modified > self.max_age_seconds]
+        live = [(key, size) for key, modified, size in entries if now - modified <= self.max_age_seconds]
+
+        # 合計サイズの上限を超える分は古いものから削除する
+        overflow = []
+        total_bytes = sum(size for _, size in live)
+        for key, size in live:
+            if total_bytes <= self.max_total_bytes:
+                break
+            overflow.append(key)
+            total_bytes -= size
+
+        evicted = expired + overflow
+        if evicted:
+            self.store.delete(evicted)
+            self._count("evicted", len(evicted))
+        return {"evicted": len(evicted), "remaining_entries": len(live) - len(overflow), "remaining_bytes": total_bytes}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
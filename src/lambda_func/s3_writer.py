@@ -0,0 +1,462 @@
+import json
+import time
+import zlib
+
+# S3のマルチパートアップロードは最終パート以外5MiB以上が必要
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+# json.dumps はオプション指定時に毎回エンコーダーを生成するため使い回す
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+# /////////////////
+# S3へのストリーミングアップロード
+# /////////////////
+# 書き込まれたバイト列をpart_sizeごとにマルチパートアップロードする。
+# 全体がpart_size未満で終わった場合は通常のput_objectで1回だけ送信する。
+class S3StreamingUpload:
+    def __init__(
+        self,
+        s3,
+        bucket_name,
+        key,
+        part_size=DEFAULT_PART_SIZE,
+        content_type="application/x-ndjson",
+    ):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.content_type = content_type
+        self.bytes_written = 0
+        # S3へのリクエストに要した時間の合計(メトリクス用)
+        self.upload_seconds = 0.0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self._closed = False
+
+    def _object_args(self):
+        args = {"Bucket": self.bucket_name, "Key": self.key}
+        if self.content_type:
+            args["ContentType"] = self.content_type
+        return args
+
+    def _request(self, method, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(**kwargs)
+        finally:
+            self.upload_seconds += time.perf_counter() - started
+
+    def _upload_part(self, body):
+        if self._upload_id is None:
+            response = self._request(self.s3.create_multipart_upload, **self._object_args())
+            self._upload_id = response["UploadId"]
+
+        part_number = len(self._parts) + 1
+        response = self._request(
+            self.s3.upload_part,
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self.bytes_written += len(data)
+
+        # バッファがpart_sizeに達したらそのまま1パートとして送信する(コピーを作らない)
+        if len(self._buffer) >= self.part_size:
+            body = self._buffer
+            self._buffer = bytearray()
+            self._upload_part(body)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._upload_id is None:
+            self._request(self.s3.put_object, Body=bytes(self._buffer), **self._object_args())
+        else:
+            if self._buffer:
+                self._upload_part(self._buffer)
+            self._request(
+                self.s3.complete_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        self._buffer = bytearray()
+
+    # pyarrowなどファイルオブジェクトを要求する書き込み側から利用するためのインターフェース
+    @property
+    def closed(self):
+        return self._closed
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def abort(self):
+        self._closed = True
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            self.s3.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+# /////////////////
+# NDJSON(JSON Lines)のストリーミング書き込み
+# /////////////////
+# レコードを受け取った順にJSON Linesへエンコードし、chunk_sizeごとに
+# (必要ならgzip圧縮して)アップロードへ流す。保持するのは常に1チャンク分のみ。
+class NdjsonWriter:
+    def __init__(self, upload, compression=None, chunk_size=256 * 1024):
+        self.upload = upload
+        self.chunk_size = chunk_size
+        self.record_count = 0
+        self._chunk = bytearray()
+        # wbits=31 でgzipヘッダー付きのストリームを生成する
+        self._compressor = zlib.compressobj(wbits=31) if compression == "gzip" else None
+
+    def _flush_chunk(self):
+        if not self._chunk:
+            return
+        data = bytes(self._chunk)
+        self._chunk = bytearray()
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        if data:
+            self.upload.write(data)
+
+    def write(self, record):
+        self._chunk.extend((_json_encoder.encode(record) + "\n").encode("utf-8"))
+        self.record_count += 1
+
+        if len(self._chunk) >= self.chunk_size:
+            self._flush_chunk()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        self._flush_chunk()
+        if self._compressor is not None:
+            self.upload.write(self._compressor.flush())
+        self.upload.close()
+
+    # アップロード済み(送信待ちを含む)のバイト数と、S3へのリクエストに要した時間
+    @property
+    def bytes_written(self):
+        return self.upload.bytes_written
+
+    @property
+    def upload_seconds(self):
+        return self.upload.upload_seconds
+
+    def abort(self):
+        self.upload.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def open_ndjson_writer(s3, bucket_name, key, compression=None, part_size=DEFAULT_PART_SIZE):
+    # gzipはContent-Encodingではなく拡張子(.gz)でSpark側に判別させる
+    upload = S3StreamingUpload(
+        s3,
+        bucket_name,
+        key,
+        part_size=part_size,
+        content_type="application/gzip" if compression == "gzip" else "application/x-ndjson",
+    )
+    return NdjsonWriter(upload, compression=compression)
+
+
+# /////////////////
+# 生データのスキーマ(Glueジョブの channel_schema / video_schema / comment_schema と対応)
+# /////////////////
+RAW_SCHEMAS = {
+    "channel": [
+        ("channel_id", "string"),
+        ("channel_name", "string"),
+        ("published_at", "string"),
+        ("subscriber_count", "int64"),
+        ("total_views", "int64"),
+        ("video_count", "int64"),
+    ],
+    "video": [
+        ("video_id", "string"),
+        ("title", "string"),
+        ("published_at", "string"),
+        ("view_count", "int64"),
+        ("like_count", "int64"),
+        ("comment_count", "int64"),
+        ("duration", "string"),
+        ("tags", "string"),
+    ],
+    "comment": [
+        ("video_id", "string"),
+        ("comment_id", "string"),
+        ("author_display_name", "string"),
+        ("published_at", "string"),
+        ("text_display", "string"),
+        ("like_count", "int64"),
+    ],
+}
+
+
+# /////////////////
+# Parquetのストリーミング書き込み
+# /////////////////
+# レコードをrow_group_size件ずつ列形式にまとめ、スキーマに沿った型で
+# Parquetの行グループとしてアップロードへ流す。スキーマに合わない値(型違い・欠損)は
+# 書き込み時点でエラーにする。pyarrowはParquet出力を選んだ場合のみ読み込む。
+class ParquetWriter:
+    def __init__(self, upload, table_name, row_group_size=50_000, compression="snappy"):
+        import pyarrow as pa
+
+        self._pa = pa
+        self.upload = upload
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.record_count = 0
+        self.schema = pa.schema(
+            [
+                pa.field(name, getattr(pa, type_name)(), nullable=False)
+                for name, type_name in RAW_SCHEMAS[table_name]
+            ]
+        )
+        self._columns = {name: [] for name in self.schema.names}
+        self._sink = pa.PythonFile(upload, mode="w")
+        self._writer = None
+
+    def _flush_row_group(self):
+        if not self._columns[self.schema.names[0]]:
+            return
+
+        import pyarrow.parquet as pq
+
+        arrays = []
+        for field in self.schema:
+            array = self._pa.array(self._columns[field.name], type=field.type)
+            if array.null_count:
+                raise ValueError(f"必須の列 '{field.name}' に欠損値が含まれています。")
+            arrays.append(array)
+        table = self._pa.Table.from_arrays(arrays, schema=self.schema)
+
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(
+                self._sink, self.schema, compression=self.compression
+            )
+        self._writer.write_table(table)
+        self._columns = {name: [] for name in self.schema.names}
+
+    def write(self, record):
+        for name in self.schema.names:
+            self._columns[name].append(record.get(name))
+        self.record_count += 1
+
+        if len(self._columns[self.schema.names[0]]) >= self.row_group_size:
+            self._flush_row_group()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        self._flush_row_group()
+        if self._writer is None:
+            # 0件の場合もスキーマ付きの空ファイルを出力する
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(
+                self._sink, self.schema, compression=self.compression
+            )
+        self._writer.close()
+        self.upload.close()
+
+    # アップロード済み(送信待ちを含む)のバイト数と、S3へのリクエストに要した時間
+    @property
+    def bytes_written(self):
+        return self.upload.bytes_written
+
+    @property
+    def upload_seconds(self):
+        return self.upload.upload_seconds
+
+    def abort(self):
+        self.upload.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+# 生データの出力形式に応じたキーの拡張子
+def raw_extension(raw_format="json", compression=None):
+    if raw_format == "parquet":
+        return ".parquet"
+    return ".json.gz" if compression == "gzip" else ".json"
+
+
+def raw_object_key(raw_prefix, table_name, raw_format="json", compression=None):
+    return f"{raw_prefix}/data_{table_name}{raw_extension(raw_format, compression)}"
+
+
+# パート分割して出力するテーブルの接頭辞(Glueはこの接頭辞配下をまとめて読み込む)
+def raw_part_prefix(raw_prefix, table_name):
+    return f"{raw_prefix}/data_{table_name}/"
+
+
+def open_raw_writer(
+    s3, bucket_name, key, table_name, raw_format="json", compression=None
+):
+    if raw_format == "parquet":
+        upload = S3StreamingUpload(
+            s3, bucket_name, key, content_type="application/vnd.apache.parquet"
+        )
+        return ParquetWriter(upload, table_name)
+
+    return open_ndjson_writer(s3, bucket_name, key, compression=compression)
+
+
+# /////////////////
+# パートファイルへの分割書き込み
+# /////////////////
+# 1ファイルの件数・サイズに上限を設け、上限に達するごとに次のパートファイル
+# (part-00000, part-00001, ...)へ切り替える。各パートは open_raw_writer でストリーミング書き込みするため、
+# 保持するのは常に書き込み中のパートの1チャンク(Parquetは1行グループ)分のみ。
+# 0件の場合も、Glueが接頭辞を読み込めるよう空のpart-00000を出力する。
+DEFAULT_PART_MAX_RECORDS = 100_000
+DEFAULT_PART_MAX_BYTES = 64 * 1024 * 1024
+
+
+class RollingRawWriter:
+    def __init__(
+        self,
+        s3,
+        bucket_name,
+        prefix,
+        table_name,
+        raw_format="json",
+        compression=None,
+        max_records=DEFAULT_PART_MAX_RECORDS,
+        max_bytes=DEFAULT_PART_MAX_BYTES,
+    ):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.table_name = table_name
+        self.raw_format = raw_format
+        self.compression = compression
+        self.max_records = max(1, max_records)
+        self.max_bytes = max_bytes
+        self.record_count = 0
+        self.part_keys = []
+        self._closed_bytes = 0
+        self._closed_upload_seconds = 0.0
+        self._writer = None
+        self._part_records = 0
+        self._open_part()
+
+    def _open_part(self):
+        extension = raw_extension(self.raw_format, self.compression)
+        key = f"{self.prefix}part-{len(self.part_keys):05d}{extension}"
+        self._writer = open_raw_writer(
+            self.s3,
+            self.bucket_name,
+            key,
+            self.table_name,
+            self.raw_format,
+            compression=self.compression,
+        )
+        self.part_keys.append(key)
+        self._part_records = 0
+        self._part_closed = False
+
+    def _close_part(self):
+        self._writer.close()
+        self._closed_bytes += self._writer.bytes_written
+        self._closed_upload_seconds += self._writer.upload_seconds
+        self._part_closed = True
+
+    def write(self, record):
+        # 上限に達したパートは次のレコードを書き込む時点で閉じる(末尾に空のパートを作らない)
+        if self._part_records >= self.max_records or self._writer.bytes_written >= self.max_bytes:
+            self._close_part()
+            self._open_part()
+
+        self._writer.write(record)
+        self._part_records += 1
+        self.record_count += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    @property
+    def bytes_written(self):
+        if self._part_closed:
+            return self._closed_bytes
+        return self._closed_bytes + self._writer.bytes_written
+
+    @property
+    def upload_seconds(self):
+        if self._part_closed:
+            return self._closed_upload_seconds
+        return self._closed_upload_seconds + self._writer.upload_seconds
+
+    def close(self):
+        self._close_part()
+
+    def abort(self):
+        # 書き込み中のパートのみ破棄する(完了したパートは失敗時のクリーンアップで削除される)
+        self._writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,90 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+
+# /////////////////
+# 差分取得用ウォーターマーク
+# /////////////////
+# チャンネルごとに「最後に取得した最新動画」と統計再取得の期間を
+# channel=<id>/state/watermark.json に保存する。
+def watermark_key(channel_id):
+    return f"channel={channel_id}/state/watermark.json"
+
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+# 後続のワークフロー(Glue)が成功するまでは、ワークフローのディレクトリ配下に仮のウォーターマークとして置く。
+# Glueの成功後にSFNが正式な位置へコピーし、失敗した場合はクリーンアップがディレクトリごと削除する。
+# (Glueが失敗した実行の動画を、次回の差分取得で取りこぼさないようにするため)
+def pending_watermark_key(channel_id, workflow_id):
+    return f"channel={channel_id}/workflow={workflow_id}/state/watermark.json"
+
+
+def load_watermark(s3, bucket_name, channel_id):
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=watermark_key(channel_id))
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+
+    return json.loads(response["Body"].read())
+
+
+def save_watermark(s3, bucket_name, channel_id, watermark):
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=watermark_key(channel_id),
+        Body=json.dumps(watermark, ensure_ascii=False),
+    )
+
+
+def save_pending_watermark(s3, bucket_name, channel_id, workflow_id, watermark):
+    key = pending_watermark_key(channel_id, workflow_id)
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=json.dumps(watermark, ensure_ascii=False),
+    )
+    return key
+
+
+# ウォーターマークより新しい動画と、統計再取得期間内の動画だけを取得対象にする
+def incremental_cutoff(watermark, refresh_window_days, now=None):
+    if not watermark or not watermark.get("latest_published_at"):
+        return None
+
+    now = now or datetime.now(timezone.utc)
+    refresh_from = now - timedelta(days=refresh_window_days)
+
+    return min(parse_timestamp(watermark["latest_published_at"]), refresh_from)
+
+
+def build_watermark(previous, videos, refresh_window_days, workflow_id):
+    latest = max(videos, key=lambda v: parse_timestamp(v["published_at"]), default=None)
+
+    if latest is None:
+        if previous:
+            return {**previous, "workflow_id": workflow_id}
+        return None
+
+    if previous and previous.get("latest_published_at") and parse_timestamp(
+        previous["latest_published_at"]
+    ) > parse_timestamp(latest["published_at"]):
+        latest_video_id = previous["latest_video_id"]
+        latest_published_at = previous["latest_published_at"]
+    else:
+        latest_video_id = latest["video_id"]
+        latest_published_at = latest["published_at"]
+
+    return {
+        "latest_video_id": latest_video_id,
+        "latest_published_at": latest_published_at,
+        "refresh_window_days": refresh_window_days,
+        "workflow_id": workflow_id,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
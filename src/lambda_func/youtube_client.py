@@ -0,0 +1,467 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# /////////////////
+# YouTubeサービスオブジェクトの生成
+# /////////////////
+# google-api-python-clientのパッケージに同梱されているディスカバリードキュメントを
+# コンテナ内で1回だけ読み込み、build_from_documentでサービスを組み立てる。
+# (ネットワーク経由のディスカバリーやキャッシュファイルの探索を行わない)
+# (googleapiclient.discoveryのimport自体が重いため、必要になるまで遅延させる)
+_discovery_lock = threading.Lock()
+_discovery_document = None
+
+
+def load_discovery_document():
+    global _discovery_document
+
+    with _discovery_lock:
+        if _discovery_document is None:
+            from googleapiclient.discovery_cache import get_static_doc
+
+            _discovery_document = get_static_doc("youtube", "v3")
+
+    return _discovery_document
+
+
+def build_youtube_service(api_key):
+    from googleapiclient.discovery import build_from_document
+
+    return build_from_document(load_discovery_document(), developerKey=api_key)
+
+
+# コールドスタート時、Secrets Managerへの問い合わせ(I/O待ち)と並行して
+# googleapiclientのimportとディスカバリードキュメントの読み込みを済ませておく
+def prewarm_in_background():
+    def warm():
+        from googleapiclient import discovery  # noqa: F401
+
+        load_discovery_document()
+
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    return thread
+
+
+# /////////////////
+# スレッドごとのHTTPクライアント
+# /////////////////
+# googleapiclientのサービスオブジェクトが持つhttplib2.Httpはスレッドセーフではないため、
+# 並列実行時はスレッドごとに専用のHttpを用意してexecute()へ渡す。
+_thread_local = threading.local()
+
+
+def get_thread_http():
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        from googleapiclient.http import build_http
+
+        http = build_http()
+        _thread_local.http = http
+    return http
+
+
+def execute_request(request, rate_limiter=None, batcher=None):
+    # バッチで送信する場合、流量制限は BatchExecutor がサブリクエストの件数分まとめて行う
+    if batcher is not None:
+        return batcher.execute(request)
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    return request.execute(http=get_thread_http())
+
+
+# APIキーの無効・期限切れによるエラーかどうか(クォータ超過などは含めない)
+API_KEY_ERROR_MARKERS = ("keyInvalid", "keyExpired", "API_KEY_INVALID", "API key not valid", "API key expired")
+
+
+def is_api_key_error(error):
+    resp = getattr(error, "resp", None)
+    if resp is None or getattr(resp, "status", None) not in (400, 401, 403):
+        return False
+
+    content = getattr(error, "content", b"")
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+    return any(marker in content for marker in API_KEY_ERROR_MARKERS)
+
+
+# /////////////////
+# リクエスト流量の制御
+# /////////////////
+class RateLimiter:
+    # 1秒あたりのリクエスト数を上限とするリミッター(0以下なら無制限)
+    # permits を指定すると、その件数分の枠をまとめて確保する(バッチリクエスト用)
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self, permits=1):
+        if self.interval <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval * permits
+
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+# /////////////////
+# YouTube Data APIのクォータ管理
+# /////////////////
+# エンドポイントごとの消費ユニット数(https://developers.google.com/youtube/v3/determine_quota_cost)
+QUOTA_COSTS = {
+    "channels.list": 1,
+    "playlistItems.list": 1,
+    "videos.list": 1,
+    "commentThreads.list": 1,
+    "comments.list": 1,
+    "search.list": 100,
+}
+METERED_RESOURCES = ("channels", "playlistItems", "videos", "commentThreads", "comments", "search")
+# 予算が残り少ない場合に先に削る任意の取得(コメント)
+OPTIONAL_ENDPOINTS = ("commentThreads.list", "comments.list")
+
+
+class QuotaBudgetExceeded(Exception):
+    pass
+
+
+# 任意の取得(コメント)用にQuotaBudgetから確保したユニット。
+# 確保した分は他のチャンネルの任意の取得には使われず、余った分は release() で戻す。
+class QuotaReservation:
+    def __init__(self, budget, units):
+        self.budget = budget
+        self.units = units
+        self.remaining = units
+
+    def release(self, units=None):
+        self.budget.release(self, units)
+
+
+class QuotaBudget:
+    # 1回の実行で使用できるクォータ(limit)と、必須の取得のために残しておく量(reserve)
+    # 複数チャンネルを並列処理する場合、任意の取得の予算は claim_optional() でチャンネルごとに分けて確保する
+    def __init__(self, limit, reserve=0):
+        self.limit = limit
+        self.reserve = reserve
+        self.used = 0
+        self.reserved = 0
+        self.units_by_endpoint = {}
+        self.calls_by_endpoint = {}
+        self._pending_claims = set()
+        self._lock = threading.Lock()
+
+    def charge(self, endpoint, units=None, reservation=None):
+        units = QUOTA_COSTS.get(endpoint, 1) if units is None else units
+        optional = endpoint in OPTIONAL_ENDPOINTS
+
+        with self._lock:
+            if optional and reservation is not None:
+                # 確保済みのユニットから使用する(実行全体の上限は超えない)
+                if units > reservation.remaining or self.used + units > self.limit:
+                    raise QuotaBudgetExceeded(
+                        f"確保したクォータを超過するため {endpoint} を実行しません。"
+                        f"(reserved={reservation.units}, remaining={reservation.remaining}, units={units})"
+                    )
+                reservation.remaining -= units
+                self.reserved -= units
+            else:
+                # 任意の取得はreserve・他のチャンネルが確保した分に食い込む前に打ち切る
+                ceiling = self.limit - self.reserve - self.reserved if optional else self.limit
+                if self.used + units > ceiling:
+                    raise QuotaBudgetExceeded(
+                        f"クォータの予算を超過するため {endpoint} を実行しません。"
+                        f"(used={self.used}, units={units}, ceiling={ceiling})"
+                    )
+            self.used += units
+            self.units_by_endpoint[endpoint] = self.units_by_endpoint.get(endpoint, 0) + units
+            self.calls_by_endpoint[endpoint] = self.calls_by_endpoint.get(endpoint, 0) + 1
+
+    def remaining(self):
+        with self._lock:
+            return self.limit - self.used
+
+    def optional_allowance(self):
+        # reserveと確保済みの分を残したうえで任意の取得に使えるユニット数
+        with self._lock:
+            return max(0, self.limit - self.reserve - self.used - self.reserved)
+
+    # これから任意の予算を確保するチャンネル(キー)を登録する
+    def expect_claims(self, keys):
+        with self._lock:
+            self._pending_claims.update(keys)
+
+    # 残りの任意の予算を、まだ確保していないチャンネルの数で等分して確保する
+    def claim_optional(self, key=None):
+        with self._lock:
+            self._pending_claims.discard(key)
+            free = max(0, self.limit - self.reserve - self.used - self.reserved)
+            units = int(free // (len(self._pending_claims) + 1))
+            self.reserved += units
+        return QuotaReservation(self, units)
+
+    # 確保する前に失敗したチャンネルを対象から外す(確保済みの場合は何もしない)
+    def withdraw_claim(self, key):
+        with self._lock:
+            self._pending_claims.discard(key)
+
+    def release(self, reservation, units=None):
+        with self._lock:
+            units = reservation.remaining if units is None else min(units, reservation.remaining)
+            reservation.remaining -= units
+            self.reserved -= units
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "budget": self.limit,
+                "reserve": self.reserve,
+                "used": self.used,
+                "reserved": self.reserved,
+                "remaining": self.limit - self.used,
+                "units_by_endpoint": dict(self.units_by_endpoint),
+                "calls_by_endpoint": dict(self.calls_by_endpoint),
+            }
+
+
+# サービスオブジェクトをラップし、execute()のたびにクォータを計上する。
+# 計上は実行全体の予算(QuotaBudget)と、このラッパー単位(チャンネル単位)の両方に行う。
+# response_cacheを渡した場合は、対象のエンドポイントをETagによる条件付きリクエストで実行する。
+# reservationを設定した場合、任意の取得(コメント)はそのチャンネルが確保したユニットから計上する。
+class MeteredYouTube:
+    def __init__(self, service, budget, usage=None, response_cache=None, reservation=None):
+        self.service = service
+        self.budget = budget
+        self.usage = usage if usage is not None else QuotaBudget(float("inf"))
+        self.response_cache = response_cache
+        self.reservation = reservation
+
+    def with_service(self, service):
+        return MeteredYouTube(
+            service,
+            self.budget,
+            usage=self.usage,
+            response_cache=self.response_cache,
+            reservation=self.reservation,
+        )
+
+    def usage_snapshot(self):
+        snapshot = self.usage.snapshot()
+        return {
+            "used": snapshot["used"],
+            "units_by_endpoint": snapshot["units_by_endpoint"],
+            "calls_by_endpoint": snapshot["calls_by_endpoint"],
+        }
+
+    def __getattr__(self, name):
+        attribute = getattr(self.service, name)
+        if name not in METERED_RESOURCES:
+            return attribute
+
+        def resource(*args, **kwargs):
+            return _MeteredResource(attribute(*args, **kwargs), name, self)
+
+        return resource
+
+
+class _MeteredResource:
+    def __init__(self, resource, resource_name, metered):
+        self._resource = resource
+        self._resource_name = resource_name
+        self._metered = metered
+
+    def __getattr__(self, name):
+        method = getattr(self._resource, name)
+        endpoint = f"{self._resource_name}.{name}"
+
+        def build_request(*args, **kwargs):
+            return MeteredRequest(method(*args, **kwargs), endpoint, self._metered)
+
+        return build_request
+
+
+class MeteredRequest:
+    def __init__(self, request, endpoint, metered):
+        self.request = request
+        self.endpoint = endpoint
+        self.metered = metered
+
+    def charge(self):
+        self.metered.budget.charge(self.endpoint, reservation=self.metered.reservation)
+        self.metered.usage.charge(self.endpoint)
+
+    def execute(self, **kwargs):
+        # 304 Not Modified の応答でもリクエスト自体はクォータを消費するため、先に計上する
+        self.charge()
+        cache = self.metered.response_cache
+        if cache is not None and self.endpoint in cache.endpoints:
+            return cache.execute(self.request, **kwargs)
+        return self.request.execute(**kwargs)
+
+    # バッチリクエストへ追加する前の処理(クォータの計上と条件付きリクエストの準備)。
+    # 戻り値は (バッチに追加するリクエスト, 個別の応答・エラーから結果を返す関数)
+    def prepare_batch(self):
+        self.charge()
+        cache = self.metered.response_cache
+        if cache is None or self.endpoint not in cache.endpoints:
+            return self.request, None
+
+        key, entry = cache.prepare(self.request)
+        return self.request, lambda response, error: cache.complete(key, entry, response, error)
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+
+# /////////////////
+# バッチリクエスト
+# /////////////////
+# 複数のスレッドから同時に発行された呼び出し(videos().list・commentThreads().list など)を集め、
+# 1つのHTTPバッチリクエスト(1回あたり最大 max_batch_size 件)にまとめて送信する。
+# 呼び出し側は execute() で従来どおり1件ずつ結果を受け取り、サブリクエストのエラーはその呼び出し元にだけ返る。
+# 最初の呼び出しから最大 max_wait 秒だけ後続の呼び出しを待ってから送信する。
+# クォータの計上と条件付きリクエストの準備・応答の保存(S3へのI/O)は呼び出し元のスレッドで行い、
+# 送信用のスレッドはHTTPの送信だけを行う(予算を超える呼び出しはその呼び出しだけ失敗させる)。
+# 流量制限はサブリクエスト1件につき1枠とし、バッチの送信前に件数分の枠を確保する
+# (requests_per_second はバッチの有無にかかわらずAPIへのリクエスト数の上限になる)。
+BATCH_MAX_SIZE = 50
+
+
+class BatchExecutor:
+    def __init__(self, service, max_batch_size=BATCH_MAX_SIZE, max_wait=0.02, rate_limiter=None):
+        self.service = service
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.rate_limiter = rate_limiter
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._stats = {"batches": 0, "requests": 0, "failed_batches": 0, "largest_batch": 0}
+
+    def execute(self, request):
+        with self._lock:
+            closed = self._closed
+        # 終了後の呼び出しは個別に実行する
+        if closed:
+            return execute_request(request, rate_limiter=self.rate_limiter)
+
+        prepare_batch = getattr(request, "prepare_batch", None)
+        http_request, finish = prepare_batch() if prepare_batch else (request, None)
+
+        future = None
+        with self._lock:
+            if not self._closed:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+                future = Future()
+                self._pending.put((http_request, future))
+
+        # 準備中に終了した場合は、準備済みのリクエストを個別に送信する
+        if future is None:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            response, error = self._execute_single(http_request)
+        else:
+            response, error = future.result()
+
+        if finish is not None:
+            return finish(response, error)
+        if error is not None:
+            raise error
+        return response
+
+    @staticmethod
+    def _execute_single(http_request):
+        try:
+            return http_request.execute(http=get_thread_http()), None
+        except Exception as e:
+            return None, e
+
+    def _collect(self):
+        item = self._pending.get()
+        if item is None:
+            return None, True
+
+        items = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._pending.get(timeout=timeout) if timeout > 0 else self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def _run(self):
+        while True:
+            items, closing = self._collect()
+            if items:
+                self._dispatch(items)
+            if closing:
+                return
+
+    def _dispatch(self, items):
+        batch = self.service.new_batch_http_request()
+        added = {}
+
+        # 応答・エラーはそのまま呼び出し元へ返し、キャッシュへの保存などは呼び出し元で行う
+        for index, (http_request, future) in enumerate(items):
+            def callback(request_id, response, exception, future=future):
+                future.set_result((response, exception))
+
+            batch.add(http_request, callback=callback, request_id=str(index))
+            added[str(index)] = future
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["requests"] += len(added)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(added))
+
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(len(added))
+            batch.execute(http=get_thread_http())
+        except Exception as e:
+            # バッチ全体の送信に失敗した場合は、結果を受け取っていない呼び出しすべてに返す
+            with self._lock:
+                self._stats["failed_batches"] += 1
+            for future in added.values():
+                if not future.done():
+                    future.set_result((None, e))
+
+        for future in added.values():
+            if not future.done():
+                future.set_result((None, RuntimeError("バッチリクエストの応答にサブリクエストの結果が含まれていません。")))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._pending.put(None)
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -142,17 +142,10 @@ resource "aws_iam_role" "sfn_glue_execution_role" {
 # SFNのポリシー（別途で記述）
 resource "aws_iam_policy" "startcrawler_cloudwatch_policy" {
   name        = "AllowStartCrawlerCloudWatch"
-  description = "Allow Step Function to start Glue crawler"
+  description = "Allow Step Function to write execution logs"
   policy      = jsonencode({
     Version = "2012-10-17",
     Statement = [
-      {
-        Effect = "Allow",
-        Action = [
-          "glue:StartCrawler"
-        ],
-        Resource = "arn:aws:glue:ap-northeast-1:879363564916:crawler/youtube_processed_data_crawler"
-      },
       {
         Effect = "Allow",
         Action = [
@@ -165,7 +158,33 @@ resource "aws_iam_policy" "startcrawler_cloudwatch_policy" {
   })
 }
 
-# SFNがCrawlerをスタートするポリシーをモジュールにアタッチ
+# Glueの成功後に仮のウォーターマークを正式な位置へコピーするためのポリシー
+resource "aws_iam_policy" "sfn_promote_watermark_policy" {
+  name        = "AllowPromoteWatermark"
+  description = "Allow Step Function to promote the pending incremental-scrape watermark"
+  policy      = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect   = "Allow",
+        Action   = ["s3:GetObject"],
+        Resource = "arn:aws:s3:::${var.data_bucket_name}/channel=*/workflow=*/state/watermark.json"
+      },
+      {
+        Effect   = "Allow",
+        Action   = ["s3:PutObject"],
+        Resource = "arn:aws:s3:::${var.data_bucket_name}/channel=*/state/watermark.json"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "attach_sfn_promote_watermark" {
+  role       = module.step-function.role_name
+  policy_arn = aws_iam_policy.sfn_promote_watermark_policy.arn
+}
+
+# SFNのログ出力ポリシーをモジュールにアタッチ
 resource "aws_iam_role_policy_attachment" "attach_glue_startcrawler" {
   role       = module.step-function.role_name
   policy_arn = aws_iam_policy.startcrawler_cloudwatch_policy.arn
@@ -183,7 +202,7 @@ module "step-function" {
 {
   "Comment": "A description of my state machine",
   "QueryLanguage": "JSONPath",
-  "TimeoutSeconds": 900,
+  "TimeoutSeconds": ${local.sfn_timeout_seconds},
   "StartAt": "Pass",
   "States": {
     "Pass": {
@@ -206,11 +225,20 @@ module "step-function" {
           "--processed_base_path.$": "$.decoded_payload.processed_base_path",
           "--report_base_path.$": "$.decoded_payload.report_base_path",
           "--s3_input_path_channel.$": "$.decoded_payload.input_keys[0]",
-          "--s3_input_path_video.$": "$.decoded_payload.input_keys[1]"
+          "--s3_input_path_video.$": "$.decoded_payload.input_keys[1]",
+          "--raw_format.$": "$.decoded_payload.raw_format"
         }
       },
       "ResultPath": "$.glue_result",
       "Retry": [
+        {
+          "ErrorEquals": [
+            "Glue.ConcurrentRunsExceededException"
+          ],
+          "IntervalSeconds": ${local.glue_queue_retry_interval},
+          "MaxAttempts": ${local.glue_queue_retry_attempts},
+          "BackoffRate": 1
+        },
         {
           "ErrorEquals": [
             "States.TaskFailed"
@@ -229,9 +257,50 @@ module "step-function" {
           "Next": "Lambda Invoke"
         }
       ],
-      "Next": "StartCrawler",
+      "Next": "HasPendingWatermark",
       "TimeoutSeconds": 300
     },
+    "HasPendingWatermark": {
+      "Type": "Choice",
+      "Choices": [
+        {
+          "Variable": "$.decoded_payload.pending_watermark_key",
+          "IsPresent": true,
+          "Next": "PromoteWatermark"
+        }
+      ],
+      "Default": "NotifySuccess"
+    },
+    "PromoteWatermark": {
+      "Type": "Task",
+      "Resource": "arn:aws:states:::aws-sdk:s3:copyObject",
+      "Parameters": {
+        "Bucket.$": "$.decoded_payload.bucket_name",
+        "Key.$": "$.decoded_payload.watermark_key",
+        "CopySource.$": "States.Format('{}/{}', $.decoded_payload.bucket_name, $.decoded_payload.pending_watermark_key)"
+      },
+      "ResultPath": null,
+      "Retry": [
+        {
+          "ErrorEquals": [
+            "States.ALL"
+          ],
+          "IntervalSeconds": 2,
+          "MaxAttempts": 3,
+          "BackoffRate": 2
+        }
+      ],
+      "Catch": [
+        {
+          "ErrorEquals": [
+            "States.ALL"
+          ],
+          "ResultPath": "$.ErrorDetails",
+          "Next": "NotifyFailure"
+        }
+      ],
+      "Next": "NotifySuccess"
+    },
     "Lambda Invoke": {
       "Type": "Task",
       "Resource": "arn:aws:states:::lambda:invoke",
@@ -257,35 +326,6 @@ module "step-function" {
       "Next": "NotifyFailure",
       "TimeoutSeconds": 300
     },
-    "StartCrawler": {
-      "Type": "Task",
-      "Parameters": {
-        "Name": "${aws_glue_crawler.youtube_processed_data_crawler.name}"
-      },
-      "ResultPath": "$.crawler_result",
-      "Resource": "arn:aws:states:::aws-sdk:glue:startCrawler",
-      "Next": "NotifySuccess",
-      "Retry": [
-        {
-          "ErrorEquals": [
-            "States.TaskFailed"
-          ],
-          "IntervalSeconds": 30,
-          "MaxAttempts": 1,
-          "BackoffRate": 2
-        }
-      ],
-      "Catch": [
-        {
-          "ErrorEquals": [
-            "States.ALL"
-          ],
-          "Next": "NotifyFailure",
-          "Comment": "Crawler Failure"
-        }
-      ],
-      "TimeoutSeconds": 300
-    },
     "NotifySuccess": {
       "Type": "Task",
       "Resource": "arn:aws:states:::sns:publish",
@@ -377,6 +417,14 @@ module "sfn_execution_failure_alarm" {
  * Lambda、SFN間のEventBridgeの定義
  */
 locals {
+  # Glueの同時実行枠が空くまでの最悪待ち時間からSFNのリトライ回数とタイムアウトを決める
+  # (1枠はジョブのタイムアウト × (再試行回数 + 1) だけ占有され得る)
+  glue_run_worst_case_seconds = aws_glue_job.youtube_data_processing_job.timeout * 60 * (aws_glue_job.youtube_data_processing_job.max_retries + 1)
+  glue_queue_waves            = ceil(var.max_channels_per_run / var.glue_max_concurrent_runs) - 1
+  glue_queue_retry_interval   = 60
+  glue_queue_retry_attempts   = max(5, ceil(local.glue_queue_waves * local.glue_run_worst_case_seconds / local.glue_queue_retry_interval) + 1)
+  sfn_timeout_seconds         = 900 + local.glue_queue_waves * local.glue_run_worst_case_seconds
+
   # EventBridgeがSFNに渡すための入力トランスフォーマーを定義
   sfn_input_transformer = {
     input_paths = {
@@ -534,6 +582,24 @@ resource "aws_s3_bucket" "s3_glue_script_bucket" {
   force_destroy = true
 }
 
+# Sparkのチェックポイントは実行後に不要となるため1日で削除する
+resource "aws_s3_bucket_lifecycle_configuration" "s3_glue_script_lifecycle" {
+  bucket = aws_s3_bucket.s3_glue_script_bucket.id
+
+  rule {
+    id     = "glue_checkpoint_expiration"
+    status = "Enabled"
+
+    filter {
+      prefix = "checkpoints/"
+    }
+
+    expiration {
+      days = 1
+    }
+  }
+}
+
 resource "aws_s3_bucket_public_access_block" "s3_glue_script_block" {
   bucket                  = aws_s3_bucket.s3_glue_script_bucket.id
   block_public_acls       = true
@@ -690,6 +756,13 @@ resource "aws_glue_job" "youtube_data_processing_job" {
   connections      = [aws_glue_connection.bigquery_connection.name]
   execution_class  = "STANDARD"
 
+  # 1回のLambda実行で複数チャンネルのワークフローが同時に起動されるため、同時実行数を確保する
+  # (上限を超えた分はSFN側で Glue.ConcurrentRunsExceededException をリトライして待つ。
+  #  リトライ回数は max_channels_per_run から求めた最悪の待ち行列を覆うように locals で算出する)
+  execution_property {
+    max_concurrent_runs = var.glue_max_concurrent_runs
+  }
+
   command {
     script_location = "s3://${aws_s3_bucket.s3_glue_script_bucket.id}/jobs/youtube_processor.py"
     name            = "glueetl"
@@ -702,6 +775,7 @@ resource "aws_glue_job" "youtube_data_processing_job" {
     "--spark-event-logs-path"   = "s3://${aws_s3_bucket.s3_data_lake_bucket.id}/logs/spark-ui/"
     "--enable-spark-ui"         = "true"
     "--job-language"            = "python"
+    "--extra-py-files"          = "s3://${aws_s3_bucket.s3_glue_script_bucket.id}/jobs/glue_lib.zip"
     "--enable-continuous-cloudwatch-log" = "true"
     "--continuous-log-logGroup" = aws_cloudwatch_log_group.glue_etl_logs.name
     "--enable-continuous-log-filter"     = "true"
@@ -709,6 +783,57 @@ resource "aws_glue_job" "youtube_data_processing_job" {
     "--enable-auto-scaling"     = "true"
     "--gcp_project_id" = "project-youtube-472803"
     "--bq_dataset" = "youtube_project_processed_data"
+    "--materialize" = "persist"
+    "--storage_level" = "MEMORY_AND_DISK"
+    "--execution_profile" = "auto"
+    "--sink_parallelism" = "3"
+    "--dq_backend" = "spark"
+    "--processed_layout" = "partitioned"
+    # processed zoneのマージで既存データを保持するチェックポイント(オートスケーリングでも失われないS3に置く)
+    "--checkpoint_dir" = "s3://${aws_s3_bucket.s3_glue_script_bucket.id}/checkpoints/"
+    "--glue_database" = aws_glue_catalog_database.crawler_db.name
+  }
+}
+
+# 小ファイル統合(コンパクション)ジョブの定義(Python shell)
+# 旧レイアウト(--processed_layout=workflow)の processed_data のみが対象。partitioned レイアウトでは不要。
+resource "aws_glue_job" "youtube_compaction_job" {
+  name         = "youtube-processed-compaction-job"
+  description  = "Compacts small per-workflow processed Parquet files (legacy workflow layout only) into target-sized files per channel and table."
+  role_arn     = aws_iam_role.glue_job_execution_role.arn
+  max_retries  = 0
+  timeout      = 60
+  max_capacity = 0.0625
+
+  command {
+    script_location = "s3://${aws_s3_bucket.s3_glue_script_bucket.id}/jobs/compact_processed.py"
+    name            = "pythonshell"
+    python_version  = "3.9"
+  }
+
+  default_arguments = {
+    "--job-language"    = "python"
+    "library-set"       = "analytics"
+    # マニフェストの条件付き書き込み(IfNoneMatch)には botocore 1.35 以降が必要
+    "--additional-python-modules" = "pyarrow==21.0.0,boto3>=1.35.0"
+    "--bucket"          = aws_s3_bucket.s3_data_lake_bucket.id
+    "--target_mb"       = "128"
+    "--min_age_hours"   = "6"
+    "--retention_hours" = "24"
+    # 統合後のデータを compacted_processed_<table> テーブルとして登録する(読み手はこのテーブルへ移行する)
+    "--glue_database"   = aws_glue_catalog_database.crawler_db.name
+  }
+}
+
+# 取り込みの無い日曜日に実行する(旧レイアウトを使う場合のみ有効にする)
+resource "aws_glue_trigger" "youtube_compaction_schedule" {
+  name     = "youtube-processed-compaction-schedule"
+  type     = "SCHEDULED"
+  schedule = "cron(0 18 ? * SUN *)"
+  enabled  = var.legacy_compaction_schedule_enabled
+
+  actions {
+    job_name = aws_glue_job.youtube_compaction_job.name
   }
 }
 
@@ -726,6 +851,21 @@ resource "aws_glue_crawler" "youtube_processed_data_crawler" {
 
   s3_target {
     path = "s3://${var.data_bucket_name}"
+    # コンパクションの出力(統合後のデータ・マニフェスト)はコンパクションジョブがテーブルを登録するため対象外とする
+    exclusions = ["**/compacted/**", "**/_manifest/**", "**/_symlink_format_manifest/**"]
+  }
+
+  # テーブル・パーティションはGlueジョブが直接登録するため、クローラーは登録漏れを補う定期的な整合処理としてのみ実行する。
+  # 新しいフォルダのみを対象とし、ジョブが登録したテーブル定義は変更しない。
+  schedule = "cron(0 21 ? * SUN *)"
+
+  recrawl_policy {
+    recrawl_behavior = "CRAWL_NEW_FOLDERS_ONLY"
+  }
+
+  schema_change_policy {
+    update_behavior = "LOG"
+    delete_behavior = "LOG"
   }
 }
 
@@ -883,6 +1023,15 @@ module "lambda_clean_back" {
   source_path = "../src/clean_up"
   tags = var.project_tags
 
+  # 失敗したワークフローの生データ・加工データ・DQレポートをまとめて削除するため、既定(3秒)より長くする
+  timeout = 300
+
+  environment_variables = {
+    DELETE_MAX_WORKERS  = "8"
+    DELETE_MAX_ATTEMPTS = "3"
+    CLEANUP_DRY_RUN     = "false"
+  }
+
   create_role = true
 
   attach_cloudwatch_logs_policy = true
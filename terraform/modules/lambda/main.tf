@@ -47,7 +47,9 @@ resource "aws_iam_policy" "combined_execution_policy" {
         Action   = [
           "s3:PutObject",
           "s3:GetObject",
-          "s3:ListBucket"
+          "s3:ListBucket",
+          "s3:DeleteObject", # APIレスポンスキャッシュの退避
+          "s3:AbortMultipartUpload"
         ],
         Resource = [
           "arn:aws:s3:::${var.s3_data_lake_bucket_name}",
@@ -97,7 +99,7 @@ resource "aws_lambda_function" "scraper" {
   role          = aws_iam_role.execution_role.arn
 
   image_config {
-    command = ["app_lambda.lambda_handler"]
+    command = ["lambda_func.app_lambda.lambda_handler"]
   }
 
   environment {
@@ -105,6 +107,7 @@ resource "aws_lambda_function" "scraper" {
       BUCKET_NAME           = var.s3_data_lake_bucket_name
       REGION_NAME           = var.region_name
       YOUTUBE_API_KEY_ARN   = var.youtube_secret_arn
+      RESPONSE_CACHE        = "s3"
     }
   }
 
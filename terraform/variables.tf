@@ -63,4 +63,21 @@ variable "bigquery_sa_key_json" {
   description = "GCP Service Account Key JSON"
   type        = string
   sensitive   = true
-}
\ No newline at end of file
+}
+variable "legacy_compaction_schedule_enabled" {
+  description = "旧レイアウト(processed_layout=workflow)向けコンパクションの定期実行を有効にするか"
+  type        = bool
+  default     = false
+}
+
+variable "glue_max_concurrent_runs" {
+  description = "加工用Glueジョブの同時実行数の上限(1回のLambda実行で処理するチャンネル数以上にする)"
+  type        = number
+  default     = 4
+}
+
+variable "max_channels_per_run" {
+  description = "1回のLambda実行で処理するチャンネル数の上限(Glue待ち行列のリトライ回数の算出に使う)"
+  type        = number
+  default     = 8
+}
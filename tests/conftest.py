@@ -0,0 +1,15 @@
+import pytest
+
+from src.lambda_func import app_lambda, aws_cache
+
+
+# コンテナ単位でキャッシュされる状態をテストごとに初期化する
+@pytest.fixture(autouse=True)
+def reset_lambda_container_state():
+    app_lambda._youtube_services.clear()
+    app_lambda._secret_cache.clear()
+    aws_cache.clear_clients()
+    yield
+    app_lambda._youtube_services.clear()
+    app_lambda._secret_cache.clear()
+    aws_cache.clear_clients()
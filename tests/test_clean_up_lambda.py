@@ -0,0 +1,164 @@
+import threading
+
+import boto3
+import pytest
+from botocore.exceptions import EndpointConnectionError
+from moto import mock_aws
+from moto.core import DEFAULT_ACCOUNT_ID
+from moto.s3.models import s3_backends
+
+from src.clean_up import clean_up_lambda
+from src.clean_up.clean_up_lambda import delete_s3_prefix, lambda_handler
+
+BUCKET = "data-lake"
+WORKFLOW_PREFIX = "channel=UC1/workflow=wf1/"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-northeast-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="ap-northeast-1")
+        client.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"},
+        )
+        # motoのS3は一覧取得中のキー削除に対応していない(スレッドセーフでない)ため、呼び出しを直列化する
+        lock = threading.Lock()
+        for name in ("list_objects_v2", "delete_objects"):
+            monkeypatch.setattr(client, name, serialized(lock, getattr(client, name)))
+        monkeypatch.setattr(clean_up_lambda, "_s3_client", client)
+        yield client
+
+
+def serialized(lock, method):
+    def call(**kwargs):
+        with lock:
+            return method(**kwargs)
+
+    return call
+
+
+def put_keys(prefix, count):
+    # 数万件のオブジェクトをAPI経由で作成すると遅いため、motoのバックエンドへ直接作成する
+    backend = s3_backends[DEFAULT_ACCOUNT_ID]["aws"]
+    keys = [f"{prefix}{index:06d}.parquet" for index in range(count)]
+    for key in keys:
+        backend.put_object(BUCKET, key, b"")
+    return keys
+
+
+def count_keys(s3, prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    return sum(page.get("KeyCount", 0) for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix))
+
+
+# ワークフロー配下の数万件を削除し、他のワークフローのデータは残すこと
+def test_lambda_handler_deletes_large_workflow_prefix(s3):
+    put_keys(f"{WORKFLOW_PREFIX}raw_data/", 12_000)
+    put_keys(f"{WORKFLOW_PREFIX}processed_data/processed_video/", 8_000)
+    put_keys(f"{WORKFLOW_PREFIX}dq_reports/", 500)
+    put_keys("channel=UC1/workflow=wf2/raw_data/", 10)
+
+    event = {
+        "decoded_payload": {
+            "bucket_name": BUCKET,
+            "processed_base_path": f"{BUCKET}/{WORKFLOW_PREFIX}processed_data/",
+        }
+    }
+    result = lambda_handler(event, None)
+
+    report = result["cleanup_report"]
+    assert report["prefix"] == WORKFLOW_PREFIX
+    assert report["listed"] == 20_500
+    assert report["deleted"] == 20_500
+    assert report["failed"] == 0
+    assert report["batches"] == 21
+    assert report["elapsed_seconds"] >= 0
+    assert count_keys(s3, WORKFLOW_PREFIX) == 0
+    assert count_keys(s3, "channel=UC1/workflow=wf2/") == 10
+
+
+# DeleteObjectsの部分的な失敗は失敗したキーだけを再試行し、最終的に失敗したキーは報告すること
+def test_delete_s3_prefix_retries_partial_errors(s3, monkeypatch):
+    keys = put_keys(WORKFLOW_PREFIX, 2_500)
+    flaky = set(keys[::100])  # 1回目だけ失敗する
+    locked = {keys[1], keys[2]}  # 常に失敗する
+    attempts = {}
+    original_delete_objects = s3.delete_objects
+
+    def delete_objects(Bucket, Delete):
+        objects, errors = [], []
+        for obj in Delete["Objects"]:
+            key = obj["Key"]
+            attempts[key] = attempts.get(key, 0) + 1
+            if key in locked or (key in flaky and attempts[key] == 1):
+                errors.append({"Key": key, "Code": "InternalError", "Message": "We encountered an internal error."})
+            else:
+                objects.append(obj)
+        response = original_delete_objects(Bucket=Bucket, Delete={**Delete, "Objects": objects})
+        return {**response, "Errors": errors}
+
+    monkeypatch.setattr(s3, "delete_objects", delete_objects)
+    monkeypatch.setattr(clean_up_lambda.time, "sleep", lambda seconds: None)
+
+    report = delete_s3_prefix(BUCKET, WORKFLOW_PREFIX, s3=s3, max_workers=4, max_attempts=3)
+
+    assert report["deleted"] == 2_498
+    assert report["failed"] == 2
+    assert sorted(error["Key"] for error in report["errors"]) == sorted(locked)
+    assert all(attempts[key] == 2 for key in flaky - locked)
+    assert all(attempts[key] == 3 for key in locked)
+    assert count_keys(s3, WORKFLOW_PREFIX) == 2
+
+
+# dry-runでは削除対象の件数のみを返し、削除しないこと
+def test_delete_s3_prefix_dry_run(s3):
+    put_keys(WORKFLOW_PREFIX, 1_500)
+
+    report = delete_s3_prefix(BUCKET, WORKFLOW_PREFIX, s3=s3, dry_run=True)
+
+    assert report["dry_run"] is True
+    assert report["listed"] == 1_500
+    assert report["deleted"] == 0
+    assert count_keys(s3, WORKFLOW_PREFIX) == 1_500
+
+
+# ClientError以外の通信エラー(接続エラーなど)もバッチごとに報告し、他のバッチの削除は続けること
+def test_delete_s3_prefix_reports_botocore_errors(s3, monkeypatch):
+    keys = put_keys(WORKFLOW_PREFIX, 2_500)
+    unreachable = set(keys[:1000])  # 1つ目のバッチだけ接続できない
+    original_delete_objects = s3.delete_objects
+
+    def delete_objects(Bucket, Delete):
+        if Delete["Objects"][0]["Key"] in unreachable:
+            raise EndpointConnectionError(endpoint_url="https://s3.ap-northeast-1.amazonaws.com")
+        return original_delete_objects(Bucket=Bucket, Delete=Delete)
+
+    monkeypatch.setattr(s3, "delete_objects", delete_objects)
+    monkeypatch.setattr(clean_up_lambda.time, "sleep", lambda seconds: None)
+
+    report = delete_s3_prefix(BUCKET, WORKFLOW_PREFIX, s3=s3, max_workers=4, max_attempts=2)
+
+    assert report["deleted"] == 1_500
+    assert report["failed"] == 1_000
+    assert {error["Code"] for error in report["errors"]} == {"EndpointConnectionError"}
+    assert count_keys(s3, WORKFLOW_PREFIX) == 1_000
+
+
+# イベントの dry_run は文字列でも判定し、"false" では削除すること
+def test_lambda_handler_parses_dry_run_string(s3):
+    put_keys(WORKFLOW_PREFIX, 10)
+    payload = {
+        "bucket_name": BUCKET,
+        "processed_base_path": f"{BUCKET}/{WORKFLOW_PREFIX}processed_data/",
+    }
+
+    report = lambda_handler({"decoded_payload": payload, "dry_run": "TRUE"}, None)["cleanup_report"]
+    assert report["dry_run"] is True
+    assert count_keys(s3, WORKFLOW_PREFIX) == 10
+
+    report = lambda_handler({"decoded_payload": payload, "dry_run": "false"}, None)["cleanup_report"]
+    assert report["dry_run"] is False
+    assert report["deleted"] == 10
+    assert count_keys(s3, WORKFLOW_PREFIX) == 0
@@ -0,0 +1,166 @@
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from moto import mock_aws
+
+import src.glue.glue_compaction as compaction
+from src.glue.glue_compaction import (
+    ConcurrentCompactionError,
+    compact_table,
+    list_objects,
+    load_manifest,
+    manifest_files,
+    read_parquet,
+)
+
+BUCKET = "data-lake"
+CHANNEL_PREFIX = "channel=UC1/"
+DATABASE = "youtube_analysis_db"
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="ap-northeast-1")
+        client.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"},
+        )
+        yield client
+
+
+@pytest.fixture
+def glue(s3):
+    client = boto3.client("glue", region_name="ap-northeast-1")
+    client.create_database(DatabaseInput={"Name": DATABASE})
+    return client
+
+
+def put_workflow(s3, workflow_id, video_ids, sealed=True):
+    prefix = f"{CHANNEL_PREFIX}workflow={workflow_id}/processed_data/processed_video/"
+    for index, video_id in enumerate(video_ids):
+        buffer = io.BytesIO()
+        pq.write_table(pa.table({"video_id": [video_id], "view_count": [100]}), buffer)
+        s3.put_object(Bucket=BUCKET, Key=f"{prefix}part-{index:05d}.parquet", Body=buffer.getvalue())
+    if sealed:
+        s3.put_object(Bucket=BUCKET, Key=f"{prefix}_SUCCESS", Body=b"")
+    return prefix
+
+
+# 書き込みが完了したワークフローのみを統合し、統合元は保持期間を過ぎてから削除すること
+def test_compact_table_merges_sealed_workflows(s3, glue):
+    first = put_workflow(s3, "wf1", ["v1", "v2", "v3"])
+    second = put_workflow(s3, "wf2", ["v4", "v5"])
+    put_workflow(s3, "wf3", ["v6"], sealed=False)  # 取り込み中
+
+    now = datetime.now(timezone.utc) + timedelta(hours=7)
+    result = compact_table(s3, BUCKET, CHANNEL_PREFIX, "video", now=now, glue=glue, database=DATABASE)
+
+    assert result["compacted_sources"] == 2
+    assert result["input_files"] == 5 and result["output_files"] == 1
+    files = manifest_files(s3, BUCKET, CHANNEL_PREFIX, "video")
+    rows = read_parquet(s3, BUCKET, files[0]).to_pylist()
+    assert sorted((row["workflow"], row["video_id"]) for row in rows) == [
+        ("wf1", "v1"),
+        ("wf1", "v2"),
+        ("wf1", "v3"),
+        ("wf2", "v4"),
+        ("wf2", "v5"),
+    ]
+    symlink = s3.get_object(
+        Bucket=BUCKET,
+        Key=f"{CHANNEL_PREFIX}compacted/processed_video/_symlink_format_manifest/manifest",
+    )["Body"].read().decode()
+    assert symlink == f"s3://{BUCKET}/{files[0]}\n"
+
+    # 統合後のデータはシンボリックリンク形式のテーブル(チャンネルごとのパーティション)から読む
+    table = glue.get_table(DatabaseName=DATABASE, Name="compacted_processed_video")["Table"]
+    assert table["StorageDescriptor"]["InputFormat"] == "org.apache.hadoop.hive.ql.io.SymlinkTextInputFormat"
+    assert [c["Name"] for c in table["StorageDescriptor"]["Columns"]] == ["video_id", "view_count", "workflow"]
+    partition = glue.get_partition(DatabaseName=DATABASE, TableName="compacted_processed_video", PartitionValues=["UC1"])
+    assert partition["Partition"]["StorageDescriptor"]["Location"] == (
+        f"s3://{BUCKET}/{CHANNEL_PREFIX}compacted/processed_video/_symlink_format_manifest/"
+    )
+
+    # カタログに登録しない実行では、保持期間を過ぎても統合元を削除しない
+    result = compact_table(s3, BUCKET, CHANNEL_PREFIX, "video", now=now + timedelta(hours=25))
+    assert result["compacted_sources"] == 0
+    assert list_objects(s3, BUCKET, first)
+
+    # 統合元は実行中のクエリのために保持期間中は残す
+    assert list_objects(s3, BUCKET, first)
+
+    # 取り込みが完了したwf3を、保持期間の経過後に統合する(既存の小さな統合済みファイルとまとめ直す)
+    put_workflow(s3, "wf3-done", ["v7"])
+    later = now + timedelta(hours=25)
+    result = compact_table(s3, BUCKET, CHANNEL_PREFIX, "video", now=later, glue=glue, database=DATABASE)
+
+    assert result["version"] == 2
+    assert result["compacted_sources"] == 1
+    assert result["deleted_objects"] == 7  # wf1・wf2 のParquetと_SUCCESS
+    assert list_objects(s3, BUCKET, first) == []
+    assert list_objects(s3, BUCKET, second) == []
+
+    files = manifest_files(s3, BUCKET, CHANNEL_PREFIX, "video")
+    assert len(files) == 1
+    assert read_parquet(s3, BUCKET, files[0]).num_rows == 6
+    manifest = load_manifest(s3, BUCKET, f"{CHANNEL_PREFIX}compacted/processed_video/")
+    assert sorted(manifest["sources"]) == [
+        f"{CHANNEL_PREFIX}workflow=wf1/processed_data/processed_video/",
+        f"{CHANNEL_PREFIX}workflow=wf2/processed_data/processed_video/",
+        f"{CHANNEL_PREFIX}workflow=wf3-done/processed_data/processed_video/",
+    ]
+
+
+# 同じ版のマニフェストが先に作成された場合は、今回の出力を削除してエラーとすること
+def test_compact_table_detects_concurrent_compaction(s3, monkeypatch):
+    put_workflow(s3, "wf1", ["v1"])
+    now = datetime.now(timezone.utc) + timedelta(hours=7)
+
+    # 他の実行が v1 を作成した後に、v0 を読んだ状態のコンパクションが公開しようとした場合を再現する
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=f"{CHANNEL_PREFIX}compacted/processed_video/_manifest/v00000001.json",
+        Body=json.dumps({"version": 1, "files": [], "sources": [], "retired": []}),
+    )
+    monkeypatch.setattr(
+        compaction,
+        "load_manifest",
+        lambda *args: {"version": 0, "files": [], "sources": [], "retired": []},
+    )
+
+    with pytest.raises(ConcurrentCompactionError):
+        compact_table(s3, BUCKET, CHANNEL_PREFIX, "video", now=now)
+
+    assert list_objects(s3, BUCKET, f"{CHANNEL_PREFIX}compacted/processed_video/data/") == []
+
+
+# 列構成の異なるファイルも、列を揃えて1ファイルにまとめること
+def test_compact_table_unifies_schemas(s3):
+    prefix = f"{CHANNEL_PREFIX}workflow=wf1/processed_data/processed_video/"
+    tables = [
+        pa.table({"video_id": ["v1"], "view_count": [100]}),
+        pa.table({"video_id": ["v2"], "view_count": [200], "like_count": [5]}),
+    ]
+    for index, table in enumerate(tables):
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer)
+        s3.put_object(Bucket=BUCKET, Key=f"{prefix}part-{index:05d}.parquet", Body=buffer.getvalue())
+    s3.put_object(Bucket=BUCKET, Key=f"{prefix}_SUCCESS", Body=b"")
+
+    now = datetime.now(timezone.utc) + timedelta(hours=7)
+    result = compact_table(s3, BUCKET, CHANNEL_PREFIX, "video", now=now)
+
+    assert result["output_files"] == 1
+    files = manifest_files(s3, BUCKET, CHANNEL_PREFIX, "video")
+    merged = read_parquet(s3, BUCKET, files[0])
+    assert merged.column_names == ["video_id", "view_count", "workflow", "like_count"]
+    assert sorted(merged.to_pylist(), key=lambda row: row["video_id"]) == [
+        {"video_id": "v1", "view_count": 100, "workflow": "wf1", "like_count": None},
+        {"video_id": "v2", "view_count": 200, "like_count": 5, "workflow": "wf1"},
+    ]
@@ -0,0 +1,608 @@
+import json
+import os
+import threading
+import time
+from functools import partial
+
+import pytest
+from datetime import datetime
+
+import boto3
+from moto import mock_aws
+
+pyspark = pytest.importorskip("pyspark")
+
+from src.glue import app_glue
+from src.glue.app_glue import log_stage
+from src.glue.glue_catalog import register_table_partitions
+from src.glue.glue_dq import RULESETS, evaluate_rules, ruleset_to_dqdl, run_spark_dq
+from src.glue.glue_metrics import emit_sink_metrics
+from src.glue.glue_processed import (
+    build_snapshot,
+    merge_partitions,
+    write_partitions,
+    write_snapshot,
+)
+from src.glue.glue_profile import (
+    apply_profile,
+    choose_profile,
+    coalesce_for_output,
+    input_size_bytes,
+    list_input_files,
+)
+from src.glue.glue_sinks import SinkError, run_sink_stages, run_sinks
+from src.glue.glue_transforms import (
+    materialize,
+    read_raw,
+    release,
+    transform_channel,
+    transform_comment,
+    transform_video,
+    video_schema,
+)
+from src.lambda_func.s3_writer import open_raw_writer
+
+
+# ローカルのPySparkを起動する(Javaが無い環境ではスキップ)
+@pytest.fixture(scope="module")
+def spark():
+    from pyspark.sql import SparkSession
+
+    try:
+        session = (
+            SparkSession.builder.master("local[1]")
+            .appName("test_glue_script")
+            .config("spark.ui.enabled", "false")
+            .config("spark.sql.shuffle.partitions", "1")
+            .config("spark.sql.session.timeZone", "UTC")
+            .getOrCreate()
+        )
+    except Exception as e:
+        pytest.skip(f"Sparkを起動できません: {e}")
+    yield session
+    session.stop()
+
+
+def make_video(video_id, published_at, duration="PT1M"):
+    return {
+        "video_id": video_id,
+        "title": f"title {video_id}",
+        "published_at": published_at,
+        "view_count": 100,
+        "like_count": 10,
+        "comment_count": 1,
+        "duration": duration,
+        "tags": "",
+    }
+
+
+# durationの秒数変換(日・週を含む表記と、解釈できない値はNULL)
+@pytest.mark.parametrize(
+    "duration, expected",
+    [
+        ("PT3M12S", 192),
+        ("PT1H", 3600),
+        ("PT45S", 45),
+        ("P1DT2H", 93600),
+        ("P1DT2H3M4S", 93784),
+        ("P1W", 604800),
+        ("P0D", 0),
+        ("3:12", None),
+        ("", None),
+    ],
+)
+def test_transform_video_duration_to_seconds(spark, duration, expected):
+    df = spark.createDataFrame(
+        [make_video("v1", "2024-01-01T00:00:00Z", duration)], schema=video_schema
+    )
+
+    row = transform_video(df).collect()[0]
+
+    assert row["total_seconds"] == expected
+
+
+# 欠損値の除外と、キーごとに最新の1行だけを残す重複排除
+def test_transform_video_drops_nulls_and_keeps_latest(spark):
+    rows = [
+        make_video("v1", "2024-01-01T00:00:00Z", "PT1M"),
+        make_video("v1", "2024-03-01T00:00:00Z", "PT2M"),
+        make_video("v2", "2024-02-01T00:00:00Z", "PT3M"),
+        make_video("v3", "not-a-timestamp"),
+    ]
+    df = spark.createDataFrame(rows, schema=video_schema)
+
+    result = {row["video_id"]: row for row in transform_video(df).collect()}
+
+    assert sorted(result) == ["v1", "v2"]
+    assert result["v1"]["published_at"] == datetime(2024, 3, 1)
+    assert result["v1"]["total_seconds"] == 120
+    assert dict(transform_video(df).dtypes)["published_at"] == "timestamp"
+
+
+def test_transform_channel_and_comment_dedup(spark):
+    channel_rows = [
+        ("UC1", "old", "2024-01-01T00:00:00Z", 1, 1, 1),
+        ("UC1", "new", "2024-02-01T00:00:00Z", 2, 2, 2),
+    ]
+    df_channel = spark.createDataFrame(
+        channel_rows,
+        "channel_id string, channel_name string, published_at string, subscriber_count long, total_views long, video_count long",
+    )
+    assert [row["channel_name"] for row in transform_channel(df_channel).collect()] == ["new"]
+
+    comment_rows = [
+        ("v1", "c1", "a", "2024-01-01T00:00:00Z", "old", 0),
+        ("v1", "c1", "a", "2024-01-02T00:00:00Z", "new", 0),
+        ("v1", "c2", "b", None, "missing", 0),
+    ]
+    df_comment = spark.createDataFrame(
+        comment_rows,
+        "video_id string, comment_id string, author_display_name string, published_at string, text_display string, like_count long",
+    )
+    assert [row["text_display"] for row in transform_comment(df_comment).collect()] == ["new"]
+
+
+# Lambdaが出力したNDJSONとParquetは同じスキーマ・同じ内容で読み込めること
+@mock_aws
+def test_read_raw_json_and_parquet_are_equivalent(spark, tmp_path):
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="raw-bucket")
+    records = [
+        make_video(f"v{i}", "2024-01-01T00:00:00Z", f"PT{i}M") for i in range(20)
+    ]
+
+    frames = {}
+    for raw_format, file_name in (("json", "data_video.json"), ("parquet", "data_video.parquet")):
+        with open_raw_writer(s3, "raw-bucket", file_name, "video", raw_format) as writer:
+            writer.write_all(records)
+        path = tmp_path / file_name
+        path.write_bytes(s3.get_object(Bucket="raw-bucket", Key=file_name)["Body"].read())
+        frames[raw_format] = read_raw(spark, video_schema, str(path), raw_format)
+
+    assert frames["json"].dtypes == frames["parquet"].dtypes
+    assert sorted(frames["json"].collect()) == sorted(frames["parquet"].collect())
+
+
+# 永続化した場合は複数のアクションを実行しても加工処理が1回だけ評価されること
+@pytest.mark.parametrize(
+    "mode, expected_evaluations",
+    [("none", 300), ("persist", 100), ("local_checkpoint", 100), ("checkpoint", 100)],
+)
+def test_materialize_evaluates_lineage_once(spark, tmp_path, mode, expected_evaluations):
+    from pyspark.sql import functions as F
+
+    evaluations = spark.sparkContext.accumulator(0)
+
+    @F.udf("long")
+    def counted(value):
+        evaluations.add(1)
+        return value
+
+    df = spark.range(100).withColumn("value", counted("id"))
+    df = materialize(df, mode=mode, checkpoint_dir=str(tmp_path / "checkpoints"))
+
+    # DQ・S3出力・BigQuery出力に相当する3回のアクション
+    df.agg(F.sum("value")).collect()
+    df.write.format("noop").mode("overwrite").save()
+    df.select("value").collect()
+
+    assert evaluations.value == expected_evaluations
+
+    release(df)
+    assert not df.is_cached
+
+
+# 処理段階ごとの開始・完了と所要時間がJSONでログ出力されること
+def test_log_stage_logs_elapsed_seconds(capsys):
+    with log_stage("S3への加工データの格納", extra={"table": "video"}):
+        pass
+
+    logs = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert [log["stage"] for log in logs] == ["S3への加工データの格納"] * 2
+    assert "elapsed_seconds" not in logs[0]
+    assert logs[1]["elapsed_seconds"] >= 0
+    assert logs[1]["table"] == "video"
+
+
+# metricを指定した段階はEMFのメトリクスも出力し、失敗した段階・出力はErrorsとして記録されること
+def test_log_stage_emits_emf_metrics(capsys, monkeypatch):
+    monkeypatch.setattr(
+        app_glue,
+        "LOG_CONTEXT",
+        {"service": "youtube-job", "correlation_id": "corr-1", "artist_name_slug": "artist"},
+    )
+
+    with log_stage("加工済みデータの永続化", metric="transform") as metrics:
+        metrics["Rows"] = 42
+    with pytest.raises(ValueError):
+        with log_stage("データクオリティーの実施", metric="dq"):
+            raise ValueError("boom")
+    emit_sink_metrics(
+        [
+            {"name": "s3_processed_video", "status": "succeeded", "elapsed_seconds": 1.5},
+            {"name": "bigquery_video", "status": "failed", "elapsed_seconds": 0.25},
+            {"name": "bigquery_comment", "status": "skipped"},
+        ],
+        app_glue.LOG_CONTEXT,
+    )
+
+    records = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')
+    ]
+    by_stage = {record["stage"]: record for record in records}
+
+    assert list(by_stage) == ["transform", "dq", "sink_s3_processed_video", "sink_bigquery_video"]
+    for record in records:
+        directive = record["_aws"]["CloudWatchMetrics"][0]
+        assert directive["Namespace"] == "YouTubePipeline"
+        assert directive["Dimensions"] == [["service", "stage", "artist_name_slug"]]
+        assert all(metric["Name"] in record for metric in directive["Metrics"])
+        assert record["correlation_id"] == "corr-1"
+
+    assert by_stage["transform"]["Rows"] == 42
+    assert by_stage["transform"]["Errors"] == 0
+    assert by_stage["dq"]["Errors"] == 1
+    assert by_stage["sink_s3_processed_video"]["Latency"] == 1500
+    assert by_stage["sink_bigquery_video"]["Errors"] == 1
+
+
+# 入力データ量はS3の接頭辞配下・ローカルのファイル/ディレクトリのいずれからも計測できること
+@mock_aws
+def test_input_size_bytes_for_s3_and_local(tmp_path):
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="raw-bucket")
+    s3.put_object(Bucket="raw-bucket", Key="raw_data/data_video.json", Body=b"x" * 1000)
+    s3.put_object(Bucket="raw-bucket", Key="raw_data/data_comment/part-0001.json", Body=b"x" * 300)
+    s3.put_object(Bucket="raw-bucket", Key="raw_data/data_comment/part-0002.json", Body=b"x" * 200)
+
+    assert input_size_bytes("s3://raw-bucket/raw_data/data_video.json", s3=s3) == 1000
+    assert input_size_bytes("s3://raw-bucket/raw_data/data_comment/", s3=s3) == 500
+    assert list_input_files("s3://raw-bucket/raw_data/data_comment/", s3=s3) == [
+        ("raw_data/data_comment/part-0001.json", 300),
+        ("raw_data/data_comment/part-0002.json", 200),
+    ]
+
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "part-0001.parquet").write_bytes(b"x" * 10)
+    (tmp_path / "data" / "part-0002.parquet").write_bytes(b"x" * 20)
+    assert input_size_bytes(str(tmp_path / "data")) == 30
+    assert input_size_bytes(str(tmp_path / "missing.json")) == 0
+
+
+# 入力データ量に応じて規模・シャッフルのパーティション数・出力ファイル数が決まること
+def test_choose_profile_scales_with_input_size():
+    paths = {"channel": "data_channel.json", "video": "data_video.json", "comment": "data_comment.json"}
+
+    small = choose_profile({"channel": 300, "video": 300 * 250, "comment": 100 * 250}, paths)
+    assert small["name"] == "small"
+    assert small["shuffle_partitions"] == 1
+    assert small["output_files"] == {"channel": 1, "video": 1, "comment": 1}
+
+    large = choose_profile(
+        {"channel": 300, "video": 2 * 1024**3, "comment": 1024**3}, paths
+    )
+    assert large["name"] == "large"
+    assert large["shuffle_partitions"] > 10
+    assert large["output_files"]["channel"] == 1
+    assert large["output_files"]["video"] > large["output_files"]["comment"] > 1
+
+    # 圧縮済み・列形式の入力は同じサイズでも推定行数が多くなる
+    gzip_paths = {table: f"{path}.gz" for table, path in paths.items()}
+    assert choose_profile({"video": 10**8}, gzip_paths)["estimated_rows"]["video"] == 4_000_000
+    assert choose_profile({"video": 10**8}, paths, "parquet")["estimated_rows"]["video"] == 4_000_000
+
+    # 接頭辞で渡す入力(コメントのパートファイル)は、一覧のキーから圧縮の有無を判定する
+    comment_parts = ["raw_data/data_comment/part-00000.json.gz", "raw_data/data_comment/part-00001.json.gz"]
+    assert choose_profile({"comment": 10**8}, {"comment": comment_parts})["estimated_rows"]["comment"] == 4_000_000
+    assert choose_profile({"comment": 10**8}, {"comment": ["raw_data/data_comment/part-00000.json"]})["estimated_rows"]["comment"] == 400_000
+
+
+# 小規模なプロファイルではシャッフル後のパーティション数と出力ファイル数が1つになること
+def test_small_profile_writes_single_file(spark, tmp_path):
+    rows = [make_video(f"v{i % 50}", "2024-01-01T00:00:00Z") for i in range(300)]
+    df = spark.createDataFrame(rows, schema=video_schema).repartition(8)
+
+    profile = choose_profile({"video": 300 * 250}, {"video": "data_video.json"})
+    apply_profile(spark, profile)
+    try:
+        assert spark.conf.get("spark.sql.shuffle.partitions") == "1"
+
+        output_path = str(tmp_path / "processed_video")
+        coalesce_for_output(transform_video(df), profile, "video").write.parquet(output_path)
+
+        parquet_files = [path for path in os.listdir(output_path) if path.endswith(".parquet")]
+        assert len(parquet_files) == 1
+        assert spark.read.parquet(output_path).count() == 50
+    finally:
+        spark.conf.set("spark.sql.shuffle.partitions", "1")
+        spark.conf.unset("spark.sql.autoBroadcastJoinThreshold")
+
+
+def test_run_sinks_runs_in_parallel():
+    def sleeping_sink():
+        time.sleep(0.3)
+
+    started = time.perf_counter()
+    results = run_sinks(None, [(f"sink{i}", sleeping_sink) for i in range(3)], max_parallelism=3)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.8
+    assert [result["name"] for result in results] == ["sink0", "sink1", "sink2"]
+    assert all(result["status"] == "succeeded" for result in results)
+    assert all(result["elapsed_seconds"] >= 0.3 for result in results)
+
+
+def test_run_sinks_aggregates_failures():
+    calls = []
+
+    def ok(name):
+        return lambda: calls.append(name)
+
+    def broken():
+        raise RuntimeError("書き込み失敗")
+
+    sinks = [("first", ok("first")), ("broken", broken), ("last", ok("last"))]
+
+    # fail_fast=False の場合は失敗後も残りの出力を実行し、失敗をまとめて報告する
+    with pytest.raises(SinkError) as excinfo:
+        run_sinks(None, sinks, max_parallelism=1, fail_fast=False)
+    assert calls == ["first", "last"]
+    assert [failure["name"] for failure in excinfo.value.failures] == ["broken"]
+    assert "RuntimeError: 書き込み失敗" in str(excinfo.value)
+
+    # fail_fast=True の場合は失敗後に未着手の出力をskippedにする
+    calls.clear()
+    with pytest.raises(SinkError) as excinfo:
+        run_sinks(None, sinks, max_parallelism=1)
+    assert calls == ["first"]
+    assert [result["status"] for result in excinfo.value.results] == [
+        "succeeded",
+        "failed",
+        "skipped",
+    ]
+
+
+def test_run_sinks_uses_scheduler_pool_per_sink(spark, tmp_path):
+    df = spark.createDataFrame([(1, "a"), (2, "b")], "id int, name string")
+    pools = {}
+    lock = threading.Lock()
+
+    def write(name):
+        def sink():
+            with lock:
+                pools[name] = spark.sparkContext.getLocalProperty("spark.scheduler.pool")
+            df.write.mode("overwrite").parquet(str(tmp_path / name))
+
+        return sink
+
+    results = run_sinks(spark, [(name, write(name)) for name in ("channel", "video")])
+
+    assert pools == {"channel": "sink_channel", "video": "sink_video"}
+    assert all(result["status"] == "succeeded" for result in results)
+    assert spark.read.parquet(str(tmp_path / "video")).count() == 2
+
+
+# すべてのルールが1回の集計(入力データの1回の走査)で評価されること
+def test_evaluate_rules_in_single_pass(spark):
+    from pyspark.sql import functions as F
+
+    evaluations = spark.sparkContext.accumulator(0)
+
+    @F.udf("string")
+    def counted(value):
+        evaluations.add(1)
+        return value
+
+    df = spark.createDataFrame(
+        [("v1", 10), ("v2", None), ("v2", 30), (None, 40)],
+        "video_id string, total_seconds long",
+    ).withColumn("video_id", counted("video_id"))
+    rules = [
+        ("IsComplete", "video_id"),
+        ("IsUnique", "video_id"),
+        ("Completeness", "total_seconds", 0.70),
+    ]
+
+    outcomes = evaluate_rules(df, rules)
+
+    assert evaluations.value == 4
+    assert [outcome["Rule"] for outcome in outcomes] == [
+        'IsComplete "video_id"',
+        'IsUnique "video_id"',
+        'Completeness "total_seconds" >= 0.70',
+    ]
+    assert [outcome["Outcome"] for outcome in outcomes] == ["Failed", "Failed", "Passed"]
+    assert outcomes[0]["EvaluatedMetrics"] == {"Column.video_id.Completeness": 0.75}
+    assert outcomes[1]["EvaluatedMetrics"] == {"Column.video_id.Uniqueness": 2 / 3}
+    assert outcomes[2]["FailureReason"] is None
+
+
+def test_run_spark_dq_writes_report_to_s3(spark):
+    df = spark.createDataFrame(
+        [("c1", datetime(2024, 1, 1)), ("c2", None)],
+        "channel_id string, published_at timestamp",
+    )
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="ap-northeast-1")
+        s3.create_bucket(
+            Bucket="report",
+            CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"},
+        )
+        outcomes = run_spark_dq(df, "channel", "s3://report/dq/channel/", s3=s3)
+
+        keys = [obj["Key"] for obj in s3.list_objects_v2(Bucket="report")["Contents"]]
+        assert len(keys) == 1 and keys[0].startswith("dq/channel/dqresult-")
+        report = json.loads(s3.get_object(Bucket="report", Key=keys[0])["Body"].read())
+
+    # published_at の完全性が0.5のため、3つ目のルールのみ失敗する
+    assert [outcome["Outcome"] for outcome in outcomes] == ["Passed", "Passed", "Failed"]
+    assert report["EvaluationContext"] == "channel"
+    assert report["Score"] == 2 / 3
+    assert [result["Result"] for result in report["RuleResults"]] == ["PASS", "PASS", "FAIL"]
+    assert report["RuleResults"][2]["Description"] == 'Completeness "published_at" >= 0.90'
+
+
+def test_ruleset_to_dqdl_matches_glue_ruleset():
+    assert ruleset_to_dqdl(RULESETS["video"]) == (
+        "Rules = [\n"
+        '    IsComplete "video_id",\n'
+        '    IsUnique "video_id",\n'
+        '    Completeness "total_seconds" >= 0.90,\n'
+        '    Completeness "published_at" >= 0.90\n'
+        "]"
+    )
+
+
+# 2回目の実行では今回のデータを含むパーティションだけが置き換わり、差分には新規・変更行のみが含まれること
+def test_merge_partitions_rewrites_only_touched_partitions(spark, tmp_path):
+    path = str(tmp_path / "processed" / "video")
+    warehouse_path = str(tmp_path / "warehouse" / "video")
+
+    def run(rows):
+        df = transform_video(spark.createDataFrame(rows, schema=video_schema))
+        merged, delta, existing, _ = merge_partitions(spark, df, path, "video_id", "UC1")
+        write_partitions(merged, path)
+        # BigQueryの代わりに差分をローカルのParquetへ追記する
+        delta.write.mode("append").parquet(warehouse_path)
+        delta_ids = sorted(row["video_id"] for row in spark.read.parquet(warehouse_path).collect())
+        release(*existing)
+        return delta_ids
+
+    first = [
+        make_video("v1", "2024-01-01T10:00:00Z"),
+        make_video("v2", "2024-01-01T12:00:00Z"),
+        make_video("v3", "2024-01-02T10:00:00Z"),
+    ]
+    assert run(first) == ["v1", "v2", "v3"]
+    untouched_dir = tmp_path / "processed" / "video" / "channel_id=UC1" / "published_date=2024-01-02"
+    untouched_files = sorted(os.listdir(untouched_dir))
+
+    # v1 の再生数が変化し、v4 が新しい日付で追加された(v2 は変化なし、v3 の日付は今回含まれない)
+    changed_v1 = dict(make_video("v1", "2024-01-01T10:00:00Z"), view_count=500)
+    second = [changed_v1, make_video("v2", "2024-01-01T12:00:00Z"), make_video("v4", "2024-01-03T10:00:00Z")]
+    assert run(second) == ["v1", "v1", "v2", "v3", "v4"]
+
+    result = {row["video_id"]: row for row in spark.read.parquet(path).collect()}
+    assert sorted(result) == ["v1", "v2", "v3", "v4"]
+    assert result["v1"]["view_count"] == 500
+    assert str(result["v4"]["published_date"]) == "2024-01-03"
+    assert sorted(os.listdir(untouched_dir)) == untouched_files
+
+
+# BigQueryへの差分出力が失敗した場合はパーティションを書き換えず、再実行時に同じ差分を出力できること
+def test_partition_rewrite_waits_for_bigquery(spark, tmp_path):
+    path = str(tmp_path / "processed" / "video")
+    warehouse_path = str(tmp_path / "warehouse" / "video")
+
+    def run(rows, bigquery_fails=False):
+        df = transform_video(spark.createDataFrame(rows, schema=video_schema))
+        merged, delta, existing, _ = merge_partitions(spark, df, path, "video_id", "UC1")
+
+        def write_bigquery():
+            if bigquery_fails:
+                raise RuntimeError("BigQuery unavailable")
+            delta.write.mode("append").parquet(warehouse_path)
+
+        try:
+            return run_sink_stages(
+                spark,
+                [[("bigquery_video", write_bigquery)], [("s3_processed_video", partial(write_partitions, merged, path))]],
+            )
+        finally:
+            release(*existing)
+
+    run([make_video("v1", "2024-01-01T10:00:00Z")])
+    changed = [dict(make_video("v1", "2024-01-01T10:00:00Z"), view_count=99)]
+
+    with pytest.raises(SinkError) as excinfo:
+        run(changed, bigquery_fails=True)
+    assert [(r["name"], r["status"]) for r in excinfo.value.results] == [
+        ("bigquery_video", "failed"),
+        ("s3_processed_video", "skipped"),
+    ]
+    assert spark.read.parquet(path).collect()[0]["view_count"] != 99
+
+    # 再実行では変更行が差分として出力され、その後パーティションが書き換わる
+    run(changed)
+    assert sorted(row["view_count"] for row in spark.read.parquet(warehouse_path).collect()) == [99, 100]
+    assert spark.read.parquet(path).collect()[0]["view_count"] == 99
+
+
+# スナップショットは日付ごとに追記され、同じ日の再実行ではその日の分だけが置き換わること
+def test_video_stats_snapshot_appends_per_date(spark, tmp_path):
+    path = str(tmp_path / "video_stats_snapshot")
+    videos = transform_video(
+        spark.createDataFrame(
+            [make_video("v2", "2024-01-01T00:00:00Z"), make_video("v1", "2024-01-02T00:00:00Z")],
+            schema=video_schema,
+        )
+    )
+
+    for snapshot_date in ("2024-02-01", "2024-02-08", "2024-02-08"):
+        write_snapshot(build_snapshot(videos, "video", "UC1", snapshot_date), path, "video")
+
+    assert sorted(name for name in os.listdir(path) if name.startswith("snapshot_date=")) == [
+        "snapshot_date=2024-02-01",
+        "snapshot_date=2024-02-08",
+    ]
+    partition_dir = os.path.join(path, "snapshot_date=2024-02-08", "channel_id=UC1")
+    files = [name for name in os.listdir(partition_dir) if name.endswith(".parquet")]
+    assert len(files) == 1
+    # ファイル内はキー順に並んでいる
+    assert [row["video_id"] for row in spark.read.parquet(os.path.join(partition_dir, files[0])).collect()] == ["v1", "v2"]
+
+    rows = spark.read.parquet(path).collect()
+    assert len(rows) == 4
+    assert sorted(rows[0].asDict()) == [
+        "channel_id",
+        "comment_count",
+        "like_count",
+        "snapshot_date",
+        "video_id",
+        "view_count",
+    ]
+
+
+# 書き込んだテーブルとパーティションがデータカタログへ直接登録され、再実行しても重複しないこと
+def test_register_table_partitions_with_moto():
+    from datetime import date
+
+    from pyspark.sql.types import DateType, StringType, StructField, StructType
+
+    schema = StructType(
+        video_schema.fields
+        + [
+            StructField("channel_id", StringType(), True),
+            StructField("published_date", DateType(), True),
+        ]
+    )
+    location = "s3://data-lake/processed/video"
+    partitions = [("UC1", date(2024, 1, d)) for d in range(1, 31)] * 5 + [("UC2", date(2024, 1, 1)), ("UC1", None)]
+
+    with mock_aws():
+        glue = boto3.client("glue", region_name="ap-northeast-1")
+        glue.create_database(DatabaseInput={"Name": "youtube_analysis_db"})
+
+        result = register_table_partitions(
+            glue, "youtube_analysis_db", "processed_video", location, schema,
+            ["channel_id", "published_date"], partitions,
+        )
+        assert result == {"table": "processed_video", "requested": 31, "created": 31, "table_status": "created"}
+
+        # 再実行(SFNのリトライなど)では登録済みのパーティションを無視する
+        result = register_table_partitions(
+            glue, "youtube_analysis_db", "processed_video", location, schema,
+            ["channel_id", "published_date"], [("UC1", date(2024, 1, 1)), ("UC1", date(2024, 2, 1))],
+        )
+        assert result["created"] == 1 and result["table_status"] == "unchanged"
+
+        table = glue.get_table(DatabaseName="youtube_analysis_db", Name="processed_video")["Table"]
+        assert [key["Name"] for key in table["PartitionKeys"]] == ["channel_id", "published_date"]
+        assert {"Name": "view_count", "Type": "bigint"} in table["StorageDescriptor"]["Columns"]
+
+        registered = glue.get_partitions(DatabaseName="youtube_analysis_db", TableName="processed_video")["Partitions"]
+        assert len(registered) == 32
+        partition = next(p for p in registered if p["Values"] == ["UC2", "2024-01-01"])
+        assert partition["StorageDescriptor"]["Location"] == f"{location}/channel_id=UC2/published_date=2024-01-01/"
@@ -1,8 +1,20 @@
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import ANY, patch, MagicMock
 import json
 import os
-from src.lambda_func.app_lambda import get_youtube_api_key, get_channel, get_video, lambda_handler
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import boto3
+from moto import mock_aws
+from src.lambda_func.app_lambda import get_youtube_api_key, get_youtube_service, get_channel, get_video, get_video_batch, get_comments_for_video, get_comments_for_videos, iter_comments_for_video, iter_comments_for_videos, lambda_handler, CommentBudget, estimate_comment_units, plan_comment_fetch
+from src.clean_up import clean_up_lambda
+from src.lambda_func.aws_cache import SecretCache
+from src.lambda_func.response_cache import CACHED_ENDPOINTS, LocalCacheStore, ResponseCache, S3CacheStore
+from src.lambda_func.s3_writer import RollingRawWriter, open_ndjson_writer, open_raw_writer, raw_object_key, raw_part_prefix
+from src.lambda_func.youtube_client import BatchExecutor, MeteredYouTube, QuotaBudget, QuotaBudgetExceeded, is_api_key_error
+from src.lambda_func.watermark import build_watermark, incremental_cutoff, load_watermark, save_watermark
 
 # SecretsManagerのモック化テスト
 @patch('src.lambda_func.app_lambda.boto3.client') 
@@ -53,15 +65,13 @@ def test_get_channel_success():
     assert channel_info["video_count"] == 1000
 
 # lambda_handlerモジュールのテスト
-@patch('src.lambda_func.app_lambda.get_comments_for_video')
-@patch('src.lambda_func.app_lambda.get_video')
+@patch('src.lambda_func.app_lambda.iter_comments_for_video')
+@patch('src.lambda_func.app_lambda.iter_videos')
 @patch('src.lambda_func.app_lambda.get_channel')
 @patch('src.lambda_func.app_lambda.get_youtube_api_key')
-@patch('src.lambda_func.app_lambda.build')
+@patch('src.lambda_func.app_lambda.build_youtube_service')
 @patch('src.lambda_func.app_lambda.boto3.client')
-@patch('src.lambda_func.app_lambda.pd.DataFrame')
 def test_lambda_handler_success(
-    mock_df,
     mock_boto_client,
     mock_build,
     mock_get_api_key,
@@ -83,11 +93,8 @@ def test_lambda_handler_success(
     ]
     mock_get_video.return_value = video_data
 
-    mock_get_comments.return_value = [{"comment_id": "c1"}]
+    mock_get_comments.side_effect = lambda youtube, video_id, **kwargs: iter([{"comment_id": "c1"}])
 
-    mock_df_instance = MagicMock()
-    mock_df.return_value = mock_df_instance
-    
     mock_s3_client = MagicMock()
     mock_events_client = MagicMock()
     def boto_client_side_effect(service_name, **kwargs):
@@ -111,9 +118,13 @@ def test_lambda_handler_success(
     response = lambda_handler(TEST_EVENT, mock_context)
 
     mock_get_api_key.assert_called_once_with(os.environ["YOUTUBE_API_KEY_ARN"])
-    mock_build.assert_called_once_with("youtube", "v3", developerKey="DUMMY_API_KEY")
-    mock_get_channel.assert_called_once_with(mock_youtube_client, TEST_EVENT["CHANNEL_ID"])
-    mock_get_video.assert_called_once_with(mock_youtube_client, TEST_EVENT["CHANNEL_ID"])
+    mock_build.assert_called_once_with("DUMMY_API_KEY")
+    # YouTubeサービスはクォータ計上用のラッパー越しに渡される
+    mock_get_channel.assert_called_once()
+    youtube_arg, channel_id_arg = mock_get_channel.call_args[0]
+    assert youtube_arg.service is mock_youtube_client
+    assert channel_id_arg == TEST_EVENT["CHANNEL_ID"]
+    mock_get_video.assert_called_once_with(youtube_arg, TEST_EVENT["CHANNEL_ID"], batcher=ANY)
     
     mock_boto_client.assert_any_call("s3", region_name=os.environ["REGION_NAME"])
     
@@ -125,4 +136,1125 @@ def test_lambda_handler_success(
     assert put_events_args["Source"] == "my-scraper"
     assert put_events_args["DetailType"] == "ScrapingCompleted"
     assert put_events_args["EventBusName"] == "youtube-pipeline-event-bus"
-    assert response["statusCode"] == 200
\ No newline at end of file
+    assert response["statusCode"] == 200
+
+# コメント並列取得のテスト(N本の動画がおよそN/workers往復分の時間で完了すること)
+def test_get_comments_for_videos_concurrent():
+    ROUND_TRIP = 0.2
+    WORKERS = 4
+    video_ids = [f"v{i}" for i in range(12)]
+
+    def comment_threads_list(**kwargs):
+        video_id = kwargs["videoId"]
+        request = MagicMock()
+
+        def execute(**_):
+            time.sleep(ROUND_TRIP)
+            if video_id == "v3":
+                raise RuntimeError("commentsDisabled")
+            return {
+                "items": [
+                    {
+                        "id": f"{video_id}_c1",
+                        "snippet": {
+                            "topLevelComment": {
+                                "snippet": {
+                                    "authorDisplayName": "user",
+                                    "publishedAt": "2024-01-01T00:00:00Z",
+                                    "textDisplay": "hello",
+                                    "likeCount": 1,
+                                }
+                            }
+                        },
+                    }
+                ]
+            }
+
+        request.execute.side_effect = execute
+        return request
+
+    mock_youtube_client = MagicMock()
+    mock_youtube_client.commentThreads.return_value.list.side_effect = comment_threads_list
+
+    started = time.monotonic()
+    result = get_comments_for_videos(
+        mock_youtube_client,
+        video_ids,
+        max_comments_per_video=10,
+        max_workers=WORKERS,
+        requests_per_second=0,
+    )
+    elapsed = time.monotonic() - started
+
+    expected_round_trips = len(video_ids) / WORKERS
+    assert elapsed < ROUND_TRIP * expected_round_trips * 1.5
+    assert elapsed >= ROUND_TRIP * expected_round_trips * 0.9
+
+    # 取得順は入力順を維持し、1ページ目で失敗した動画のコメントは出力されない
+    assert [c["video_id"] for c in result] == [v for v in video_ids if v != "v3"]
+
+
+# テスト用のコメントAPIモック(commentThreads・comments をページ単位で返す)
+# スレッドごとの返信は inline_replies 件までcommentThreadsに含め、残りは comments().list で返す
+def make_fake_comment_youtube(threads_per_video, replies_per_thread=0, inline_replies=5):
+    calls = []
+
+    def comment_snippet(number):
+        return {
+            "authorDisplayName": f"user{number}",
+            "publishedAt": "2024-01-01T00:00:00Z",
+            "textDisplay": f"comment {number}",
+            "likeCount": number,
+        }
+
+    def replies(thread_id):
+        return [
+            {"id": f"{thread_id}.r{n}", "snippet": comment_snippet(n)} for n in range(replies_per_thread)
+        ]
+
+    def paginate(items, maxResults, pageToken):
+        start = int(pageToken or 0)
+        end = min(start + maxResults, len(items))
+        response = {"items": items[start:end]}
+        if end < len(items):
+            response["nextPageToken"] = str(end)
+        return response
+
+    def comment_threads_list(part, videoId, maxResults=20, pageToken=None, **kwargs):
+        calls.append(("commentThreads.list", videoId, maxResults))
+        threads = []
+        for n in range(threads_per_video):
+            thread_id = f"{videoId}_t{n}"
+            thread = {
+                "id": thread_id,
+                "snippet": {"topLevelComment": {"snippet": comment_snippet(n)}, "totalReplyCount": replies_per_thread},
+            }
+            if "replies" in part and replies_per_thread:
+                thread["replies"] = {"comments": replies(thread_id)[:inline_replies]}
+            threads.append(thread)
+        request = MagicMock()
+        request.execute.return_value = paginate(threads, maxResults, pageToken)
+        return request
+
+    def comments_list(part, parentId, maxResults=20, pageToken=None, **kwargs):
+        calls.append(("comments.list", parentId, maxResults))
+        request = MagicMock()
+        request.execute.return_value = paginate(replies(parentId), maxResults, pageToken)
+        return request
+
+    youtube = MagicMock()
+    youtube.commentThreads.return_value.list.side_effect = comment_threads_list
+    youtube.comments.return_value.list.side_effect = comments_list
+    return youtube, calls
+
+
+# コメントのページング: nextPageTokenを辿り、動画ごとの上限で以降のAPI呼び出しを打ち切ること
+def test_iter_comments_for_video_paginates_up_to_cap():
+    youtube, calls = make_fake_comment_youtube(threads_per_video=250)
+
+    comments = list(iter_comments_for_video(youtube, "v1", max_comments_per_video=230))
+
+    assert [c["comment_id"] for c in comments] == [f"v1_t{n}" for n in range(230)]
+    assert calls == [
+        ("commentThreads.list", "v1", 100),
+        ("commentThreads.list", "v1", 100),
+        ("commentThreads.list", "v1", 30),
+    ]
+
+    # 上限なし(0)の場合は最後のページまで取得する
+    youtube, calls = make_fake_comment_youtube(threads_per_video=250)
+    assert len(list(iter_comments_for_video(youtube, "v1", max_comments_per_video=0))) == 250
+    assert len(calls) == 3
+
+
+# 返信: commentThreadsに含まれない返信は comments().list で取得し、スレッドの直後に出力すること
+def test_iter_comments_for_video_includes_replies():
+    youtube, calls = make_fake_comment_youtube(threads_per_video=2, replies_per_thread=7, inline_replies=5)
+
+    comments = list(iter_comments_for_video(youtube, "v1", max_comments_per_video=0, include_replies=True))
+
+    assert [c["comment_id"] for c in comments] == [
+        comment_id
+        for n in range(2)
+        for comment_id in [f"v1_t{n}"] + [f"v1_t{n}.r{r}" for r in range(7)]
+    ]
+    assert all(c["video_id"] == "v1" for c in comments)
+    assert [call[0] for call in calls] == ["commentThreads.list", "comments.list", "comments.list"]
+
+    # 返信がすべてcommentThreadsに含まれる場合は追加の呼び出しを行わない
+    youtube, calls = make_fake_comment_youtube(threads_per_video=2, replies_per_thread=3, inline_replies=5)
+    assert len(list(iter_comments_for_video(youtube, "v1", include_replies=True))) == 8
+    assert [call[0] for call in calls] == ["commentThreads.list"]
+
+
+# 実行全体の上限: 複数動画(複数チャンネル)で共有し、上限に達した時点で取得を打ち切ること
+def test_comment_budget_caps_run_total():
+    youtube, _ = make_fake_comment_youtube(threads_per_video=30)
+    budget = CommentBudget(50)
+
+    first = list(
+        iter_comments_for_videos(
+            youtube, ["v1", "v2"], max_comments_per_video=20, requests_per_second=0, comment_budget=budget
+        )
+    )
+    second = list(
+        iter_comments_for_videos(
+            youtube, ["v3", "v4"], max_comments_per_video=20, requests_per_second=0, comment_budget=budget
+        )
+    )
+
+    assert len(first) == 40
+    assert [c["video_id"] for c in first] == ["v1"] * 20 + ["v2"] * 20
+    assert len(second) == 10
+    assert budget.used == 50
+
+    # 0以下は無制限
+    assert CommentBudget(0).acquire()
+
+
+# 出力を途中で止めた場合も取得スレッドが終了し、保持するページ数が有界であること
+def test_iter_comments_for_videos_stops_workers_on_close():
+    youtube, calls = make_fake_comment_youtube(threads_per_video=1000)
+
+    comments = iter_comments_for_videos(
+        youtube, [f"v{i}" for i in range(4)], max_comments_per_video=0, max_workers=4,
+        requests_per_second=0, queue_size=1,
+    )
+    assert next(comments)["comment_id"] == "v0_t0"
+    comments.close()
+
+    # 取得済みで未出力のページは動画ごとにキュー1件 + 書き込み待ちの1件まで
+    assert len(calls) <= 4 * 3
+
+
+# 途中のページで失敗した動画は取得済みのコメントを残し、以降のコメントだけをスキップすること
+def test_comments_keep_partial_pages_on_failure():
+    youtube, calls = make_fake_comment_youtube(threads_per_video=250)
+    list_threads = youtube.commentThreads.return_value.list.side_effect
+
+    def comment_threads_list(**kwargs):
+        request = list_threads(**kwargs)
+        if kwargs["videoId"] == "v1" and kwargs.get("pageToken"):
+            request.execute.side_effect = RuntimeError("backendError")
+        return request
+
+    youtube.commentThreads.return_value.list.side_effect = comment_threads_list
+
+    partial = get_comments_for_video(youtube, "v1", max_comments_per_video=0)
+    assert [c["comment_id"] for c in partial] == [f"v1_t{n}" for n in range(100)]
+
+    comments = get_comments_for_videos(
+        youtube, ["v0", "v1", "v2"], max_comments_per_video=0, max_workers=3, requests_per_second=0
+    )
+    counts = {}
+    for comment in comments:
+        counts[comment["video_id"]] = counts.get(comment["video_id"], 0) + 1
+    assert counts == {"v0": 250, "v1": 100, "v2": 250}
+
+
+# テスト用のYouTube APIモック(アップロード動画のプレイリストを新しい順にページ単位で返す)
+FAKE_LATEST_PUBLISHED_AT = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+def make_fake_youtube(video_count, page_size=50, latency=0.0):
+    videos = [
+        {
+            "id": f"vid{i:05d}",
+            "snippet": {
+                "title": f"動画{i}",
+                "publishedAt": (FAKE_LATEST_PUBLISHED_AT - timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "tags": ["tag"],
+            },
+            "statistics": {"viewCount": str(i * 10), "likeCount": "1", "commentCount": "2"},
+            "contentDetails": {"duration": "PT3M20S"},
+        }
+        for i in range(video_count)
+    ]
+    videos_by_id = {v["id"]: v for v in videos}
+
+    def request(response_factory):
+        req = MagicMock()
+
+        def execute(**_):
+            if latency:
+                time.sleep(latency)
+            return response_factory()
+
+        req.execute.side_effect = execute
+        return req
+
+    def playlist_items_list(**kwargs):
+        start = int(kwargs.get("pageToken") or 0)
+        page = videos[start:start + page_size]
+
+        def response():
+            body = {
+                "items": [
+                    {"contentDetails": {"videoId": v["id"], "videoPublishedAt": v["snippet"]["publishedAt"]}}
+                    for v in page
+                ]
+            }
+            if start + page_size < len(videos):
+                body["nextPageToken"] = str(start + page_size)
+            return body
+
+        return request(response)
+
+    def videos_list(**kwargs):
+        ids = kwargs["id"].split(",")
+        return request(lambda: {"items": [videos_by_id[i] for i in ids]})
+
+    youtube = MagicMock()
+    youtube.channels.return_value.list.side_effect = lambda **kwargs: request(
+        lambda: {"items": [{"contentDetails": {"relatedPlaylists": {"uploads": "UU_TEST"}}}]}
+    )
+    youtube.playlistItems.return_value.list.side_effect = playlist_items_list
+    youtube.videos.return_value.list.side_effect = videos_list
+    return youtube
+
+
+# パイプライン実行のget_videoが逐次実行と同じ結果を返すこと
+def test_get_video_pipelined_matches_sequential():
+    mock_youtube_client = make_fake_youtube(video_count=237, latency=0.01)
+
+    sequential = get_video(mock_youtube_client, "UC_TEST", max_workers=1)
+    pipelined = get_video(mock_youtube_client, "UC_TEST", max_workers=3, queue_size=2)
+
+    assert len(sequential) == 237
+    assert pipelined == sequential
+    assert sequential[1]["view_count"] == 10
+    assert sequential[1]["duration"] == "PT3M20S"
+
+
+# 差分取得: ウォーターマークより古い動画に到達したらページングを打ち切ること
+def test_get_video_incremental_stops_at_cutoff():
+    mock_youtube_client = make_fake_youtube(video_count=500)
+    published_after = FAKE_LATEST_PUBLISHED_AT - timedelta(hours=60)
+
+    for workers in (1, 3):
+        mock_youtube_client.playlistItems.return_value.list.reset_mock()
+        result = get_video(mock_youtube_client, "UC_TEST", max_workers=workers, published_after=published_after)
+
+        assert [v["video_id"] for v in result] == [f"vid{i:05d}" for i in range(61)]
+        # 500件すべて(10ページ)ではなく2ページ目で打ち切る
+        assert mock_youtube_client.playlistItems.return_value.list.call_count == 2
+
+
+# ウォーターマークの保存・読み込みと打ち切り時刻の計算
+@mock_aws
+def test_watermark_roundtrip_and_cutoff():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="watermark-bucket")
+
+    assert load_watermark(s3, "watermark-bucket", "UC_TEST") is None
+
+    videos = [
+        {"video_id": "old", "published_at": "2024-05-01T00:00:00Z"},
+        {"video_id": "new", "published_at": "2024-05-20T00:00:00Z"},
+    ]
+    watermark = build_watermark(None, videos, 7, "wf-1")
+    save_watermark(s3, "watermark-bucket", "UC_TEST", watermark)
+
+    loaded = load_watermark(s3, "watermark-bucket", "UC_TEST")
+    assert loaded["latest_video_id"] == "new"
+
+    # 統計再取得期間がウォーターマークより前に及ぶ場合は期間の開始が打ち切り時刻になる
+    now = datetime(2024, 5, 22, tzinfo=timezone.utc)
+    assert incremental_cutoff(loaded, 7, now=now) == datetime(2024, 5, 15, tzinfo=timezone.utc)
+    assert incremental_cutoff(loaded, 1, now=now) == datetime(2024, 5, 20, tzinfo=timezone.utc)
+    assert incremental_cutoff(None, 7, now=now) is None
+
+
+# NDJSONストリーミング書き込み: 5MiBを超えるとマルチパートアップロードになること
+@mock_aws
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_ndjson_writer_multipart_upload(compression):
+    import gzip
+
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="raw-bucket")
+
+    records = [
+        {"video_id": f"vid{i:06d}", "title": "テスト動画" + "x" * 200, "view_count": i}
+        for i in range(40000)
+    ]
+
+    writer = open_ndjson_writer(s3, "raw-bucket", "raw/data_video.json", compression=compression)
+    with writer:
+        writer.write_all(iter(records))
+
+    assert writer.record_count == len(records)
+    # gzipなしの場合は約9MBとなり2パートに分割される
+    if compression is None:
+        assert len(writer.upload._parts) == 2
+
+    body = s3.get_object(Bucket="raw-bucket", Key="raw/data_video.json")["Body"].read()
+    if compression == "gzip":
+        body = gzip.decompress(body)
+
+    lines = body.decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == records
+
+
+# 書き込み途中で例外が発生した場合はマルチパートアップロードを中断すること
+@mock_aws
+def test_ndjson_writer_aborts_on_error():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="raw-bucket")
+
+    def records():
+        for i in range(40000):
+            yield {"video_id": f"vid{i:06d}", "title": "x" * 200}
+        raise RuntimeError("YouTube API error")
+
+    with pytest.raises(RuntimeError):
+        with open_ndjson_writer(s3, "raw-bucket", "raw/data_video.json") as writer:
+            writer.write_all(records())
+
+    assert "Contents" not in s3.list_objects_v2(Bucket="raw-bucket")
+    assert "Uploads" not in s3.list_multipart_uploads(Bucket="raw-bucket")
+
+
+# Parquet形式の生データはGlueのスキーマと同じ列・型で書き込まれ、欠損値はエラーになること
+@mock_aws
+def test_parquet_raw_writer_matches_glue_schema():
+    import io
+    import pyarrow.parquet as pq
+
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="raw-bucket")
+
+    key = raw_object_key("raw", "video", raw_format="parquet")
+    assert key == "raw/data_video.parquet"
+
+    records = [
+        {
+            "video_id": f"vid{i:06d}",
+            "title": "テスト動画",
+            "published_at": "2024-01-01T00:00:00Z",
+            "view_count": i,
+            "like_count": 1,
+            "comment_count": 2,
+            "duration": "PT3M",
+            "tags": "a,b",
+        }
+        for i in range(1000)
+    ]
+    with open_raw_writer(s3, "raw-bucket", key, "video", raw_format="parquet") as writer:
+        writer.write_all(iter(records))
+
+    body = s3.get_object(Bucket="raw-bucket", Key=key)["Body"].read()
+    table = pq.read_table(io.BytesIO(body))
+    assert table.column_names == list(records[0].keys())
+    assert str(table.schema.field("view_count").type) == "int64"
+    assert table.to_pylist() == records
+
+    # 必須の列が欠けている場合はアップロードせずに中断する
+    with pytest.raises(ValueError):
+        with open_raw_writer(s3, "raw-bucket", "raw/data_comment.parquet", "comment", raw_format="parquet") as writer:
+            writer.write({"video_id": "vid", "comment_id": "c1"})
+
+    assert [obj["Key"] for obj in s3.list_objects_v2(Bucket="raw-bucket")["Contents"]] == [key]
+
+
+# パートファイルへの分割書き込み: 件数の上限ごとに次のパートへ切り替え、0件でも空のパートを出力すること
+@mock_aws
+def test_rolling_raw_writer_rolls_parts():
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="raw-bucket")
+
+    prefix = raw_part_prefix("raw", "comment")
+    assert prefix == "raw/data_comment/"
+
+    records = [{"video_id": "v1", "comment_id": f"c{i}"} for i in range(25)]
+    with RollingRawWriter(s3, "raw-bucket", prefix, "comment", max_records=10) as writer:
+        writer.write_all(iter(records))
+
+    assert writer.record_count == 25
+    assert writer.part_keys == [
+        "raw/data_comment/part-00000.json",
+        "raw/data_comment/part-00001.json",
+        "raw/data_comment/part-00002.json",
+    ]
+    assert writer.bytes_written == sum(
+        s3.head_object(Bucket="raw-bucket", Key=key)["ContentLength"] for key in writer.part_keys
+    )
+    written = []
+    for key in writer.part_keys:
+        body = s3.get_object(Bucket="raw-bucket", Key=key)["Body"].read().decode("utf-8")
+        written.extend(json.loads(line) for line in body.splitlines())
+    assert written == records
+
+    # 件数がちょうど上限の倍数でも末尾に空のパートを作らない
+    with RollingRawWriter(s3, "raw-bucket", "raw20/", "comment", max_records=10) as writer:
+        writer.write_all(iter(records[:20]))
+    assert len(writer.part_keys) == 2
+
+    with RollingRawWriter(s3, "raw-bucket", "empty/", "comment", compression="gzip") as writer:
+        writer.write_all(iter([]))
+    assert writer.part_keys == ["empty/part-00000.json.gz"]
+    assert s3.head_object(Bucket="raw-bucket", Key="empty/part-00000.json.gz")["ContentLength"] > 0
+
+
+# YouTubeサービスは同梱のディスカバリードキュメントから1回だけ生成され、再利用されること
+def test_get_youtube_service_is_reused():
+    youtube = get_youtube_service("DUMMY_API_KEY")
+
+    assert get_youtube_service("DUMMY_API_KEY") is youtube
+    request = youtube.channels().list(part="snippet", id="UC_TEST")
+    assert "key=DUMMY_API_KEY" in request.uri
+
+    # APIキーが変わった場合は作り直す
+    assert get_youtube_service("ROTATED_API_KEY") is not youtube
+
+
+# 複数のチャンネルのスレッドが同時にキーを再取得しても、サービスは1つだけ生成されること
+@patch('src.lambda_func.app_lambda.build_youtube_service')
+def test_get_youtube_service_is_thread_safe(mock_build):
+    def build(api_key):
+        time.sleep(0.01)
+        return MagicMock(name=api_key)
+
+    mock_build.side_effect = build
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        services = list(executor.map(get_youtube_service, ["ROTATED_API_KEY"] * 16))
+
+    assert mock_build.call_count == 1
+    assert all(service is services[0] for service in services)
+
+
+# シークレットはTTL内ならキャッシュから返し、強制更新時は再取得すること
+@patch('src.lambda_func.app_lambda.boto3.client')
+def test_get_youtube_api_key_is_cached(mock_boto_client):
+    mock_secretsmanager_client = mock_boto_client.return_value
+    mock_secretsmanager_client.get_secret_value.return_value = {
+        'SecretString': json.dumps({"API_KEY": "cached_key"})
+    }
+
+    assert get_youtube_api_key("dummy_arn") == "cached_key"
+    assert get_youtube_api_key("dummy_arn") == "cached_key"
+    assert mock_secretsmanager_client.get_secret_value.call_count == 1
+    # Secrets Managerのクライアントも1回だけ生成される
+    assert mock_boto_client.call_count == 1
+
+    get_youtube_api_key("dummy_arn", force_refresh=True)
+    assert mock_secretsmanager_client.get_secret_value.call_count == 2
+
+
+def test_secret_cache_expires_after_ttl():
+    loader = MagicMock(side_effect=["key-1", "key-2"])
+    cache = SecretCache(ttl_seconds=0.05)
+
+    assert cache.get("arn", loader) == "key-1"
+    assert cache.get("arn", loader) == "key-1"
+    time.sleep(0.06)
+    assert cache.get("arn", loader) == "key-2"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+# APIキーの無効エラーのみ再取得の対象とし、クォータ超過は対象外とすること
+def test_is_api_key_error():
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    key_invalid = HttpError(
+        httplib2.Response({"status": 400}),
+        b'{"error": {"errors": [{"reason": "keyInvalid"}], "message": "API key not valid."}}',
+    )
+    quota_exceeded = HttpError(
+        httplib2.Response({"status": 403}),
+        b'{"error": {"errors": [{"reason": "quotaExceeded"}]}}',
+    )
+
+    assert is_api_key_error(key_invalid)
+    assert not is_api_key_error(quota_exceeded)
+    assert not is_api_key_error(RuntimeError("keyInvalid"))
+
+
+# 複数チャンネルの一括処理: 失敗したチャンネルを切り離し、完了イベントを10件ずつまとめて送信すること
+@patch('src.lambda_func.app_lambda.iter_comments_for_video')
+@patch('src.lambda_func.app_lambda.iter_videos')
+@patch('src.lambda_func.app_lambda.get_channel')
+@patch('src.lambda_func.app_lambda.get_youtube_api_key')
+@patch('src.lambda_func.app_lambda.build_youtube_service')
+@patch('src.lambda_func.app_lambda.boto3.client')
+def test_lambda_handler_multi_channel_fan_out(
+    mock_boto_client,
+    mock_build,
+    mock_get_api_key,
+    mock_get_channel,
+    mock_iter_videos,
+    mock_get_comments,
+):
+    mock_get_api_key.return_value = "DUMMY_API_KEY"
+
+    def get_channel_side_effect(youtube, channel_id):
+        if channel_id == "UC_BAD":
+            raise RuntimeError("channelNotFound")
+        return [{"channel_id": channel_id}]
+
+    mock_get_channel.side_effect = get_channel_side_effect
+    mock_iter_videos.side_effect = lambda youtube, channel_id, **kwargs: iter(
+        [{"video_id": f"{channel_id}_v1", "view_count": 1}]
+    )
+    mock_get_comments.side_effect = lambda youtube, video_id, **kwargs: iter([])
+
+    mock_s3_client = MagicMock()
+    mock_events_client = MagicMock()
+    mock_events_client.put_events.side_effect = lambda Entries: {
+        "FailedEntryCount": 0,
+        "Entries": [{"EventId": "e"} for _ in Entries],
+    }
+    mock_boto_client.side_effect = lambda service_name, **kwargs: {
+        "s3": mock_s3_client,
+        "events": mock_events_client,
+    }.get(service_name, MagicMock())
+
+    channel_ids = [f"UC_{i:02d}" for i in range(11)] + ["UC_BAD"]
+    TEST_EVENT = {
+        "CHANNELS": [
+            {"CHANNEL_ID": channel_id, "ARTIST_NAME_SLUG": channel_id.lower()}
+            for channel_id in channel_ids
+        ],
+        "POWERTOOLS_SERVICE_NAME": "youtube-scraper",
+    }
+    mock_context = MagicMock()
+    mock_context.aws_request_id = "test-execution-id"
+
+    response = lambda_handler(TEST_EVENT, mock_context)
+
+    # シークレット取得とサービス生成は1回だけ
+    mock_get_api_key.assert_called_once()
+    mock_build.assert_called_once()
+
+    # 11チャンネル分のイベントを10件 + 1件に分けて送信する
+    sent_batches = [call[1]["Entries"] for call in mock_events_client.put_events.call_args_list]
+    assert [len(batch) for batch in sent_batches] == [10, 1]
+    sent_details = [json.loads(entry["Detail"]) for batch in sent_batches for entry in batch]
+    assert [detail["artist_name_slug"] for detail in sent_details] == [c.lower() for c in channel_ids[:11]]
+    assert sent_details[0]["input_keys"][0] == (
+        "s3://dummy-bucket-for-test/channel=UC_00/workflow=test-execution-id/raw_data/data_channel.json"
+    )
+    # コメントはパートファイルを格納したプレフィックスを渡す
+    assert sent_details[0]["input_keys"][2] == (
+        "s3://dummy-bucket-for-test/channel=UC_00/workflow=test-execution-id/raw_data/data_comment/"
+    )
+
+    # クォータの使用量(チャンネル単位と実行全体)がイベントに含まれる
+    assert sent_details[0]["quota_usage"]["run"]["budget"] == 10000
+    assert "channel" in sent_details[0]["quota_usage"]
+
+    assert response["statusCode"] == 207
+    assert response["succeeded_channels"] == channel_ids[:11]
+    assert [f["channel_id"] for f in response["failed_channels"]] == ["UC_BAD"]
+
+
+# クォータ計上: エンドポイントごとの消費ユニット数を実行全体とチャンネル単位で集計すること
+def test_metered_youtube_counts_quota_units():
+    budget = QuotaBudget(10000)
+    youtube = MeteredYouTube(make_fake_youtube(video_count=237), budget)
+
+    get_video(youtube, "UC_TEST", max_workers=3)
+
+    # channels 1回 + playlistItems 5ページ + videos 5バッチ
+    assert budget.snapshot()["units_by_endpoint"] == {
+        "channels.list": 1,
+        "playlistItems.list": 5,
+        "videos.list": 5,
+    }
+    assert youtube.usage_snapshot()["used"] == 11
+
+
+# 予算が逼迫した場合はコメント(任意の取得)から打ち切り、必須の取得は予算の上限まで続けること
+def test_quota_budget_cuts_optional_work_first():
+    budget = QuotaBudget(12, reserve=10)
+    youtube = MeteredYouTube(MagicMock(), budget)
+
+    comments = get_comments_for_videos(youtube, ["v1", "v2", "v3"], requests_per_second=0)
+
+    assert comments == []
+    assert budget.snapshot()["units_by_endpoint"] == {"commentThreads.list": 2}
+    assert budget.optional_allowance() == 0
+
+    for _ in range(10):
+        youtube.videos().list(id="v1").execute()
+    with pytest.raises(QuotaBudgetExceeded):
+        youtube.videos().list(id="v1").execute()
+
+
+# 並列処理するチャンネルは任意の予算を等分して確保し、確保した分を超えてコメントを取得しないこと
+def test_quota_budget_splits_optional_allowance_across_channels():
+    budget = QuotaBudget(100, reserve=10)
+    budget.expect_claims(["UC_A", "UC_B", "UC_C"])
+
+    first = budget.claim_optional("UC_A")
+    assert first.units == 30
+    budget.withdraw_claim("UC_C")  # 確保する前に失敗したチャンネル
+    budget.charge("videos.list")
+    second = budget.claim_optional("UC_B")
+    assert second.units == 59
+    assert budget.optional_allowance() == 0
+
+    youtube = MeteredYouTube(MagicMock(), budget, reservation=first)
+    for _ in range(30):
+        youtube.commentThreads().list(videoId="v1").execute()
+    with pytest.raises(QuotaBudgetExceeded):
+        youtube.commentThreads().list(videoId="v1").execute()
+    # 確保していない任意の取得は、他のチャンネルが確保した分を使わない
+    with pytest.raises(QuotaBudgetExceeded):
+        MeteredYouTube(MagicMock(), budget).commentThreads().list(videoId="v1").execute()
+
+    second.release(9)
+    assert budget.optional_allowance() == 9
+    second.release()
+    assert budget.snapshot()["reserved"] == 0
+    assert budget.optional_allowance() == 59
+
+
+# クォータが不足する場合は、動画を減らす前に1動画あたりの件数・返信を減らすこと
+def test_plan_comment_fetch_trims_depth_before_coverage():
+    video_ids = [f"v{i}" for i in range(10)]
+
+    assert estimate_comment_units(250, False) == 3
+    assert estimate_comment_units(250, True) == 253
+    assert estimate_comment_units(0, True) is None
+
+    # 十分な予算があれば変更しない
+    assert plan_comment_fetch(video_ids, 3000, 250, True) == (video_ids, 250, True)
+    # 返信を含めたまま件数を減らす(50件 + 1ページ = 51ユニット以内)
+    assert plan_comment_fetch(video_ids, 510, 250, True) == (video_ids, 50, True)
+    # 返信を取得する余裕がなければ返信をやめる(1ページ = 100件)
+    assert plan_comment_fetch(video_ids, 15, 250, True) == (video_ids, 100, False)
+    # 上限なしは予算を動画数で割った範囲に収める
+    assert plan_comment_fetch(video_ids, 25, 0, False) == (video_ids, 200, False)
+    # 1動画あたり1ユニットも確保できない場合のみ動画を減らす
+    assert plan_comment_fetch(video_ids, 4, 250, True) == (video_ids[:4], 100, False)
+    assert plan_comment_fetch(video_ids, 0, 10, False) == ([], 10, False)
+
+
+# ETagキャッシュ: 2回目は If-None-Match を送り、304 の場合は保存済みのレスポンスを返すこと
+# (APIキーが変わっても同じキャッシュを使い、クォータは304でも計上する)
+@mock_aws
+def test_response_cache_serves_not_modified_from_s3():
+    from googleapiclient.http import HttpMockSequence
+
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="cache-bucket")
+    cache = ResponseCache(S3CacheStore(s3, "cache-bucket"))
+    budget = QuotaBudget(100)
+
+    payload = {"etag": "etag-v1", "items": [{"id": "UC_TEST"}]}
+    http = HttpMockSequence(
+        [
+            ({"status": "200"}, json.dumps(payload)),
+            ({"status": "304"}, ""),
+            ({"status": "200"}, json.dumps({"items": []})),
+        ]
+    )
+
+    youtube = MeteredYouTube(get_youtube_service("KEY_1"), budget, response_cache=cache)
+    assert youtube.channels().list(part="snippet", id="UC_TEST").execute(http=http) == payload
+
+    youtube = youtube.with_service(get_youtube_service("KEY_2"))
+    assert youtube.channels().list(part="snippet", id="UC_TEST").execute(http=http) == payload
+
+    # キャッシュ対象外のエンドポイントは条件付きリクエストにしない
+    youtube.playlistItems().list(part="contentDetails", playlistId="UU_TEST").execute(http=http)
+
+    headers = [request[3] for request in http.request_sequence]
+    assert "if-none-match" not in {k.lower() for k in headers[0]}
+    assert {k.lower(): v for k, v in headers[1].items()}["if-none-match"] == "etag-v1"
+    assert "if-none-match" not in {k.lower() for k in headers[2]}
+    assert "KEY_1" not in json.dumps(s3.list_objects_v2(Bucket="cache-bucket")["Contents"], default=str)
+
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["stored"] == 1
+    assert budget.used == 3
+
+
+# キャッシュの退避: 期限切れのエントリと、合計サイズの上限を超える古いエントリを削除すること
+def test_response_cache_eviction(tmp_path):
+    store = LocalCacheStore(str(tmp_path))
+    cache = ResponseCache(store, max_age_seconds=3600, max_total_bytes=2500)
+    now = time.time()
+
+    for i, age in enumerate([7200, 1800, 1200, 600]):
+        store.put(f"entry{i}", b"x" * 1000)
+        os.utime(tmp_path / f"entry{i}.json", (now - age, now - age))
+
+    result = cache.evict(now=now)
+
+    assert sorted(key for key, _, _ in store.entries()) == ["entry2", "entry3"]
+    assert result == {"evicted": 2, "remaining_entries": 2, "remaining_bytes": 2000}
+
+
+# バッチリクエストのモック(追加されたサブリクエストを1回の execute でまとめて実行する)
+class FakeBatch:
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback, request_id))
+
+    def execute(self, http=None):
+        self.sizes.append(len(self.requests))
+        time.sleep(0.05)
+        for request, callback, request_id in self.requests:
+            try:
+                response = request.execute()
+            except Exception as e:
+                callback(request_id, None, e)
+            else:
+                callback(request_id, response, None)
+
+
+# バッチ実行: 同時に発行された呼び出しをまとめて送信し、結果・エラーをそれぞれの呼び出し元へ返すこと
+# (失敗した動画は以降のコメントだけをスキップし、クォータはサブリクエストごとに計上する)
+def test_batch_executor_routes_results_to_callers():
+    youtube, calls = make_fake_comment_youtube(threads_per_video=3)
+    list_threads = youtube.commentThreads.return_value.list.side_effect
+
+    def comment_threads_list(**kwargs):
+        request = list_threads(**kwargs)
+        if kwargs["videoId"] == "v3":
+            request.execute.side_effect = RuntimeError("commentsDisabled")
+        return request
+
+    youtube.commentThreads.return_value.list.side_effect = comment_threads_list
+    sizes = []
+    youtube.new_batch_http_request.side_effect = lambda: FakeBatch(sizes)
+    budget = QuotaBudget(10000)
+    video_ids = [f"v{i}" for i in range(12)]
+
+    with BatchExecutor(youtube, max_batch_size=5, max_wait=0.2) as batcher:
+        comments = get_comments_for_videos(
+            MeteredYouTube(youtube, budget), video_ids, max_workers=12, requests_per_second=0, batcher=batcher
+        )
+        stats = batcher.stats()
+
+    assert [c["video_id"] for c in comments] == [v for v in video_ids if v != "v3" for _ in range(3)]
+    assert sizes == [5, 5, 2]
+    assert stats["batches"] == 3
+    assert stats["requests"] == 12
+    assert budget.snapshot()["units_by_endpoint"] == {"commentThreads.list": 12}
+
+
+# 予算を超えるサブリクエストはその呼び出しだけを失敗させ、終了後の呼び出しは個別に実行すること
+def test_batch_executor_quota_and_close():
+    youtube, _ = make_fake_comment_youtube(threads_per_video=1)
+    sizes = []
+    youtube.new_batch_http_request.side_effect = lambda: FakeBatch(sizes)
+    metered = MeteredYouTube(youtube, QuotaBudget(1))
+    batcher = BatchExecutor(youtube, max_batch_size=2, max_wait=0.5)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(batcher.execute, metered.commentThreads().list(part="snippet", videoId=video_id))
+            for video_id in ["v1", "v2"]
+        ]
+    outcomes = sorted("ok" if f.exception() is None else type(f.exception()).__name__ for f in futures)
+    assert outcomes == ["QuotaBudgetExceeded", "ok"]
+    assert sizes == [1]
+
+    batcher.close()
+    request = youtube.commentThreads().list(part="snippet", videoId="v9")
+    assert batcher.execute(request)["items"][0]["id"] == "v9_t0"
+    assert sizes == [1]
+
+
+# キャッシュの準備・保存は呼び出し元のスレッドで行い、流量制限はサブリクエストの件数分の枠を確保すること
+def test_batch_executor_prepares_on_callers_and_limits_per_request():
+    class ThreadRecordingRequest:
+        def __init__(self, video_id):
+            self.video_id = video_id
+            self.threads = []
+
+        def prepare_batch(self):
+            self.threads.append(threading.current_thread().name)
+            request = MagicMock()
+            request.execute.return_value = {"id": self.video_id}
+            return request, self.finish
+
+        def finish(self, response, error):
+            self.threads.append(threading.current_thread().name)
+            return response
+
+    sizes = []
+    youtube = MagicMock()
+    youtube.new_batch_http_request.side_effect = lambda: FakeBatch(sizes)
+    rate_limiter = MagicMock()
+    requests = [ThreadRecordingRequest(f"v{i}") for i in range(7)]
+
+    with BatchExecutor(youtube, max_batch_size=5, max_wait=0.2, rate_limiter=rate_limiter) as batcher:
+        with ThreadPoolExecutor(max_workers=7, thread_name_prefix="caller") as executor:
+            results = list(executor.map(batcher.execute, requests))
+
+    assert [result["id"] for result in results] == [f"v{i}" for i in range(7)]
+    assert sizes == [5, 2]
+    assert [c.args for c in rate_limiter.acquire.call_args_list] == [(5,), (2,)]
+    assert all(len(r.threads) == 2 and all(name.startswith("caller") for name in r.threads) for r in requests)
+
+
+# googleapiclientのバッチリクエスト: 1回のHTTPリクエストで送信し、ETagキャッシュ(304)もサブリクエスト単位で働くこと
+# (モックはサブリクエストの動画IDごとに応答し、If-None-Match が一致する場合は304を返す)
+class BatchHttpMock:
+    def __init__(self):
+        self.requests = []
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        import re
+        import httplib2
+
+        self.requests.append((uri, body))
+        parts = []
+        for part in body.split("Content-Type: application/http")[1:]:
+            content_id = re.search(r"Content-ID: <[^+]+\+ (\d+)>", part).group(1)
+            video_id = re.search(r"[?&]id=([^&\s]+)", part).group(1)
+            etag = f"etag-{video_id}"
+            if f"If-None-Match: {etag}" in part:
+                status, payload = "304 Not Modified", ""
+            else:
+                status = "200 OK"
+                payload = json.dumps(
+                    {
+                        "etag": etag,
+                        "items": [
+                            {
+                                "id": video_id,
+                                "snippet": {"title": video_id, "publishedAt": "2024-01-01T00:00:00Z"},
+                                "statistics": {"viewCount": "10"},
+                                "contentDetails": {"duration": "PT1M"},
+                            }
+                        ],
+                    }
+                )
+            parts.append(
+                "--batch_boundary\r\n"
+                "Content-Type: application/http\r\n"
+                "Content-Transfer-Encoding: binary\r\n"
+                f"Content-ID: <response-x + {content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nETag: {etag}\r\n\r\n{payload}\r\n"
+            )
+        response = httplib2.Response(
+            {"status": "200", "content-type": 'multipart/mixed; boundary="batch_boundary"'}
+        )
+        return response, ("".join(parts) + "--batch_boundary--").encode("utf-8")
+
+
+def test_batch_executor_with_googleapiclient(tmp_path):
+    http = BatchHttpMock()
+    service = get_youtube_service("KEY_1")
+    # videos.list は既定ではキャッシュ対象外のため、サブリクエストの条件付きリクエストを確認するために明示する
+    assert "videos.list" not in CACHED_ENDPOINTS
+    cache = ResponseCache(LocalCacheStore(str(tmp_path)), endpoints=("videos.list",))
+    budget = QuotaBudget(100)
+    youtube = MeteredYouTube(service, budget, response_cache=cache)
+
+    with patch("src.lambda_func.youtube_client.get_thread_http", return_value=http):
+        with BatchExecutor(service, max_batch_size=2, max_wait=1.0) as batcher:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                first = list(executor.map(lambda ids: get_video_batch(youtube, ids, batcher=batcher), [["a"], ["b"]]))
+            second = get_video_batch(youtube, ["a"], batcher=batcher)
+
+    assert [[v["video_id"] for v in videos] for videos in first] == [["a"], ["b"]]
+    assert second == first[0]
+    assert [uri for uri, _ in http.requests] == ["https://youtube.googleapis.com/batch"] * 2
+    assert http.requests[0][1].count("Content-Type: application/http") == 2
+    assert "If-None-Match: etag-a" in http.requests[1][1]
+    assert cache.stats()["hits"] == 1
+    assert budget.snapshot()["units_by_endpoint"] == {"videos.list": 3}
+
+
+# 処理段階ごとのメトリクスがEMF形式で出力され、ログから段階ごとの値を取り出せること
+@patch('src.lambda_func.app_lambda.iter_comments_for_video')
+@patch('src.lambda_func.app_lambda.iter_videos')
+@patch('src.lambda_func.app_lambda.get_channel')
+@patch('src.lambda_func.app_lambda.get_youtube_api_key')
+@patch('src.lambda_func.app_lambda.build_youtube_service')
+@patch('src.lambda_func.app_lambda.boto3.client')
+def test_lambda_handler_emits_stage_metrics(
+    mock_boto_client,
+    mock_build,
+    mock_get_api_key,
+    mock_get_channel,
+    mock_iter_videos,
+    mock_get_comments,
+    capsys,
+):
+    mock_get_api_key.return_value = "DUMMY_API_KEY"
+    mock_get_channel.return_value = [{"channel_id": "UC_TEST"}]
+    mock_iter_videos.side_effect = lambda youtube, channel_id, **kwargs: iter(
+        [{"video_id": f"v{i}", "view_count": i} for i in range(3)]
+    )
+    mock_get_comments.side_effect = lambda youtube, video_id, **kwargs: iter(
+        [{"video_id": video_id, "comment_id": "c1"}]
+    )
+    mock_events_client = MagicMock()
+    mock_events_client.put_events.side_effect = lambda Entries: {
+        "FailedEntryCount": 0,
+        "Entries": [{"EventId": "e"} for _ in Entries],
+    }
+    mock_boto_client.side_effect = lambda service_name, **kwargs: {
+        "events": mock_events_client,
+    }.get(service_name, MagicMock())
+
+    mock_context = MagicMock()
+    mock_context.aws_request_id = "test-execution-id"
+    lambda_handler(
+        {"CHANNEL_ID": "UC_TEST", "ARTIST_NAME_SLUG": "test_artist_slug", "POWERTOOLS_SERVICE_NAME": "youtube-scraper"},
+        mock_context,
+    )
+
+    records = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')
+    ]
+    by_stage = {record["stage"]: record for record in records}
+
+    assert list(by_stage) == [
+        "secret_fetch",
+        "channel_fetch",
+        "channel_upload",
+        "video_fetch_upload",
+        "comment_fetch_upload",
+    ]
+    for record in records:
+        directive = record["_aws"]["CloudWatchMetrics"][0]
+        assert directive["Namespace"] == "YouTubePipeline"
+        # メトリクスとして宣言した値・ディメンションがすべてレコードに含まれること
+        assert all(metric["Name"] in record for metric in directive["Metrics"])
+        assert all(name in record for name in directive["Dimensions"][0])
+        assert record["correlation_id"] == "test-execution-id"
+        # Powertools の EMF は値を配列で出力する
+        assert record["Latency"][0] >= 0
+        assert record["Errors"] == [0]
+
+    assert "artist_name_slug" not in by_stage["secret_fetch"]
+    video = by_stage["video_fetch_upload"]
+    assert video["artist_name_slug"] == "test_artist_slug"
+    assert video["service"] == "youtube-scraper"
+    assert sorted(video["_aws"]["CloudWatchMetrics"][0]["Dimensions"][0]) == ["artist_name_slug", "service", "stage"]
+    assert video["Rows"] == [3]
+    assert video["Bytes"][0] > 0
+    assert video["UploadLatency"][0] >= 0
+    assert by_stage["comment_fetch_upload"]["Rows"] == [3]
+    assert by_stage["comment_fetch_upload"]["ApiCalls"] == [0]  # iter_comments_for_videoをモック化しているため
+
+
+# イベントのフラグは文字列でも渡されるため、"false" を真として扱わないこと
+@patch('src.lambda_func.app_lambda.load_watermark')
+@patch('src.lambda_func.app_lambda.iter_comments_for_video')
+@patch('src.lambda_func.app_lambda.iter_videos')
+@patch('src.lambda_func.app_lambda.get_channel')
+@patch('src.lambda_func.app_lambda.get_youtube_api_key')
+@patch('src.lambda_func.app_lambda.build_youtube_service')
+@patch('src.lambda_func.app_lambda.boto3.client')
+def test_lambda_handler_parses_string_flags(
+    mock_boto_client,
+    mock_build,
+    mock_get_api_key,
+    mock_get_channel,
+    mock_iter_videos,
+    mock_get_comments,
+    mock_load_watermark,
+):
+    mock_get_api_key.return_value = "DUMMY_API_KEY"
+    mock_get_channel.return_value = [{"channel_id": "UC_TEST"}]
+    mock_load_watermark.return_value = {"latest_published_at": "2024-05-20T00:00:00Z"}
+    mock_iter_videos.side_effect = lambda youtube, channel_id, **kwargs: iter(
+        [{"video_id": "v1", "view_count": 1, "published_at": "2024-05-21T00:00:00Z"}]
+    )
+    mock_get_comments.side_effect = lambda youtube, video_id, **kwargs: iter([])
+    mock_events_client = MagicMock()
+    mock_events_client.put_events.side_effect = lambda Entries: {
+        "FailedEntryCount": 0,
+        "Entries": [{"EventId": "e"} for _ in Entries],
+    }
+    mock_boto_client.side_effect = lambda service_name, **kwargs: {
+        "events": mock_events_client,
+    }.get(service_name, MagicMock())
+
+    mock_context = MagicMock()
+    mock_context.aws_request_id = "test-execution-id"
+    for value, expected in [("false", False), ("TRUE", True), (True, True)]:
+        mock_iter_videos.reset_mock()
+        mock_get_comments.reset_mock()
+        lambda_handler(
+            {
+                "CHANNEL_ID": "UC_TEST",
+                "ARTIST_NAME_SLUG": "test_artist_slug",
+                "SCRAPE_MODE": "incremental",
+                "FULL_RESCAN": value,
+                "COMMENT_INCLUDE_REPLIES": value,
+            },
+            mock_context,
+        )
+
+        # FULL_RESCAN=true の場合のみウォーターマークを無視して全件取得する
+        assert ("published_after" not in mock_iter_videos.call_args.kwargs) == expected
+        assert mock_get_comments.call_args.kwargs["include_replies"] == expected
+
+
+# ウォーターマークはGlueの成功後に確定するため、Glueが失敗した実行(クリーンアップ済み)の動画は
+# 次回の差分取得の対象に残ること
+@mock_aws
+@patch('src.lambda_func.app_lambda.iter_comments_for_video')
+@patch('src.lambda_func.app_lambda.iter_videos')
+@patch('src.lambda_func.app_lambda.get_channel')
+@patch('src.lambda_func.app_lambda.get_youtube_api_key')
+@patch('src.lambda_func.app_lambda.build_youtube_service')
+def test_watermark_is_not_advanced_when_glue_fails(
+    mock_build,
+    mock_get_api_key,
+    mock_get_channel,
+    mock_iter_videos,
+    mock_get_comments,
+):
+    bucket = "dummy-bucket-for-test"
+    real_client = boto3.client
+    s3 = real_client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket=bucket)
+    previous = {"latest_video_id": "old", "latest_published_at": "2024-05-20T00:00:00Z"}
+    save_watermark(s3, bucket, "UC_TEST", previous)
+
+    mock_get_api_key.return_value = "DUMMY_API_KEY"
+    mock_get_channel.return_value = [{"channel_id": "UC_TEST"}]
+    mock_iter_videos.side_effect = lambda youtube, channel_id, **kwargs: iter(
+        [{"video_id": "new", "view_count": 1, "published_at": "2024-05-25T00:00:00Z"}]
+    )
+    mock_get_comments.side_effect = lambda youtube, video_id, **kwargs: iter([])
+    mock_events_client = MagicMock()
+    mock_events_client.put_events.side_effect = lambda Entries: {
+        "FailedEntryCount": 0,
+        "Entries": [{"EventId": "e"} for _ in Entries],
+    }
+
+    mock_context = MagicMock()
+    mock_context.aws_request_id = "wf-failed"
+    with patch(
+        'src.lambda_func.app_lambda.boto3.client',
+        side_effect=lambda service_name, **kwargs: mock_events_client
+        if service_name == "events"
+        else real_client(service_name, **kwargs),
+    ):
+        lambda_handler(
+            {"CHANNEL_ID": "UC_TEST", "ARTIST_NAME_SLUG": "test_artist_slug", "SCRAPE_MODE": "incremental"},
+            mock_context,
+        )
+
+    # Lambdaの時点では仮の位置に保存し、正式なウォーターマークは進めない
+    detail = json.loads(mock_events_client.put_events.call_args.kwargs["Entries"][0]["Detail"])
+    assert detail["pending_watermark_key"] == "channel=UC_TEST/workflow=wf-failed/state/watermark.json"
+    assert detail["watermark_key"] == "channel=UC_TEST/state/watermark.json"
+    assert load_watermark(s3, bucket, "UC_TEST") == previous
+
+    # Glueが失敗するとSFNはクリーンアップを呼び出し、ワークフローのディレクトリごと仮の値を削除する
+    with patch.object(clean_up_lambda, "_s3_client", s3):
+        clean_up_lambda.lambda_handler({"decoded_payload": detail}, None)
+
+    assert s3.list_objects_v2(Bucket=bucket, Prefix="channel=UC_TEST/workflow=wf-failed/")["KeyCount"] == 0
+    now = datetime(2024, 5, 26, tzinfo=timezone.utc)
+    assert incremental_cutoff(load_watermark(s3, bucket, "UC_TEST"), 1, now=now) == datetime(
+        2024, 5, 20, tzinfo=timezone.utc
+    )